@@ -170,15 +170,19 @@
 
 import logging
 import os
-from typing import Optional, Tuple, List
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple, List
 
 import cv2
 import numpy as np
-import onnxruntime as ort
-from mtcnn import MTCNN
 from werkzeug.utils import secure_filename
 
+from .ann import search_gallery
 from .config import settings
+from .detectors import build_detector
+from .metrics import DETECTOR_FALLBACKS, FACES_DETECTED, FACES_REJECTED, STAGE_SECONDS
+from .templates import prune_templates
 
 
 # ----------------- Initialization -----------------
@@ -187,15 +191,74 @@ logging.getLogger().setLevel(logging.INFO)
 if not hasattr(settings, "MODEL_PATH"):
     raise RuntimeError("settings.MODEL_PATH is required")
 
-logging.info("Loading ArcFace ONNX model: %s", settings.MODEL_PATH)
-ort_session = ort.InferenceSession(settings.MODEL_PATH)
-logging.info("ArcFace model loaded")
 
-logging.info("Initializing MTCNN detector")
-detector = MTCNN()
+class _Models:
+    """ArcFace and the detectors, built on first use (or by load_models() at startup),
+    so importing this module - and app.main - stays cheap for tooling and tests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.embedding_engine = None
+        self.detector = None
+        self.fallback_detector = None
+        self.detectors_loaded = False
+
+    @property
+    def loaded(self) -> bool:
+        return self.embedding_engine is not None and self.detectors_loaded
+
+    def load(self, detectors: bool = True) -> "_Models":
+        if self.embedding_engine is not None and (self.detectors_loaded or not detectors):
+            return self
+        with self._lock:
+            started = time.perf_counter()
+            if self.embedding_engine is None:
+                from .engine import EmbeddingEngine, warmup_batch_sizes
+
+                logging.info("Loading ArcFace ONNX model: %s", settings.MODEL_PATH)
+                engine = EmbeddingEngine(settings.MODEL_PATH)
+                engine.warm_up(warmup_batch_sizes(settings.MODEL_WARMUP_BATCH_SIZES))
+                self.embedding_engine = engine
+
+            if detectors and not self.detectors_loaded:
+                # Primary detector and optional fallback, selected through settings
+                # (MTCNN is only imported - and TensorFlow only loaded - when it is selected)
+                primary = build_detector(settings.DETECTOR_BACKEND)
+                fallback = None
+                if settings.DETECTOR_FALLBACK and settings.DETECTOR_FALLBACK.lower() != settings.DETECTOR_BACKEND.lower():
+                    fallback = build_detector(settings.DETECTOR_FALLBACK)
+                self.detector, self.fallback_detector = primary, fallback
+                self.detectors_loaded = True
+            logging.info("Models loaded in %.1fs", time.perf_counter() - started)
+        return self
+
+
+_models = _Models()
+
+
+def load_models(detectors: bool = True):
+    """Build every model handle now (blocking); a no-op once loaded.
+    detectors=False builds only ArcFace: with the inference pool running, detection
+    happens in its children, and the detectors load here only if something (the
+    stream endpoint) asks for them."""
+    _models.load(detectors)
+
+
+def models_loaded() -> bool:
+    return _models.loaded
+
+
+def __getattr__(name: str):
+    # module attributes kept for callers of the old eagerly-loaded globals
+    if name == "embedding_engine":
+        return _models.load(detectors=False).embedding_engine
+    if name in ("detector", "fallback_detector"):
+        return getattr(_models.load(), name)
+    if name == "ort_session":
+        return _models.load(detectors=False).embedding_engine.session
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Haar cascade fallback
-haar_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
 
 # Ensure upload folder exists
 IMAGE_UPLOAD_FOLDER = getattr(settings, "IMAGE_UPLOAD_FOLDER", "uploads")
@@ -226,6 +289,22 @@ def preprocess_face(image_bgr: np.ndarray) -> np.ndarray:
     return np.expand_dims(image, axis=0)
 
 
+def normalize_embeddings(embs: np.ndarray) -> np.ndarray:
+    """Row-wise L2 normalization of an (F,D) batch (zero rows are left as-is)."""
+    embs = embs.astype(np.float32)
+    norms = np.linalg.norm(embs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embs / norms
+
+
+def preprocess_faces(faces_bgr: List[np.ndarray]) -> np.ndarray:
+    """Batch version of preprocess_face: stack faces into one (F,3,112,112) tensor."""
+    batch = np.stack([cv2.resize(face, (112, 112)) for face in faces_bgr], axis=0)
+    batch = batch[..., ::-1].astype(np.float32)  # BGR -> RGB
+    batch = (batch / 127.5) - 1.0
+    return np.ascontiguousarray(np.transpose(batch, (0, 3, 1, 2)))
+
+
 def get_image_sharpness(img: np.ndarray) -> float:
     if img is None or img.size == 0:
         return 0.0
@@ -235,6 +314,8 @@ def get_image_sharpness(img: np.ndarray) -> float:
 
 # ----------------- Face Alignment -----------------
 
+FACE_KEYPOINTS = ("left_eye", "right_eye", "nose", "mouth_left", "mouth_right")
+
 ARCREF = np.array([
     [38.2946, 51.6963],
     [73.5318, 51.5014],
@@ -288,92 +369,225 @@ def crop_face_from_box(image: np.ndarray, box: List[int], margin: float = 0.2) -
 
 # ----------------- Embedding Generation -----------------
 
-def generate_embedding_from_face(face_bgr: np.ndarray) -> Optional[np.ndarray]:
-    """Given a cropped/aligned face (BGR), return normalized embedding or None."""
+def passes_quality_gates(face_bgr: np.ndarray) -> bool:
+    """Size and sharpness gates applied to every face before it reaches ArcFace."""
     if face_bgr is None or face_bgr.size == 0:
-        return None
+        return False
 
     h, w = face_bgr.shape[:2]
     if h < MIN_FACE_SIZE or w < MIN_FACE_SIZE:
         logging.warning("Face rejected: too small (%dx%d)", w, h)
-        return None
+        FACES_REJECTED.inc("too_small")
+        return False
 
     sharp = get_image_sharpness(face_bgr)
     if sharp < MIN_SHARPNESS:
         logging.warning("Face rejected: too blurry (lap_var=%.2f)", sharp)
-        return None
+        FACES_REJECTED.inc("too_blurry")
+        return False
+
+    return True
+
+
+def run_embedding_model(batch: np.ndarray) -> np.ndarray:
+    """Run ArcFace once on a preprocessed (F,3,112,112) batch, return (F,512) normalized rows."""
+    engine = _models.load(detectors=False).embedding_engine
+    with STAGE_SECONDS.time("embed"):
+        emb = engine.run(batch)
+    return normalize_embeddings(emb)
+
+
+def generate_embeddings_batch(faces_bgr: List[np.ndarray]) -> List[Optional[np.ndarray]]:
+    """Gate, preprocess and embed several faces with a single model call.
+    Returns a list aligned with the input; rejected faces map to None.
+    """
+    results: List[Optional[np.ndarray]] = [None] * len(faces_bgr)
+    accepted = [i for i, face in enumerate(faces_bgr) if passes_quality_gates(face)]
+    if not accepted:
+        return results
 
     try:
-        inp = preprocess_face(face_bgr)
-        in_name = ort_session.get_inputs()[0].name
-        out_name = ort_session.get_outputs()[0].name
-        emb = ort_session.run([out_name], {in_name: inp})[0]
-        return normalize_embedding(emb[0])
+        embs = run_embedding_model(preprocess_faces([faces_bgr[i] for i in accepted]))
     except Exception:
         logging.exception("Embedding generation failed")
-        return None
+        return results
+
+    for row, i in enumerate(accepted):
+        results[i] = embs[row]
+    return results
+
+
+def generate_embedding_from_face(face_bgr: np.ndarray) -> Optional[np.ndarray]:
+    """Given a cropped/aligned face (BGR), return normalized embedding or None."""
+    return generate_embeddings_batch([face_bgr])[0]
 
 
 # ----------------- Detection with fallback -----------------
 
-def detect_faces_with_fallback(image_bgr: np.ndarray) -> List[dict]:
-    """Return a list of face dicts. Try MTCNN first, then Haar fallback.
-    MTCNN returns dicts with keys: box, confidence, keypoints
-    Haar fallback returns dicts with box and no keypoints.
+def detect_faces_with_fallback(image_bgr: np.ndarray, scale: float = 1.0) -> List[dict]:
+    """Return a list of face dicts. Try the primary detector first, then the fallback.
+    Every backend returns dicts with keys: box, confidence, keypoints
+    (Haar has no landmarks, so its keypoints are an empty dict).
+    `scale` is full-resolution pixels per pixel of image_bgr when it is a downscaled copy.
     """
-    faces_out = []
+    models = _models.load()
+    detector, fallback_detector = models.detector, models.fallback_detector
     try:
-        rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
-        mtcnn_results = detector.detect_faces(rgb)
-        if mtcnn_results:
-            logging.debug("MTCNN detected %d faces", len(mtcnn_results))
-            # normalize box to [x,y,w,h]
-            faces_out.extend(mtcnn_results)
-            return faces_out
+        with STAGE_SECONDS.time("detect"):
+            faces = detector.detect(image_bgr, scale)
+        if faces:
+            logging.debug("%s detected %d faces", detector.name, len(faces))
+            FACES_DETECTED.inc(amount=len(faces))
+            return faces
     except Exception:
-        logging.exception("MTCNN detection failed, falling back to Haar")
+        logging.exception("%s detection failed, trying fallback", detector.name)
+
+    if fallback_detector is None:
+        return []
 
-    # Haar fallback
+    DETECTOR_FALLBACKS.inc()
     try:
-        gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
-        haar_faces = haar_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=3, minSize=(MIN_FACE_SIZE, MIN_FACE_SIZE))
-        for (x, y, w, h) in haar_faces:
-            faces_out.append({"box": [int(x), int(y), int(w), int(h)], "confidence": None, "keypoints": {}})
-        logging.debug("Haar detected %d faces", len(haar_faces))
+        with STAGE_SECONDS.time("detect_fallback"):
+            faces = fallback_detector.detect(image_bgr, scale)
+        logging.debug("%s fallback detected %d faces", fallback_detector.name, len(faces))
+        FACES_DETECTED.inc(amount=len(faces))
+        return faces
     except Exception:
-        logging.exception("Haar fallback detection failed")
+        logging.exception("%s fallback detection failed", fallback_detector.name)
+        return []
 
-    return faces_out
 
+# ----------------- Detection Resolution -----------------
 
-# ----------------- Recognition -----------------
+DETECTION_MAX_SIDE = int(getattr(settings, "DETECTION_MAX_SIDE", 0) or 0)  # 0 = detect at full size
 
-def detect_and_recognize_faces(image_bgr: np.ndarray, cache_data: Tuple) -> List[dict]:
-    """Detect faces and recognize using cached embeddings.
-    cache_data: (names, stored_embeddings, ids, member_codes)
-    stored_embeddings must be a (N,512) numpy array of normalized vectors.
-    Returns list of dicts with: name, member_code, box, score
+
+def _encoded_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) from a JPEG or PNG header without decoding; None for other formats."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if data[:2] != b"\xff\xd8":
+        return None
+    i, n = 2, len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        # SOF0..SOF15 carry the frame size (C4 = DHT, C8 = JPG, CC = DAC are not frames)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+        i += 2 + length
+    return None
+
+
+def downscale_for_detection(image_bgr: np.ndarray, max_side: Optional[int] = None) -> np.ndarray:
+    """Copy of the image whose longer side is at most max_side (the image itself if already small enough)."""
+    max_side = DETECTION_MAX_SIDE if max_side is None else max_side
+    h, w = image_bgr.shape[:2]
+    if max_side <= 0 or max(h, w) <= max_side:
+        return image_bgr
+    f = max_side / float(max(h, w))
+    return cv2.resize(image_bgr, (max(1, round(w * f)), max(1, round(h * f))), interpolation=cv2.INTER_AREA)
+
+
+class DetectionFrame(NamedTuple):
+    image: np.ndarray  # what the detector sees
+    full: Optional[np.ndarray]  # full-resolution decode, None until needed
+    scale_x: float  # full / detection size
+    scale_y: float
+
+
+def decode_for_detection(data: bytes, max_side: Optional[int] = None) -> Optional[DetectionFrame]:
+    """Decode an upload at (about) detection resolution.
+    Large JPEGs are decoded with IMREAD_REDUCED_COLOR_2/4/8, which lets libjpeg skip
+    most of the work; the full-resolution decode (decode_full) is then only needed
+    if a face is found. Returns None if the bytes cannot be decoded.
     """
-    if image_bgr is None or image_bgr.size == 0:
-        return []
+    max_side = DETECTION_MAX_SIDE if max_side is None else max_side
+    nparr = np.frombuffer(data, np.uint8)
+    size = _encoded_size(data) if max_side > 0 else None
+    if size is not None:
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                             (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if max(size) // factor >= max_side:
+                with STAGE_SECONDS.time("decode"):
+                    reduced = cv2.imdecode(nparr, flag)
+                if reduced is None:
+                    return None
+                image = downscale_for_detection(reduced, max_side)
+                width, height = size
+                if (image.shape[1] >= image.shape[0]) != (width >= height):
+                    width, height = height, width  # EXIF rotation was applied by imdecode
+                return DetectionFrame(image, None, width / float(image.shape[1]), height / float(image.shape[0]))
+
+    with STAGE_SECONDS.time("decode"):
+        full = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if full is None:
+        return None
+    image = downscale_for_detection(full, max_side)
+    return DetectionFrame(image, full, full.shape[1] / float(image.shape[1]), full.shape[0] / float(image.shape[0]))
 
-    names, stored_embeddings, ids, member_codes = cache_data
-    if stored_embeddings is None or stored_embeddings.size == 0:
-        logging.warning("No stored embeddings available")
-        return []
 
-    faces = detect_faces_with_fallback(image_bgr)
-    if not faces:
-        return []
+def decode_full(data: bytes, frame: DetectionFrame) -> Optional[np.ndarray]:
+    """Full-resolution pixels of a frame from decode_for_detection (decoded now if it was reduced)."""
+    if frame.full is not None:
+        return frame.full
+    with STAGE_SECONDS.time("decode"):
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
 
-    results = []
+
+def remap_faces(faces: List[dict], sx: float, sy: float) -> List[dict]:
+    """Scale detector boxes and keypoints from the detection image to the full image."""
+    if sx == 1.0 and sy == 1.0:
+        return faces
+    out = []
+    for face in faces:
+        x, y, w, h = face["box"]
+        mapped = dict(face)
+        mapped["box"] = [int(round(x * sx)), int(round(y * sy)), int(round(w * sx)), int(round(h * sy))]
+        mapped["keypoints"] = {name: (int(round(px * sx)), int(round(py * sy)))
+                               for name, (px, py) in (face.get("keypoints") or {}).items()}
+        out.append(mapped)
+    return out
+
+
+def detect_faces_capped(image_bgr: np.ndarray, detection_image: Optional[np.ndarray] = None) -> List[dict]:
+    """Detect on a copy no larger than DETECTION_MAX_SIDE and return boxes and keypoints
+    in image_bgr coordinates, so alignment still samples the full-resolution pixels.
+    """
+    if detection_image is None:
+        detection_image = downscale_for_detection(image_bgr)
+    sx = image_bgr.shape[1] / float(detection_image.shape[1])
+    sy = image_bgr.shape[0] / float(detection_image.shape[0])
+    faces = detect_faces_with_fallback(detection_image, max(sx, sy))
+    return remap_faces(faces, sx, sy)
+
+
+# ----------------- Recognition -----------------
+
+def has_all_keypoints(keypoints: Optional[dict]) -> bool:
+    return bool(keypoints) and all(k in keypoints for k in FACE_KEYPOINTS)
+
+
+def extract_aligned_faces(image_bgr: np.ndarray, faces: List[dict]) -> List[Tuple[dict, np.ndarray]]:
+    """Align (or crop) every detected face. Returns (face, aligned_bgr) pairs for faces that could be cut out."""
+    with STAGE_SECONDS.time("align"):
+        return _extract_aligned_faces(image_bgr, faces)
+
+
+def _extract_aligned_faces(image_bgr: np.ndarray, faces: List[dict]) -> List[Tuple[dict, np.ndarray]]:
+    out = []
     for face in faces:
         box = face.get("box")
         keypoints = face.get("keypoints", {})
 
         # Align if keypoints available else crop box
         aligned = None
-        if keypoints and all(k in keypoints for k in ("left_eye", "right_eye", "nose", "mouth_left", "mouth_right")):
+        if has_all_keypoints(keypoints):
             aligned = align_face_by_keypoints(image_bgr, keypoints)
         if aligned is None and box is not None:
             aligned = crop_face_from_box(image_bgr, box)
@@ -381,76 +595,275 @@ def detect_and_recognize_faces(image_bgr: np.ndarray, cache_data: Tuple) -> List
         if aligned is None:
             logging.debug("Skipping face: cannot align or crop")
             continue
+        out.append((face, aligned))
+    return out
 
-        emb = generate_embedding_from_face(aligned)
-        if emb is None:
-            continue
-
-        # Both stored_embeddings and emb are normalized → cosine = dot
-        sims = stored_embeddings @ emb  # shape (N,)
-        best_idx = int(np.argmax(sims))
-        best_score = float(sims[best_idx])
 
+def match_embeddings(embs: np.ndarray, cache_data: Tuple, index=None) -> List[dict]:
+    """Score an (F,512) batch against the gallery with one (F,N) product,
+    or through the ANN index when one is given. A GallerySnapshot with a compact
+    (float16/int8) matrix is scored on it and re-ranked in float32; one with
+    several templates per employee scores each employee by their best template.
+    Returns one dict per row with: name, member_code, employee_id, score
+    """
+    names, stored_embeddings, ids, member_codes = cache_data[:4]
+
+    # Both stored_embeddings and embs are normalized → cosine = dot
+    with STAGE_SECONDS.time("match"):
+        best_idx, best_scores = search_gallery(embs, stored_embeddings, index=index, k=1,
+                                               compact=getattr(cache_data, "compact", None),
+                                               rerank=settings.GALLERY_RERANK_CANDIDATES,
+                                               owners=getattr(cache_data, "owners", None))
+
+    threshold = max(RECOGNITION_THRESHOLD, getattr(settings, "MIN_RECOGNITION_THRESHOLD", 0.35))
+    matches = []
+    for idx, score in zip(best_idx[:, 0].tolist(), best_scores[:, 0].tolist()):
         recognized_name = "Unknown"
         member_code = None
-        threshold = max(RECOGNITION_THRESHOLD, getattr(settings, "MIN_RECOGNITION_THRESHOLD", 0.35))
-        if best_score >= threshold:
-            recognized_name = names[best_idx]
-            member_code = member_codes[best_idx] if member_codes is not None else None
+        employee_id = None
+        if idx >= 0 and score >= threshold:
+            recognized_name = names[idx]
+            member_code = member_codes[idx] if member_codes is not None else None
+            employee_id = ids[idx] if ids is not None else None
+        matches.append({"name": recognized_name, "member_code": member_code,
+                        "employee_id": employee_id, "score": float(score)})
+    return matches
+
+
+def prepare_faces(image_bgr: np.ndarray) -> Tuple[List[dict], Optional[np.ndarray]]:
+    """CPU-side half of recognition: detect, align, gate and preprocess.
+    Returns the faces that passed the gates and their (F,3,112,112) model input
+    (None when no face survived), ready to be embedded alone or in a shared batch.
+    """
+    if image_bgr is None or image_bgr.size == 0:
+        return [], None
+
+    faces = detect_faces_capped(image_bgr)
+    if not faces:
+        return [], None
+
+    return prepare_detected_faces(image_bgr, faces)
+
+
+def prepare_faces_from_bytes(data: bytes) -> Optional[Tuple[List[dict], Optional[np.ndarray]]]:
+    """prepare_faces() for an encoded upload: detect on a reduced decode and only
+    decode the full resolution when there is a face to align.
+    Returns None when the bytes cannot be decoded.
+    """
+    frame = decode_for_detection(data)
+    if frame is None:
+        return None
+
+    faces = detect_faces_with_fallback(frame.image, max(frame.scale_x, frame.scale_y))
+    if not faces:
+        return [], None
+
+    full = decode_full(data, frame)
+    if full is None:
+        return None
+    faces = remap_faces(faces, full.shape[1] / float(frame.image.shape[1]), full.shape[0] / float(frame.image.shape[0]))
+    return prepare_detected_faces(full, faces)
+
+
+def prepare_detected_faces(image_bgr: np.ndarray, faces: List[dict]) -> Tuple[List[dict], Optional[np.ndarray]]:
+    """Align, gate and preprocess faces that were already detected (e.g. by a tracker's frame).
+    Returns the faces that passed the gates and their (F,3,112,112) model input, or None.
+    """
+    kept = [(face, aligned) for face, aligned in extract_aligned_faces(image_bgr, faces)
+            if passes_quality_gates(aligned)]
+    if not kept:
+        return [], None
 
+    return [face for face, _ in kept], preprocess_faces([aligned for _, aligned in kept])
+
+
+def build_recognition_results(faces: List[dict], embs: np.ndarray, cache_data: Tuple, index=None) -> List[dict]:
+    """Match embedded faces against the gallery and format them for the API.
+    Returns list of dicts with: name, member_code, box, score, employee_id
+    """
+    if not faces:
+        return []
+
+    matches = match_embeddings(embs, cache_data, index=index)
+
+    results = []
+    for face, match in zip(faces, matches):
+        box = face.get("box")
         results.append({
-            "name": recognized_name,
-            "member_code": member_code,
+            "name": match["name"],
+            "member_code": match["member_code"],
             "box": [int(x) for x in box] if box is not None else None,
-            "score": best_score
+            "score": match["score"],
+            "employee_id": match["employee_id"]
         })
 
     return results
 
 
-# ----------------- Employee Image Processing -----------------
+def detect_and_recognize_faces(image_bgr: np.ndarray, cache_data: Tuple, index=None) -> List[dict]:
+    """Detect faces and recognize using cached embeddings.
+    cache_data: (names, stored_embeddings, ids, member_codes) or a GallerySnapshot
+    stored_embeddings must be a (N,512) numpy array of normalized vectors.
+    index: optional ANN index over stored_embeddings (brute force when None).
+    All faces of the frame are embedded in one model call and scored in one matmul.
+    Returns list of dicts with: name, member_code, box, score, employee_id
+    """
+    if image_bgr is None or image_bgr.size == 0:
+        return []
 
-def process_employee_images(employee_name: str, employee_id: str, files_data: List[Tuple[str, bytes]]) -> Tuple[Optional[np.ndarray], Optional[str]]:
-    """Process uploaded employee images (filename, bytes) and return average embedding and saved representative path."""
-    embeddings = []
-    rep_img_path = None
+    names, stored_embeddings, ids, member_codes = cache_data[:4]
+    if stored_embeddings is None or stored_embeddings.size == 0:
+        logging.warning("No stored embeddings available")
+        return []
 
-    if not files_data:
-        return None, None
+    faces, batch = prepare_faces(image_bgr)
+    if batch is None:
+        return []
 
-    for filename, contents in files_data:
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if image is None:
-            continue
+    try:
+        embs = run_embedding_model(batch)
+    except Exception:
+        logging.exception("Embedding generation failed")
+        return []
 
-        faces = detect_faces_with_fallback(image)
-        if not faces:
-            continue
+    return build_recognition_results(faces, embs, cache_data, index=index)
 
-        main_face = max(faces, key=lambda r: r["box"][2] * r["box"][3])
-        keypoints = main_face.get("keypoints", {})
 
+# ----------------- Employee Image Processing -----------------
+
+def score_enrollment_image(data: bytes) -> dict:
+    """Cheap first stage of enrollment: sharpness, exposure and size of a photo,
+    measured on a decode reduced to ENROLL_SCORE_MAX_SIDE (no detector, no ArcFace).
+    Returns a report entry with status "candidate" (and a ranking score) or
+    "rejected" with the reason.
+    """
+    frame = decode_for_detection(data, max_side=settings.ENROLL_SCORE_MAX_SIDE)
+    if frame is None:
+        return {"status": "rejected", "reason": "undecodable", "rank": None, "score": 0.0}
+
+    with STAGE_SECONDS.time("enroll_score"):
+        gray = cv2.cvtColor(frame.image, cv2.COLOR_BGR2GRAY)
+        width = int(round(frame.image.shape[1] * frame.scale_x))
+        height = int(round(frame.image.shape[0] * frame.scale_y))
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        brightness = float(gray.mean())
+        clipped = np.count_nonzero((gray < 8) | (gray > 247)) / float(gray.size)
+
+        # higher is better: sharp, mid-grey without clipped areas, at least the scoring size
+        exposure = max(0.0, 1.0 - abs(brightness - 128.0) / 128.0) * (1.0 - clipped)
+        size = min(1.0, min(width, height) / float(max(1, settings.ENROLL_SCORE_MAX_SIDE)))
+        score = float(np.log1p(sharpness)) * exposure * size
+
+    entry = {"status": "candidate", "reason": None, "rank": None, "score": round(score, 4), "sharpness": round(sharpness, 2),
+             "brightness": round(brightness, 1), "width": width, "height": height}
+    if min(width, height) < settings.ENROLL_MIN_IMAGE_SIDE:
+        entry.update(status="rejected", reason="too_small")
+    elif brightness < settings.ENROLL_MIN_BRIGHTNESS:
+        entry.update(status="rejected", reason="too_dark")
+    elif brightness > settings.ENROLL_MAX_BRIGHTNESS:
+        entry.update(status="rejected", reason="too_bright")
+    elif sharpness < settings.ENROLL_MIN_SHARPNESS:
+        entry.update(status="rejected", reason="too_blurry")
+    return entry
+
+
+def align_main_face(data: bytes) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    """Detect on a reduced decode and align the largest face at full resolution.
+    Returns (aligned_bgr, None), or (None, reason) when no face could be cut out.
+    """
+    frame = decode_for_detection(data)
+    if frame is None:
+        return None, "undecodable"
+
+    faces = detect_faces_with_fallback(frame.image, max(frame.scale_x, frame.scale_y))
+    if not faces:
+        return None, "no_face"
+
+    full = decode_full(data, frame)
+    if full is None:
+        return None, "undecodable"
+    main_face = max(faces, key=lambda r: r["box"][2] * r["box"][3])
+    main_face = remap_faces([main_face], full.shape[1] / float(frame.image.shape[1]),
+                            full.shape[0] / float(frame.image.shape[0]))[0]
+    keypoints = main_face.get("keypoints", {})
+
+    with STAGE_SECONDS.time("align"):
         aligned = None
-        if keypoints and all(k in keypoints for k in ("left_eye", "right_eye", "nose", "mouth_left", "mouth_right")):
-            aligned = align_face_by_keypoints(image, keypoints)
+        if has_all_keypoints(keypoints):
+            aligned = align_face_by_keypoints(full, keypoints)
         if aligned is None:
-            aligned = crop_face_from_box(image, main_face["box"], margin=0.25)
+            aligned = crop_face_from_box(full, main_face["box"], margin=0.25)
+
+    if aligned is None:
+        return None, "align_failed"
+    return aligned, None
+
+
+def process_employee_images(employee_name: str, employee_id: str, files_data: List[Tuple[str, bytes]]) -> Tuple[Optional[np.ndarray], Optional[str], List[dict]]:
+    """Process uploaded employee images (filename, bytes) and return the employee's
+    templates, the saved representative face and a per-image quality report.
+    Templates are a (k,512) array, one row per used image pruned to
+    GALLERY_MAX_TEMPLATES; with GALLERY_MAX_TEMPLATES=1 (the default) a single
+    averaged (512,) embedding.
+
+    Every image is scored cheaply first (score_enrollment_image); detection,
+    alignment and ArcFace then run on the best-ranked ones only, until
+    ENROLL_TOP_K embeddings are collected (0 = all candidates). A candidate that
+    fails (no face, rejected by the face gates) is replaced by the next one in
+    rank order. The representative face is the best-ranked image that was used.
+    Report entries: filename, status (used, skipped, rejected), reason, rank,
+    score, sharpness, brightness, width, height.
+    """
+    report = []
+    for filename, contents in files_data:
+        entry = score_enrollment_image(contents)
+        entry["filename"] = filename
+        report.append(entry)
 
-        if aligned is None:
-            continue
+    ranked = sorted((i for i, entry in enumerate(report) if entry["status"] == "candidate"),
+                    key=lambda i: report[i]["score"], reverse=True)
+    for rank, i in enumerate(ranked, 1):
+        report[i]["rank"] = rank
+    top_k = settings.ENROLL_TOP_K if settings.ENROLL_TOP_K > 0 else len(ranked)
 
-        emb = generate_embedding_from_face(aligned)
-        if emb is not None:
+    embeddings = []
+    rep_img_path = None
+    position = 0
+    while len(embeddings) < top_k and position < len(ranked):
+        wave = ranked[position:position + top_k - len(embeddings)]
+        position += len(wave)
+
+        aligned_faces = []
+        for i in wave:
+            aligned, reason = align_main_face(files_data[i][1])
+            if aligned is None:
+                report[i].update(status="rejected", reason=reason)
+            else:
+                aligned_faces.append((i, aligned))
+
+        # one ArcFace call for the whole wave
+        embs = generate_embeddings_batch([aligned for _, aligned in aligned_faces])
+        for (i, aligned), emb in zip(aligned_faces, embs):
+            if emb is None:
+                report[i].update(status="rejected", reason="low_face_quality")
+                continue
             embeddings.append(emb)
+            report[i]["status"] = "used"
             if rep_img_path is None:
-                safe = secure_filename(f"{employee_id}_rep_{filename}")
+                safe = secure_filename(f"{employee_id}_rep_{files_data[i][0]}")
                 rep_img_path = os.path.join(IMAGE_UPLOAD_FOLDER, safe)
                 # Save aligned face for future comparisons
                 cv2.imwrite(rep_img_path, aligned)
 
+    for i in ranked[position:]:
+        report[i].update(status="skipped", reason="not_in_top_k")
+    logging.info("Enrollment of %s: %d/%d images used (%d rejected)", employee_id, len(embeddings), len(report),
+                 sum(1 for entry in report if entry["status"] == "rejected"))
+
+    if embeddings and settings.GALLERY_MAX_TEMPLATES > 1:
+        return prune_templates(np.stack(embeddings, axis=0).astype(np.float32)), rep_img_path, report
     if embeddings:
         avg = normalize_embedding(np.mean(np.stack(embeddings, axis=0), axis=0).astype(np.float32))
-        return avg, rep_img_path
+        return avg, rep_img_path, report
 
-    return None, None
+    return None, None, report
@@ -0,0 +1,367 @@
+# app/ann.py
+
+import logging
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .templates import TemplateOwners
+
+# ----------------- Exact search -----------------
+
+def top_k_columns(sims: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Best k columns of every row of an (F,N) score matrix. Returns (indices, scores), both (F,k), best first."""
+    k = min(k, sims.shape[1])
+    if k == 1:
+        idx = np.argmax(sims, axis=1)[:, None]
+    else:
+        idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(sims, idx, axis=1), axis=1)
+        idx = np.take_along_axis(idx, order, axis=1)
+    return idx, np.take_along_axis(sims, idx, axis=1)
+
+
+def exact_search(queries: np.ndarray, embeddings: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Brute-force cosine search of (F,D) normalized queries against (N,D) normalized rows.
+    Returns (indices, scores), both (F,k), best first.
+    """
+    return top_k_columns(queries @ embeddings.T, k)  # (F, N) scores
+
+
+def owner_search(queries: np.ndarray, embeddings: np.ndarray, owners: TemplateOwners,
+                 k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Brute-force search of a multi-template gallery: one (F,T) matmul, then the best
+    template of every employee with one segment-max reduction.
+    Returns (employee indices, scores), both (F,k), best first.
+    """
+    if not owners.n_owners:  # only dead rows left
+        return (np.full((queries.shape[0], k), -1, dtype=np.int64),
+                np.full((queries.shape[0], k), -np.inf, dtype=np.float32))
+    return top_k_columns(owners.max_per_owner(queries @ embeddings.T), k)
+
+
+def search_gallery(queries: np.ndarray, embeddings: np.ndarray, index: Optional["_IVFSearch"] = None,
+                   k: int = 1, compact: Optional["CompactGallery"] = None,
+                   rerank: int = 8, owners: Optional[TemplateOwners] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Search through the ANN index when one is given; otherwise brute force, on the
+    compact (float16/int8) matrix with float32 re-ranking when one is given.
+    With `owners` (a multi-template gallery) the returned indices are employees, not rows;
+    the index and compact paths search rows and map the hits to their employees, so for
+    k > 1 an employee can appear more than once there. Dead rows are never returned
+    (the index does not list them); a slot without a candidate holds -1 and -inf.
+    """
+    if owners is not None and index is None and compact is None:
+        return owner_search(queries, embeddings, owners, k)
+    if index is not None:
+        idx, scores = index.search(queries, embeddings, k)
+    elif compact is not None and embeddings.shape[0]:
+        idx, scores = compact_search(queries, embeddings, compact, k, rerank,
+                                     exclude=owners.dead if owners is not None else None)
+    else:
+        idx, scores = exact_search(queries, embeddings, k)
+    if owners is not None:
+        idx = owners.owner_of(idx)
+    return idx, scores
+
+
+# ----------------- Reduced-precision search -----------------
+
+class CompactGallery(NamedTuple):
+    """float16 rows, or int8 rows with one float32 scale per row (x ~= q * scale)."""
+    precision: str
+    matrix: np.ndarray
+    scales: Optional[np.ndarray]
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+
+def quantize_rows(embeddings: np.ndarray, precision: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Compact copy of (N,D) float32 rows: float16 cast, or symmetric per-row int8."""
+    if precision == "float16":
+        return embeddings.astype(np.float16), None
+    if precision == "int8":
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        q = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+        return q, scales.astype(np.float32)
+    raise ValueError(f"Unsupported gallery precision '{precision}' (use float32, float16 or int8)")
+
+
+def compact_search(queries: np.ndarray, embeddings: np.ndarray, compact: CompactGallery, k: int = 1,
+                   rerank: int = 8, chunk: int = 8192,
+                   exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Score against the compact matrix, then re-rank the best `rerank` rows in float32.
+    Rows are widened chunk by chunk so the full-size gallery is never materialised and
+    memory traffic is that of the compact matrix. Returned scores are exact cosines;
+    rows in `exclude` score -inf.
+    """
+    n = compact.matrix.shape[0]
+    approx = np.empty((queries.shape[0], n), dtype=np.float32)
+    for start in range(0, n, chunk):
+        block = compact.matrix[start:start + chunk].astype(np.float32)
+        approx[:, start:start + chunk] = queries @ block.T
+    if compact.scales is not None:
+        approx *= compact.scales[None, :]
+    if exclude is not None:
+        approx[:, exclude] = -np.inf
+
+    shortlist = min(max(rerank, k), n)
+    if shortlist < n:
+        candidates = np.argpartition(-approx, shortlist - 1, axis=1)[:, :shortlist]
+    else:
+        candidates = np.broadcast_to(np.arange(n), (queries.shape[0], n))
+
+    # exact float32 re-ranking of the shortlist only
+    exact = np.einsum("fkd,fd->fk", embeddings[candidates], queries)
+    if exclude is not None:
+        exact[np.isneginf(np.take_along_axis(approx, candidates, axis=1))] = -np.inf
+    top = min(k, shortlist)
+    order = np.argsort(-exact, axis=1)[:, :top]
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(exact, order, axis=1)
+
+
+# ----------------- Spherical k-means -----------------
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    """Nearest centroid (max inner product) for every row, computed in chunks."""
+    out = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], chunk):
+        out[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """k-means on the unit sphere (cosine). Returns (k,D) normalized centroids."""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    k = max(1, min(k, n))
+    centroids = vectors[rng.choice(n, size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=k)
+
+        empty = np.where(counts == 0)[0]
+        if empty.size:
+            # re-seed empty clusters with random points
+            sums[empty] = vectors[rng.choice(n, size=empty.size, replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+# ----------------- IVF index -----------------
+
+class _IVFSearch:
+    """Probe-and-rerank search shared by the mutable index and its frozen snapshots."""
+    centroids: np.ndarray
+    nprobe: int
+
+    def _rows(self, label: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def search(self, queries: np.ndarray, embeddings: np.ndarray, k: int = 1,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate top-k for (F,D) queries. Returns (indices, scores), both (F,k), best first.
+        Slots without a candidate hold index -1 and score -inf.
+        """
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        coarse = queries @ self.centroids.T  # (F, nlist)
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        out_idx = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        out_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        for qi in range(queries.shape[0]):
+            candidates = np.concatenate([self._rows(label) for label in probes[qi]])
+            if candidates.size == 0:
+                continue
+            # exact re-ranking of the shortlist
+            sims = embeddings[candidates] @ queries[qi]
+            top = min(k, sims.shape[0])
+            best = np.argpartition(-sims, top - 1)[:top] if top < sims.shape[0] else np.arange(top)
+            best = best[np.argsort(-sims[best])]
+            out_idx[qi, :top] = candidates[best]
+            out_scores[qi, :top] = sims[best]
+        return out_idx, out_scores
+
+
+class IVFIndex(_IVFSearch):
+    """Inverted-file ANN index over the rows of an embedding matrix.
+
+    Rows are bucketed by their nearest k-means centroid. A query scores the
+    centroids, probes the `nprobe` closest buckets and re-ranks that shortlist
+    exactly against the full-precision rows, so scores are true cosines and only
+    recall (never the score of a returned match) depends on `nprobe`.
+
+    The index stores row numbers only; the caller owns the matrix and keeps the
+    index in sync through add / update / remove / relabel.
+    """
+
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = 8, kmeans_iterations: int = 10,
+                 train_sample: int = 65536, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iterations = kmeans_iterations
+        self.train_sample = train_sample
+        self.seed = seed
+
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0
+        self._lists: List[List[int]] = []
+        self._list_arrays: List[Optional[np.ndarray]] = []
+        self._assignment: dict = {}
+
+    # ---- building ----
+
+    def build(self, embeddings: np.ndarray):
+        """(Re)train centroids on `embeddings` and bucket every row."""
+        started = time.perf_counter()
+        n = embeddings.shape[0]
+        nlist = self.nlist or int(np.clip(4 * np.sqrt(n), 1, 4096))
+
+        rng = np.random.default_rng(self.seed)
+        sample = embeddings if n <= self.train_sample else embeddings[rng.choice(n, self.train_sample, replace=False)]
+        self.centroids = spherical_kmeans(np.ascontiguousarray(sample, dtype=np.float32), nlist,
+                                          self.kmeans_iterations, self.seed)
+
+        labels = _assign(embeddings, self.centroids)
+        self._lists = [[] for _ in range(self.centroids.shape[0])]
+        for row, label in enumerate(labels.tolist()):
+            self._lists[label].append(row)
+        self._list_arrays = [None] * len(self._lists)
+        self._assignment = dict(enumerate(labels.tolist()))
+        self.trained_size = n
+        logging.info("IVF index built: %d rows, %d lists in %.1fms",
+                     n, len(self._lists), (time.perf_counter() - started) * 1000.0)
+
+    @classmethod
+    def restore(cls, centroids: np.ndarray, labels: np.ndarray, trained_size: int, nprobe: int = 8) -> "IVFIndex":
+        """Rebuild a mutable index from saved centroids and per-row labels (no retraining)."""
+        index = cls(nlist=centroids.shape[0], nprobe=nprobe)
+        index.centroids = np.asarray(centroids, dtype=np.float32)
+        index._lists = [[] for _ in range(centroids.shape[0])]
+        for row, label in enumerate(labels.tolist()):
+            index._lists[label].append(row)
+        index._list_arrays = [None] * len(index._lists)
+        index._assignment = dict(enumerate(labels.tolist()))
+        index.trained_size = trained_size
+        return index
+
+    def labels(self, n: int) -> np.ndarray:
+        """Per-row list labels for rows 0..n-1 (what restore() needs)."""
+        out = np.zeros(n, dtype=np.int32)
+        for row, label in self._assignment.items():
+            out[row] = label
+        return out
+
+    def needs_retrain(self, n: int) -> bool:
+        """Centroids drift out of balance as the gallery grows; retrain after it doubles."""
+        return self.centroids is None or n > 2 * max(self.trained_size, 1)
+
+    def __len__(self) -> int:
+        return len(self._assignment)
+
+    # ---- mutation ----
+
+    def _nearest_list(self, vector: np.ndarray) -> int:
+        return int(np.argmax(self.centroids @ vector))
+
+    def _invalidate(self, label: int):
+        self._list_arrays[label] = None
+
+    def add(self, row: int, vector: np.ndarray):
+        label = self._nearest_list(vector)
+        self._lists[label].append(row)
+        self._assignment[row] = label
+        self._invalidate(label)
+
+    def update(self, row: int, vector: np.ndarray):
+        self.remove(row)
+        self.add(row, vector)
+
+    def remove(self, row: int):
+        label = self._assignment.pop(row, None)
+        if label is None:
+            return
+        self._lists[label].remove(row)
+        self._invalidate(label)
+
+    def relabel(self, old_row: int, new_row: int):
+        """Point the entry of `old_row` at `new_row` (the cache moved a row, e.g. swap-remove)."""
+        label = self._assignment.pop(old_row, None)
+        if label is None:
+            return
+        members = self._lists[label]
+        members[members.index(old_row)] = new_row
+        self._assignment[new_row] = label
+        self._invalidate(label)
+
+    # ---- search / snapshots ----
+
+    def _rows(self, label: int) -> np.ndarray:
+        arr = self._list_arrays[label]
+        if arr is None:
+            arr = np.asarray(self._lists[label], dtype=np.int64)
+            self._list_arrays[label] = arr
+        return arr
+
+    def freeze(self) -> "FrozenIVFIndex":
+        """Immutable copy for a published gallery snapshot.
+        Unchanged lists share their cached row arrays, so this costs O(nlist + changed rows).
+        """
+        return FrozenIVFIndex(self.centroids, [self._rows(label) for label in range(len(self._lists))], self.nprobe)
+
+
+class FrozenIVFIndex(_IVFSearch):
+    """Read-only IVF index held by a gallery snapshot; safe to search from any thread."""
+
+    def __init__(self, centroids: np.ndarray, list_arrays: List[np.ndarray], nprobe: int):
+        self.centroids = centroids
+        self.nprobe = nprobe
+        self._list_arrays = list_arrays
+
+    @classmethod
+    def from_labels(cls, centroids: np.ndarray, labels: np.ndarray, nprobe: int) -> "FrozenIVFIndex":
+        """Group rows by label with one argsort (used when mapping a shared gallery)."""
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(centroids.shape[0] + 1))
+        arrays = [order[bounds[i]:bounds[i + 1]].astype(np.int64) for i in range(centroids.shape[0])]
+        return cls(centroids, arrays, nprobe)
+
+    def _rows(self, label: int) -> np.ndarray:
+        return self._list_arrays[label]
+
+
+# ----------------- Evaluation -----------------
+
+def evaluate_recall(index: _IVFSearch, embeddings: np.ndarray, queries: np.ndarray, k: int = 1,
+                    nprobe: Optional[int] = None) -> dict:
+    """Compare the index against exact search on the same queries.
+    Returns recall@k and per-query latency of both paths.
+    """
+    started = time.perf_counter()
+    exact_idx, _ = exact_search(queries, embeddings, k)
+    exact_ms = (time.perf_counter() - started) * 1000.0
+
+    started = time.perf_counter()
+    ann_idx, _ = index.search(queries, embeddings, k, nprobe=nprobe)
+    ann_ms = (time.perf_counter() - started) * 1000.0
+
+    hits = sum(len(set(a.tolist()) & set(e.tolist())) for a, e in zip(ann_idx, exact_idx))
+    n_queries = max(queries.shape[0], 1)
+    return {
+        "n": int(embeddings.shape[0]),
+        "k": k,
+        "nprobe": nprobe or index.nprobe,
+        "recall": hits / float(n_queries * exact_idx.shape[1]),
+        "exact_ms_per_query": exact_ms / n_queries,
+        "ann_ms_per_query": ann_ms / n_queries,
+    }
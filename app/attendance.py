@@ -0,0 +1,46 @@
+# app/attendance.py
+
+"""Maintenance for the daily_attendance summary table.
+
+The recognition-log writer keeps daily_attendance current as it inserts rows;
+this rebuilds it from recognition_log, e.g. after upgrading an installation
+that already has history, or to repair a range of days:
+
+    python -m app.attendance rebuild [--from YYYY-MM-DD] [--to YYYY-MM-DD]
+
+`--to` is inclusive. Run it while the kiosks are quiet: recognitions written
+for a day while that day is being rebuilt can be counted twice or miss the
+summary (the writer logs that; the raw rows are kept either way).
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from . import crud, models
+
+
+async def _rebuild_cli(start, end):
+    from .db import AsyncSessionLocal, engine
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        count = await crud.rebuild_daily_attendance(db, start, end)
+    print(f"daily_attendance rebuilt: {count} employee-days in {time.perf_counter() - started:.1f}s")
+
+
+def _day(value: str):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the daily_attendance summary table.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--from", dest="start", type=_day, default=None, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", type=_day, default=None, help="last day, inclusive (YYYY-MM-DD)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_rebuild_cli(args.start, args.end + timedelta(days=1) if args.end else None))
@@ -0,0 +1,189 @@
+# app/batching.py
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from .ai_processing import run_embedding_model
+from .config import settings
+
+
+class _PendingFace:
+    __slots__ = ("tensor", "future", "enqueued_at")
+
+    def __init__(self, tensor: np.ndarray, future: asyncio.Future):
+        self.tensor = tensor
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceBatcher:
+    """Dynamic micro-batching scheduler for ArcFace.
+
+    Requests enqueue their preprocessed faces (one (3,112,112) tensor each) into a
+    bounded queue. A single dispatcher task drains the queue into batches and
+    flushes a batch when it holds `max_batch_size` faces or when the oldest face
+    has waited `max_wait_ms`, whichever comes first. Each face's embedding is
+    delivered to the future its request is awaiting. While a batch is running on
+    the threadpool, new faces keep accumulating, so bursts naturally form larger
+    batches and `max_wait_ms` caps the latency added at low load.
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 max_queue_size: int = 512, stats_window: int = 1024):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: List[_PendingFace] = []  # taken off the queue, results not yet delivered
+
+        # rolling stats over the last `stats_window` batches / faces
+        self._batch_sizes: Deque[int] = deque(maxlen=stats_window)
+        self._queue_waits_ms: Deque[float] = deque(maxlen=stats_window)
+        self._run_times_ms: Deque[float] = deque(maxlen=stats_window)
+        self.total_batches = 0
+        self.total_faces = 0
+        self.failed_batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._dispatch_loop())
+        logging.info("Inference batcher started (max_batch=%d, max_wait=%.1fms, queue=%d)",
+                     self.max_batch_size, self.max_wait * 1000.0, self.max_queue_size)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        # fail the batch the cancelled dispatcher held and anything still queued,
+        # so no request hangs on shutdown
+        items, self._in_flight = self._in_flight, []
+        while self._queue is not None and not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(RuntimeError("Inference batcher stopped"))
+        logging.info("Inference batcher stopped")
+
+    async def embed(self, batch: np.ndarray) -> List[Optional[np.ndarray]]:
+        """Embed a request's (F,3,112,112) faces through the shared queue.
+        Returns one normalized embedding per face (None if its batch failed).
+        """
+        if not self.running:
+            raise RuntimeError("Inference batcher is not running")
+
+        loop = asyncio.get_running_loop()
+        pending = []
+        for tensor in batch:
+            item = _PendingFace(tensor, loop.create_future())
+            await self._queue.put(item)  # blocks when the queue is full (backpressure)
+            pending.append(item.future)
+        return list(await asyncio.gather(*pending))
+
+    async def _collect(self) -> List[_PendingFace]:
+        first = await self._queue.get()
+        items = self._in_flight = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(items) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                # deadline passed: take only what is already queued
+                try:
+                    items.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _dispatch_loop(self):
+        while True:
+            items = await self._collect()
+            await self._dispatch(items)
+
+    async def _dispatch(self, items: List[_PendingFace]):
+        started = time.perf_counter()
+        for item in items:
+            self._queue_waits_ms.append((started - item.enqueued_at) * 1000.0)
+
+        try:
+            embs = await run_in_threadpool(run_embedding_model, np.stack([it.tensor for it in items], axis=0))
+        except Exception:
+            logging.exception("Batched embedding generation failed (batch of %d)", len(items))
+            self.failed_batches += 1
+            embs = [None] * len(items)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        self._batch_sizes.append(len(items))
+        self._run_times_ms.append(elapsed_ms)
+        self.total_batches += 1
+        self.total_faces += len(items)
+        logging.debug("Inference batch: size=%d run=%.2fms", len(items), elapsed_ms)
+
+        for item, emb in zip(items, embs):
+            if not item.future.done():
+                item.future.set_result(emb)
+        self._in_flight = []
+
+    def stats(self) -> dict:
+        """Rolling batch-size, queue-wait and run-time statistics."""
+        def summary(values) -> dict:
+            if not values:
+                return {"mean": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+            arr = np.asarray(values, dtype=np.float64)
+            return {
+                "mean": round(float(arr.mean()), 3),
+                "p50": round(float(np.percentile(arr, 50)), 3),
+                "p99": round(float(np.percentile(arr, 99)), 3),
+                "max": round(float(arr.max()), 3),
+            }
+
+        return {
+            "running": self.running,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "total_batches": self.total_batches,
+            "total_faces": self.total_faces,
+            "failed_batches": self.failed_batches,
+            "batch_size": summary(self._batch_sizes),
+            "queue_wait_ms": summary(self._queue_waits_ms),
+            "run_time_ms": summary(self._run_times_ms),
+        }
+
+
+# Global batcher instance
+inference_batcher = InferenceBatcher(
+    max_batch_size=settings.BATCH_MAX_SIZE,
+    max_wait_ms=settings.BATCH_MAX_WAIT_MS,
+    max_queue_size=settings.BATCH_QUEUE_SIZE,
+)
+
+
+async def embed_faces(batch: np.ndarray) -> List[Optional[np.ndarray]]:
+    """Embed an (F,3,112,112) batch through the shared batcher when it is running,
+    otherwise directly on the threadpool."""
+    if inference_batcher.running:
+        return await inference_batcher.embed(batch)
+    return list(await run_in_threadpool(run_embedding_model, batch))
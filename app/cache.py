@@ -1,72 +1,648 @@
 # app/cache.py
 
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
 import numpy as np
-from typing import Dict, List, Tuple
+
+from .ann import CompactGallery, FrozenIVFIndex, IVFIndex, quantize_rows
+from .config import settings
+from .shared_gallery import SharedGallery
+from .templates import DEAD_RANK, MAX_TEMPLATES, TemplateOwners, as_templates
+
+
+class GallerySnapshot(NamedTuple):
+    """An immutable, versioned view of the gallery.
+    The first four fields keep the legacy get_all() layout. names, ids and
+    member_codes hold one entry per employee; embeddings holds one row per
+    template (dead rows of replaced or removed templates included), and
+    `owners` maps the rows to employees (None when row i is employee i's only
+    template).
+    """
+    names: Tuple[str, ...]
+    embeddings: np.ndarray  # read-only (T,512) view
+    ids: Tuple[str, ...]
+    member_codes: Tuple[str, ...]
+    index: Optional[FrozenIVFIndex]
+    version: int
+    compact: Optional[CompactGallery] = None  # float16/int8 copy scored before float32 re-ranking
+    owners: Optional[TemplateOwners] = None
+
+    @property
+    def templates(self) -> int:
+        """Live template rows."""
+        dead = self.owners.dead if self.owners is not None else None
+        return len(self.embeddings) - (len(dead) if dead is not None else 0)
+
+
+def _empty_snapshot(dim: int) -> GallerySnapshot:
+    embeddings = np.empty((0, dim), dtype=np.float32)
+    embeddings.flags.writeable = False
+    return GallerySnapshot((), embeddings, (), (), None, 0)
+
 
 class EmbeddingCache:
-    """A simple in-memory cache for face embeddings."""
-    def __init__(self):
+    """An in-memory cache for face embeddings.
+
+    Rows live in a capacity-managed float32 array that doubles when full, so
+    enrollments append in amortised O(1) without copying the gallery. Each row is
+    one template (an employee has 1..GALLERY_MAX_TEMPLATES); parallel arrays hold
+    the employee slot and template rank of every row, and a per-slot list holds
+    an employee's rows. An id -> slot dict makes lookups O(1).
+
+    The matrix is append-only: replacing or removing an employee marks their
+    rows dead (owner -1) instead of overwriting them, and removal moves the last
+    employee into the freed slot, so a mutation touches O(templates) rows. Once
+    dead rows make up a quarter of the matrix it is rewritten without them (first
+    templates in slot order, so a single-template gallery is plain again); that
+    O(rows) copy is amortised over the mutations that caused it.
+
+    Readers never see that working state. Writers (serialised by a lock) publish
+    an immutable GallerySnapshot and swap it in with a single reference
+    assignment, so `snapshot()` is lock-free and always self-consistent. A
+    snapshot's matrix is a read-only view of the working buffer: rows are only
+    ever written past the published ones, and compaction or growth fills a new
+    buffer, so a held snapshot never changes. Mutations inside `batch()`, or
+    within CACHE_PUBLISH_DELAY_MS of each other, are coalesced into one publish.
+
+    With GALLERY_PRECISION set to float16 or int8, a compact copy of every row
+    (plus a per-row scale for int8) is kept in step with the float32 rows and
+    published alongside them; brute-force matching scores the compact matrix and
+    re-ranks only the top few candidates in float32.
+
+    With a SharedGallery attached (several uvicorn workers), the matrix is a
+    memory map of the shared generation files instead of a private buffer.
+    Mutations are queued; at publish time the writer appends their rows to the
+    shared files under the cross-process lock and logs them, and every worker
+    replays the log into its own bookkeeping, so snapshots map the same pages.
+    """
+
+    COMPACT_MIN_DEAD = 64  # dead rows tolerated whatever the gallery size
+
+    def __init__(self, dim: int = 512, publish_delay_ms: Optional[float] = None,
+                 shared: Optional[SharedGallery] = None, precision: Optional[str] = None):
+        self.dim = dim
+        self.precision = (precision or settings.GALLERY_PRECISION).lower()
+        if self.precision not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported gallery precision '{self.precision}'")
         self.names: List[str] = []
         self.ids: List[str] = []
         self.member_codes: List[str] = []
-        self.embeddings: np.ndarray = np.array([])
-        print("EmbeddingCache initialized.")
+        self._matrix: np.ndarray = np.empty((0, dim), dtype=np.float32)
+        self._owner: np.ndarray = np.empty(0, dtype=np.int32)  # employee slot of every row, -1 = dead
+        self._rank: np.ndarray = np.empty(0, dtype=np.uint8)  # template number within the employee
+        self._compact: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._size = 0  # template rows, dead ones included
+        self._dead = 0
+        self._slot_of: Dict[str, int] = {}
+        self._rows_of: List[List[int]] = []  # per slot: live rows, first template first
+        self.index: Optional[IVFIndex] = None
+
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._dirty = False
+        self._publish_timer: Optional[threading.Timer] = None
+        self.publish_delay = (settings.CACHE_PUBLISH_DELAY_MS if publish_delay_ms is None else publish_delay_ms) / 1000.0
+        self.publish_count = 0
+        self._snapshot = _empty_snapshot(dim)
+
+        # cross-process mode: mutations are queued and replayed into the shared gallery
+        self.shared = shared
+        self._shared_generation = 0
+        self._shared_log_end = 0
+        self._shared_reload = False  # update() loaded a gallery that must become the next generation
+        self._pending_ops: List[tuple] = []
+        logging.debug("EmbeddingCache initialized.")
+
+    # ---------- readers (lock-free) ----------
+
+    def snapshot(self) -> GallerySnapshot:
+        """The latest published gallery. Never changes once returned."""
+        if self.shared is not None:
+            self._refresh_from_shared()
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self.snapshot().version
 
     def is_empty(self) -> bool:
-        return len(self.names) == 0
+        return len(self.snapshot().ids) == 0
 
     def get_all(self) -> Tuple[List[str], np.ndarray, List[str]]:
-        return self.names, self.embeddings, self.ids, self.member_codes
+        names, embeddings, ids, member_codes = self.snapshot()[:4]
+        return names, embeddings, ids, member_codes
+
+    # ---------- working state (writers) ----------
 
-    def update(self, names: List[str], embeddings: np.ndarray, ids: List[str], member_codes: List[str]): # <-- ADD member_codes here
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._matrix[:self._size]
+
+    @property
+    def capacity(self) -> int:
+        return self._matrix.shape[0]
+
+    @property
+    def owners(self) -> np.ndarray:
+        return self._owner[:self._size]
+
+    @property
+    def ranks(self) -> np.ndarray:
+        return self._rank[:self._size]
+
+    def get_rows(self, emp_id: str) -> np.ndarray:
+        """Template rows of an employee, first template first (empty when unknown)."""
+        slot = self._slot_of.get(emp_id)
+        return np.asarray(self._rows_of[slot] if slot is not None else [], dtype=np.int64)
+
+    def _ensure_capacity(self, needed: int):
+        if needed <= self.capacity:
+            return
+        # a new buffer: published snapshots keep viewing the old one
+        self._relayout(np.arange(self._size), max(needed, 2 * self.capacity, 16))
+
+    def _relayout(self, order: np.ndarray, capacity: int):
+        """Copy rows `order` (in that order) into fresh buffers of `capacity` rows."""
+        n = len(order)
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        matrix[:n] = self._matrix[order]
+        self._matrix = matrix
+        owner = np.empty(capacity, dtype=np.int32)
+        owner[:n] = self._owner[order]
+        self._owner = owner
+        rank = np.empty(capacity, dtype=np.uint8)
+        rank[:n] = self._rank[order]
+        self._rank = rank
+        if self._compact is not None:
+            compact = np.empty((capacity, self.dim), dtype=self._compact.dtype)
+            compact[:n] = self._compact[order]
+            self._compact = compact
+        if self._scales is not None:
+            scales = np.empty(capacity, dtype=np.float32)
+            scales[:n] = self._scales[order]
+            self._scales = scales
+        self._size = n
+
+    def _append_rows(self, templates: np.ndarray) -> List[int]:
+        """Write (k,512) templates past the last row; _assign() gives them an owner."""
+        first, k = self._size, len(templates)
+        self._ensure_capacity(first + k)
+        self._matrix[first:first + k] = templates
+        if self._compact is not None:
+            q, scales = quantize_rows(self._matrix[first:first + k], self.precision)
+            self._compact[first:first + k] = q
+            if self._scales is not None:
+                self._scales[first:first + k] = scales
+        self._size += k
+        return list(range(first, first + k))
+
+    def _kill_rows(self, rows: List[int]):
+        """Mark rows dead. They stay in the matrix (snapshots may be reading them) until compaction."""
+        self._owner[rows] = -1
+        self._rank[rows] = DEAD_RANK
+        self._dead += len(rows)
+        if self.index is not None:
+            for row in rows:
+                self.index.remove(row)
+
+    def _index_due(self) -> bool:
+        live = self._size - self._dead
+        return settings.ANN_ENABLED and live >= settings.ANN_MIN_SIZE and (
+            self.index is None or self.index.needs_retrain(live))
+
+    def _compaction_due(self) -> bool:
+        return self._dead > max(self.COMPACT_MIN_DEAD, self._size // 4)
+
+    def _tidy(self):
+        """Build / retrain the ANN index or drop dead rows once due. That O(rows) work
+        is amortised over the mutations that made it due."""
+        if self._index_due():
+            self._rebuild_index()
+        elif self._compaction_due():
+            self._compact_rows()
+
+    def _compact_rows(self, capacity: Optional[int] = None):
+        """Rewrite the rows without the dead ones: first templates in slot order, then the rest by rank."""
+        live = np.flatnonzero(self._rank[:self._size] != DEAD_RANK)
+        order = live[np.lexsort((self._owner[live], self._rank[live]))]
+        labels = self.index.labels(self._size)[order] if self.index is not None else None
+        position = np.empty(self._size, dtype=np.int64)
+        position[order] = np.arange(len(order))
+
+        self._relayout(order, capacity or self.capacity)
+        self._dead = 0
+        self._rows_of = [position[rows].tolist() for rows in self._rows_of]
+        if labels is not None:
+            self.index = IVFIndex.restore(self.index.centroids, labels, self.index.trained_size,
+                                          nprobe=self.index.nprobe)
+
+    def _compact_view(self) -> Optional[CompactGallery]:
+        if self._compact is None:
+            return None
+        matrix = self._compact[:self._size]
+        matrix.flags.writeable = False
+        scales = None
+        if self._scales is not None:
+            scales = self._scales[:self._size]
+            scales.flags.writeable = False
+        return CompactGallery(self.precision, matrix, scales)
+
+    # ---------- publishing ----------
+
+    def _publish(self):
+        with self._lock:
+            if self._publish_timer is not None:
+                self._publish_timer.cancel()
+                self._publish_timer = None
+            if self.shared is not None:
+                self._publish_shared()
+            self._publish_snapshot()
+            self._dirty = False
+            self.publish_count += 1
+
+    def _publish_snapshot(self):
+        view = self._matrix[:self._size]
+        view.flags.writeable = False
+        self._snapshot = GallerySnapshot(
+            tuple(self.names), view, tuple(self.ids), tuple(self.member_codes),
+            self.index.freeze() if self.index is not None else None,
+            self._snapshot.version + 1,
+            self._compact_view(),
+            TemplateOwners.build(self._owner[:self._size], self._rank[:self._size], len(self.ids)),
+        )
+
+    def _publish_shared(self):
+        """Append the queued mutations to the shared gallery.
+
+        Their template rows are written into the shared matrix past the published
+        ones and each mutation becomes one log record that every worker replays,
+        so an enrollment costs O(its templates) however large the gallery. A new
+        generation (live rows only, room to double) is written only when the file
+        is full, dead rows pile up or the ANN index needs (re)training.
+        """
+        with self.shared.write_lock():
+            ops, self._pending_ops = self._pending_ops, []
+            if self._shared_reload:
+                # update() loaded the whole gallery: it replaces whatever is shared
+                self._shared_reload = False
+                self._write_shared_generation()
+                return
+            try:
+                self._sync_shared()
+                records = []
+                for op in ops:
+                    if op[0] == "upsert":
+                        _, emp_id, name, member_code, templates = op
+                        rows = self._append_rows(templates)
+                        self._assign(emp_id, name, member_code, rows)
+                        records.append({"op": "set", "id": emp_id, "name": name, "code": member_code,
+                                        "row": rows[0], "k": len(rows)})
+                    elif self._drop(op[1]) is not None:
+                        records.append({"op": "del", "id": op[1]})
+
+                if not isinstance(self._matrix, np.memmap) or self._index_due() or self._compaction_due():
+                    # the rows outgrew the shared file (and were copied), or it is time to compact / retrain
+                    self._tidy()
+                    self._write_shared_generation()
+                elif records:
+                    self._shared_log_end = self.shared.append(self._shared_generation, records)
+            except BaseException:
+                self._shared_generation = 0  # the working store is half-applied: remap on next sync
+                raise
+
+    def _write_shared_generation(self):
+        """Write the working store as a new shared generation and switch to its mapping."""
+        if self._dead:
+            self._compact_rows(self._size - self._dead)  # a transient copy: the new files replace it
+        index = self.index
+        generation = self.shared.publish(
+            self.names, self.embeddings, self.ids, self.member_codes,
+            centroids=index.centroids if index is not None else None,
+            labels=index.labels(self._size) if index is not None else None,
+            trained_size=index.trained_size if index is not None else 0,
+            compact=self._compact_view(),
+            owners=self.owners,
+            capacity=2 * self._size,
+        )
+        self._map_shared(self.shared.load(generation))
+
+    def _map_shared(self, state):
+        """Make a shared generation's base the working store. Its matrix files are mapped, not copied."""
+        self._matrix = state.embeddings
+        self._compact = state.compact.matrix if state.compact is not None else None
+        self._scales = state.compact.scales if state.compact is not None else None
+        self._load_layout(state.names, state.ids, state.member_codes, state.rows, state.owners)
+        self.index = None
+        if state.centroids is not None and state.labels is not None:
+            self.index = IVFIndex.restore(state.centroids, state.labels, state.trained_size,
+                                          nprobe=settings.ANN_NPROBE)
+        self._shared_generation = state.generation
+        self._shared_log_end = 0
+
+    def _sync_shared(self) -> bool:
+        """Replay what was appended to the shared gallery since this worker last looked,
+        remapping first if a new generation was written. Call with _lock held.
+        Returns True if the working store changed."""
+        if self._shared_reload:
+            return False  # a full reload is about to replace the shared gallery
+        while True:
+            generation, log_end = self.shared.head()
+            if generation <= 0 or (generation, log_end) == (self._shared_generation, self._shared_log_end):
+                return False
+            try:
+                if generation != self._shared_generation:
+                    self._map_shared(self.shared.load(generation))
+                records = self.shared.read_log(generation, self._shared_log_end, log_end)
+            except FileNotFoundError:
+                if self.shared.generation() == generation:
+                    raise
+                continue  # pruned while we looked: a newer generation is current
+            for record in records:
+                self._replay(record)
+            self._shared_log_end = log_end
+            return True
+
+    def _replay(self, record: dict):
+        """Apply one shared log record. The writer already put any new rows in the shared matrix."""
+        if record["op"] == "set":
+            row, k = record["row"], record["k"]
+            self._size = row + k
+            self._assign(record["id"], record["name"], record["code"], list(range(row, row + k)))
+        else:
+            self._drop(record["id"])
+
+    def _refresh_from_shared(self, force: bool = False):
+        """Catch up with mutations other workers published."""
+        generation, log_end = self.shared.head()
+        if (generation, log_end) == (self._shared_generation, self._shared_log_end):
+            return
+        if not self._lock.acquire(blocking=force):
+            return  # a writer of this worker holds the store; keep serving the current snapshot
+        try:
+            if self._sync_shared():
+                self._publish_snapshot()
+        finally:
+            self._lock.release()
+
+    def attach_shared(self):
+        """Serve the gallery another worker of this deployment already published."""
+        self._refresh_from_shared(force=True)
+        logging.info("Attached to shared gallery generation %d (%d employees, %d templates).",
+                     self._shared_generation, len(self._snapshot.ids), self._snapshot.templates)
+
+    def _changed(self):
+        """Called by every mutation (with the lock held): publish now, later, or at batch end."""
+        self._dirty = True
+        if self._batch_depth:
+            return
+        if self.publish_delay <= 0:
+            self._publish()
+        elif self._publish_timer is None:
+            self._publish_timer = threading.Timer(self.publish_delay, self._publish)
+            self._publish_timer.daemon = True
+            self._publish_timer.start()
+
+    def flush(self):
+        """Publish pending mutations immediately."""
+        with self._lock:
+            if self._dirty:
+                self._publish()
+
+    @contextmanager
+    def batch(self):
+        """Group several mutations into a single published version."""
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._dirty:
+                    self._publish()
+
+    # ---------- mutations ----------
+
+    def _load_working(self, names: List[str], embeddings: np.ndarray, ids: List[str], member_codes: List[str],
+                      owners: Optional[np.ndarray] = None):
+        rows = len(embeddings)
+        self._matrix = np.empty((max(rows, 16), self.dim), dtype=np.float32)
+        self._matrix[:rows] = embeddings
+        self._compact = self._scales = None
+        if self.precision != "float32":
+            compact, scales = quantize_rows(self._matrix[:rows], self.precision)
+            self._compact = np.empty((len(self._matrix), self.dim), dtype=compact.dtype)
+            self._compact[:rows] = compact
+            if scales is not None:
+                self._scales = np.empty(len(self._matrix), dtype=np.float32)
+                self._scales[:rows] = scales
+        self._load_layout(names, ids, member_codes, rows, owners)
+
+    def _load_layout(self, names: List[str], ids: List[str], member_codes: List[str], rows: int,
+                     owners: Optional[np.ndarray]):
+        """Employee lists and row bookkeeping for the first `rows` rows of the matrix."""
+        n = len(ids)
+        self.names = list(names)
+        self.ids = list(ids)
+        self.member_codes = list(member_codes)
+        self._owner = np.empty(self.capacity, dtype=np.int32)
+        self._rank = np.empty(self.capacity, dtype=np.uint8)
+        if owners is None:
+            self._owner[:rows] = np.arange(rows)
+            self._rank[:rows] = 0
+        else:
+            # rows keep their order; a row's rank is its position among its employee's rows
+            owners = np.asarray(owners, dtype=np.int64)
+            counts = np.bincount(owners, minlength=n)
+            if rows and (counts.min() < 1 or counts.max() > MAX_TEMPLATES):
+                raise ValueError(f"Every employee needs 1..{MAX_TEMPLATES} template rows")
+            by_owner = np.argsort(owners, kind="stable")
+            self._owner[:rows] = owners
+            self._rank[by_owner] = np.arange(rows) - np.repeat(np.cumsum(counts) - counts, counts)
+        self._size = rows
+        self._dead = 0
+        self._slot_of = {emp_id: slot for slot, emp_id in enumerate(self.ids)}
+        if owners is None:
+            self._rows_of = [[row] for row in range(rows)]
+        else:
+            self._rows_of = [[] for _ in range(n)]
+            for row, slot in zip(by_owner.tolist(), owners[by_owner].tolist()):
+                self._rows_of[slot].append(row)
+
+    def update(self, names: List[str], embeddings: np.ndarray, ids: List[str], member_codes: List[str], # <-- ADD member_codes here
+               owners: Optional[np.ndarray] = None):
         """
         Updates the entire cache with fresh data from the database.
+        With templates, embeddings has one row per template and owners[row] is the
+        position of its employee in names/ids/member_codes (None = one row each).
         """
-        self.names = names
-        self.embeddings = embeddings
-        self.ids = ids
-        self.member_codes = member_codes
-        print(f"Cache updated with {len(names)} embeddings.")
+        with self._lock:
+            self._load_working(names, embeddings, ids, member_codes, owners)
+            self._rebuild_index()
+            self._pending_ops = []  # superseded by the full reload
+            self._shared_reload = self.shared is not None
+            # a full reload is published straight away (no coalescing delay)
+            self._dirty = True
+            if not self._batch_depth:
+                self._publish()
+        logging.info("Cache updated with %d embeddings.", len(names))
+
+    def _rebuild_index(self):
+        """Build the ANN index when enabled and the gallery is large enough; small galleries use brute force."""
+        self.index = None
+        if not settings.ANN_ENABLED or self._size - self._dead < settings.ANN_MIN_SIZE:
+            return
+        if self._dead:
+            self._compact_rows()  # train on, and list, live rows only
+        index = IVFIndex(nlist=settings.ANN_NLIST or None, nprobe=settings.ANN_NPROBE)
+        index.build(self.embeddings)
+        self.index = index
+
+    def _index_rows(self, rows: List[int]):
+        """Keep an existing ANN index in step with newly assigned rows; _tidy() builds or retrains it."""
+        if self.index is None:
+            return
+        if self._size - self._dead < settings.ANN_MIN_SIZE:
+            self.index = None
+            return
+        for row in rows:
+            self.index.add(row, self._matrix[row])
+
+    def _templates(self, emp_id: str, embedding: np.ndarray) -> np.ndarray:
+        templates = as_templates(embedding, self.dim)
+        if not 1 <= len(templates) <= MAX_TEMPLATES:
+            raise ValueError(f"Employee {emp_id} needs 1..{MAX_TEMPLATES} embeddings, got {len(templates)}")
+        return templates
+
+    def _assign(self, emp_id: str, name: str, member_code: str, rows: List[int]) -> bool:
+        """Make `rows` (already written) an employee's templates, first template first,
+        retiring any they had. Returns True if they were already present."""
+        slot = self._slot_of.get(emp_id)
+        existed = slot is not None
+        if existed:
+            self.names[slot] = name
+            self.member_codes[slot] = member_code
+            self._kill_rows(self._rows_of[slot])
+        else:
+            slot = len(self.ids)
+            self.names.append(name)
+            self.ids.append(emp_id)
+            self.member_codes.append(member_code)
+            self._slot_of[emp_id] = slot
+            self._rows_of.append([])
+        self._owner[rows] = slot
+        self._rank[rows] = np.arange(len(rows))
+        self._rows_of[slot] = rows
+        self._index_rows(rows)
+        return existed
+
+    def _drop(self, emp_id: str) -> Optional[str]:
+        """Retire an employee's slot and templates. Returns their name, or None if absent."""
+        slot = self._slot_of.pop(emp_id, None)
+        if slot is None:
+            return None
+
+        name = self.names[slot]
+        self._kill_rows(self._rows_of[slot])
+        last = len(self.ids) - 1
+        if slot != last:
+            # move the last employee into the freed slot and repoint their rows
+            self.names[slot] = self.names[last]
+            self.ids[slot] = self.ids[last]
+            self.member_codes[slot] = self.member_codes[last]
+            self._slot_of[self.ids[slot]] = slot
+            self._rows_of[slot] = self._rows_of[last]
+            self._owner[self._rows_of[slot]] = slot
+        self.names.pop()
+        self.ids.pop()
+        self.member_codes.pop()
+        self._rows_of.pop()
+
+        if self.index is not None and self._size - self._dead < settings.ANN_MIN_SIZE:
+            self.index = None
+        return name
+
+    def _apply_upsert(self, emp_id: str, name: str, member_code: str, embedding: np.ndarray) -> bool:
+        """Write one employee and their templates ((512,) or (k,512)) into the working store,
+        replacing any templates they had. Returns True if they were already present."""
+        existed = self._assign(emp_id, name, member_code, self._append_rows(self._templates(emp_id, embedding)))
+        self._tidy()
+        return existed
+
+    def _apply_remove(self, emp_id: str) -> Optional[str]:
+        """Drop one employee and their templates from the working store. Returns their name, or None if absent."""
+        name = self._drop(emp_id)
+        if name is not None:
+            self._tidy()
+        return name
 
     def update_or_add_employee(self, emp_id: str, name: str, member_code: str, embedding: np.ndarray):
         """
         Updates an existing employee's details in the cache,
         or adds them if they don't exist.
         """
-        try:
-            idx = self.ids.index(emp_id)
-            self.names[idx] = name
-            self.member_codes[idx] = member_code 
-            self.embeddings[idx] = embedding
-            print(f"Updated '{name}' (ID: {emp_id}) in cache.")
-        except ValueError:
-            self.names.append(name)
-            self.ids.append(emp_id)
-            self.member_codes.append(member_code)
-            if self.embeddings.size == 0:
-                self.embeddings = np.expand_dims(embedding, axis=0)
-            else:
-                self.embeddings = np.vstack([self.embeddings, embedding])
-            print(f"Added new employee '{name}' (ID: {emp_id}) to cache.")
+        with self._lock:
+            if self.shared is not None:
+                # replayed against the newest shared generation at publish time
+                self._pending_ops.append(("upsert", emp_id, name, member_code,
+                                          self._templates(emp_id, np.array(embedding, dtype=np.float32))))
+                self._changed()
+                logging.debug("Queued '%s' (ID: %s) for the shared gallery.", name, emp_id)
+                return
+            existed = self._apply_upsert(emp_id, name, member_code, embedding)
+            self._changed()
+        if existed:
+            logging.debug("Updated '%s' (ID: %s) in cache.", name, emp_id)
+        else:
+            logging.debug("Added new employee '%s' (ID: %s) to cache.", name, emp_id)
+
+    def upsert_many(self, entries: List[Tuple[str, str, str, np.ndarray]]) -> int:
+        """
+        Adds or updates many (emp_id, name, member_code, embedding) entries and
+        publishes them as one version, so readers switch to the whole set at once.
+        """
+        if not entries:
+            return 0
+        with self.batch():
+            for emp_id, name, member_code, embedding in entries:
+                if self.shared is not None:
+                    self._pending_ops.append(("upsert", emp_id, name, member_code,
+                                              self._templates(emp_id, np.array(embedding, dtype=np.float32))))
+                else:
+                    self._apply_upsert(emp_id, name, member_code, embedding)
+            self._changed()
+        logging.debug("Upserted %d employees in cache.", len(entries))
+        return len(entries)
 
     def remove_employee(self, emp_id: str) -> bool:
         """
         Removes an employee from the cache by their ID.
         Returns True if successful, False if the employee was not found.
         """
-        try:
-            idx = self.ids.index(emp_id)
-
-            self.ids.pop(idx)
-            name = self.names.pop(idx)
-            self.member_codes.pop(idx)
-            self.embeddings = np.delete(self.embeddings, idx, axis=0)
-            
-            print(f"Removed '{name}' (ID: {emp_id}) from cache.")
-            return True
-        except ValueError:
-            print(f"Attempted to remove non-existent employee (ID: {emp_id}) from cache.")
+        with self._lock:
+            if self.shared is not None:
+                known = emp_id in self.snapshot().ids or any(op[1] == emp_id for op in self._pending_ops)
+                if known:
+                    self._pending_ops.append(("remove", emp_id))
+                    self._changed()
+                    logging.debug("Queued removal of ID %s from the shared gallery.", emp_id)
+                    return True
+                name = None
+            else:
+                name = self._apply_remove(emp_id)
+                if name is not None:
+                    self._changed()
+
+        if name is None:
+            logging.debug("Attempted to remove non-existent employee (ID: %s) from cache.", emp_id)
             return False
+        logging.debug("Removed '%s' (ID: %s) from cache.", name, emp_id)
+        return True
 
 # Global cache instance
-embedding_cache = EmbeddingCache()
\ No newline at end of file
+embedding_cache = EmbeddingCache(
+    shared=SharedGallery(settings.SHARED_GALLERY_DIR) if settings.SHARED_GALLERY_DIR else None
+)
@@ -10,6 +10,32 @@ class Settings(BaseSettings):
 
     # --- Model Configuration ---
     MODEL_PATH: str = r"model/buffalo_l/glintr100.onnx"
+    # ArcFace is run once at each of these batch sizes at startup ("" = no warm-up)
+    MODEL_WARMUP_BATCH_SIZES: str = "1,8,32"
+
+    # --- ONNX Runtime (ArcFace, SCRFD) ---
+    # Thread counts per session; 0 = ORT default (intra-op: all cores)
+    ORT_INTRA_OP_THREADS: int = 0
+    ORT_INTER_OP_THREADS: int = 0  # only used when ORT_EXECUTION_MODE="parallel"
+    ORT_EXECUTION_MODE: str = "sequential"  # "sequential" or "parallel"
+    ORT_GRAPH_OPTIMIZATION: str = "all"  # "disable", "basic", "extended" or "all"
+    # Optimized graphs (up to "extended"; "all"'s CPU-specific layout passes run at each load)
+    # are saved here by the first boot and reused by later ones ("" = off)
+    ORT_OPTIMIZED_MODEL_DIR: str = "model/optimized"
+
+    # --- Face Detector ---
+    # Backends: "mtcnn" (TensorFlow), "haar" (OpenCV), "scrfd" (ONNX Runtime).
+    # The fallback runs only when the primary detector finds nothing; "" disables it.
+    DETECTOR_BACKEND: str = "mtcnn"
+    DETECTOR_FALLBACK: str = "haar"
+    DETECTOR_MODEL_PATH: str = r"model/buffalo_l/det_10g.onnx"
+    DETECTOR_INPUT_SIZE: int = 640
+    DETECTOR_SCORE_THRESHOLD: float = 0.5
+    DETECTOR_NMS_THRESHOLD: float = 0.4
+
+    # Detection runs on a copy whose longer side is at most DETECTION_MAX_SIDE px
+    # (JPEGs are decoded reduced); alignment still uses full resolution. 0 = off.
+    DETECTION_MAX_SIDE: int = 1280
 
     # --- Directory Configuration ---
     IMAGE_UPLOAD_FOLDER: str = "uploads"
@@ -18,6 +44,118 @@ class Settings(BaseSettings):
     # --- Recognition Threshold ---
     RECOGNITION_THRESHOLD: float = 0.45
 
+    # --- Approximate Nearest-Neighbour Gallery Search ---
+    # IVF index (pure NumPy) used once the gallery has ANN_MIN_SIZE members;
+    # smaller galleries are always brute-forced. ANN_NLIST=0 picks ~4*sqrt(N) lists.
+    ANN_ENABLED: bool = False
+    ANN_MIN_SIZE: int = 20000
+    ANN_NLIST: int = 0
+    ANN_NPROBE: int = 8
+
+    # --- Embedding Cache ---
+    # Mutations within this window are published to readers as one snapshot (0 = publish immediately).
+    CACHE_PUBLISH_DELAY_MS: float = 20.0
+    # Directory (ideally on tmpfs, e.g. /dev/shm/facerecog) holding a gallery shared
+    # by all uvicorn workers through memory-mapped files. Empty = per-process cache.
+    SHARED_GALLERY_DIR: str = ""
+    # On-disk gallery snapshot (.npy + sidecar, stamped with a DB watermark) that
+    # startup memory-maps before reading only the rows changed since. Empty = full DB scan.
+    GALLERY_SNAPSHOT_DIR: str = "gallery_snapshot"
+    # Rows stamped up to this long before the watermark are re-read too, so writes from
+    # transactions still in flight when the watermark was taken are not missed.
+    GALLERY_SNAPSHOT_MARGIN_SECONDS: float = 300.0
+
+    # --- Gallery Precision ---
+    # "float16" or "int8" (per-row scale) scores a compact copy of the gallery and
+    # re-ranks the best GALLERY_RERANK_CANDIDATES rows in float32; "float32" scores directly.
+    GALLERY_PRECISION: str = "float32"
+    GALLERY_RERANK_CANDIDATES: int = 8
+
+    # --- Gallery Templates ---
+    # 1 (default) = one averaged embedding per employee, replaced on every upload.
+    # Set GALLERY_MAX_TEMPLATES=5 (for example) to keep every enrolled photo as its own
+    # template, up to that many; an employee then scores as their best-matching
+    # template and uploads add to the stored templates. Employee.embedding then holds
+    # k*512 float32 values, which code expecting a single (512,) embedding cannot read.
+    GALLERY_MAX_TEMPLATES: int = 1
+    GALLERY_TEMPLATE_PRUNING: str = "redundant"  # over the cap: drop the most redundant template, or "oldest"
+
+    # --- Inference Batching ---
+    # Faces from concurrent /recognize calls are embedded together; a batch is
+    # flushed at BATCH_MAX_SIZE faces or after BATCH_MAX_WAIT_MS, whichever is first.
+    BATCHING_ENABLED: bool = True
+    BATCH_MAX_SIZE: int = 32
+    BATCH_MAX_WAIT_MS: float = 5.0
+    BATCH_QUEUE_SIZE: int = 512
+
+    # --- Inference Process Pool ---
+    # "process" moves decoding, detection and alignment of /recognize, and all of
+    # /upload's image processing, to INFERENCE_PROCESSES child processes (0 = the
+    # CPUs divided among WEB_CONCURRENCY uvicorn workers, each of which has its own
+    # pool) that each load the detector and ArcFace once; images reach them
+    # through shared memory. "thread" runs everything on this worker's threadpool.
+    INFERENCE_EXECUTOR: str = "thread"
+    INFERENCE_PROCESSES: int = 0
+    WEB_CONCURRENCY: int = 1  # uvicorn workers on this host (uvicorn reads it too, as its --workers default)
+    INFERENCE_ORT_THREADS: int = 1  # ORT intra-op threads in each child
+
+    # --- Bulk Enrollment (/upload/batch) ---
+    ENROLL_WORKERS: int = 4  # threads running detection + ArcFace for a job
+    ENROLL_DB_BATCH_SIZE: int = 500  # rows per bulk upsert
+
+    # --- Enrollment Image Quality (/upload, /upload/batch) ---
+    # Every photo is first scored on a small decode (sharpness, exposure, size);
+    # only the best ENROLL_TOP_K go on to detection and ArcFace.
+    ENROLL_TOP_K: int = 5  # 0 = embed every image that passes the checks
+    ENROLL_SCORE_MAX_SIDE: int = 320  # px, longer side of the scoring decode
+    ENROLL_MIN_IMAGE_SIDE: int = 112  # px, shorter side at full resolution
+    ENROLL_MIN_SHARPNESS: float = 5.0  # Laplacian variance on the scoring decode
+    ENROLL_MIN_BRIGHTNESS: float = 40.0  # mean grey level, 0-255
+    ENROLL_MAX_BRIGHTNESS: float = 220.0
+
+    # --- Recognition Log Writer ---
+    # Recognitions are buffered in memory and written with one multi-row INSERT
+    # every LOG_FLUSH_INTERVAL_MS or LOG_FLUSH_MAX_ROWS rows, whichever is first.
+    LOG_FLUSH_INTERVAL_MS: float = 250.0
+    LOG_FLUSH_MAX_ROWS: int = 500
+    LOG_BUFFER_SIZE: int = 20000  # events beyond this are rejected (and counted) rather than queued
+    LOG_FLUSH_MAX_RETRIES: int = 5  # a batch that keeps failing is dropped after this many attempts
+
+    # --- Recognition Cooldown ---
+    # A person is logged at most once per RECOGNITION_COOLDOWN_SECONDS. "memory" is
+    # per worker; "sqlite" shares the window between all workers on the host.
+    RECOGNITION_COOLDOWN_SECONDS: float = 60.0
+    COOLDOWN_BACKEND: str = "memory"
+    COOLDOWN_SQLITE_PATH: str = "cooldown.db"
+    COOLDOWN_MAX_ENTRIES: int = 100000
+
+    # --- Recognition Result Cache ---
+    # Level one: hash of the raw upload -> whole /recognize result.
+    # Level two: hash of each preprocessed face -> embedding. Only a bit-identical
+    # crop hits (a similarity hash would hand one person's embedding to another),
+    # so it helps mainly with re-sent frames that were re-encoded; off by default.
+    # Both are cleared whenever the gallery changes.
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_TTL_SECONDS: float = 5.0
+    RESULT_CACHE_MAX_ENTRIES: int = 1024
+    FACE_CACHE_ENABLED: bool = False
+    FACE_CACHE_TTL_SECONDS: float = 30.0
+    FACE_CACHE_MAX_ENTRIES: int = 4096
+    RESULT_CACHE_MAX_MB: int = 64  # per level
+
+    # --- Streaming Recognition (/recognize/stream) ---
+    # Faces are tracked across frames; a track is re-embedded only when it is new,
+    # its face got STREAM_QUALITY_GAIN times better, or STREAM_REFRESH_SECONDS passed.
+    STREAM_IOU_THRESHOLD: float = 0.3
+    STREAM_MAX_MISSED_FRAMES: int = 5
+    STREAM_REFRESH_SECONDS: float = 2.0
+    STREAM_QUALITY_GAIN: float = 1.25
+    STREAM_VOTE_WINDOW: int = 5  # identity is the majority of a track's last N embeddings
+    STREAM_MIN_VOTES: int = 2  # votes needed before a track's identity is logged
+
+    # --- Attendance Queries ---
+    DATEWISE_MAX_PAGE_SIZE: int = 5000  # upper bound for "limit" on /recognitions/datewise
+
     class Config:
         # If you use a .env file, settings will be loaded from it
         env_file = ".env"
@@ -0,0 +1,189 @@
+# app/cooldown.py
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Type
+
+from .config import settings
+
+
+class CooldownStore:
+    """Remembers who was logged recently so a person standing in front of the
+    kiosk is written once per cooldown window, not once per frame.
+
+    `check_and_set(key)` is a single atomic step: it returns True (and starts a
+    new window) when `key` is not cooling down, False when it is. `release(key)`
+    undoes a window whose write did not happen. Entries expire after `ttl`
+    seconds and at most `max_entries` are kept, so the store never grows with
+    the number of people seen.
+    """
+    name = "base"
+    blocking = False  # True when calls do I/O: async callers run them on the threadpool
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 100000):
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self.checks = 0
+        self.hits = 0  # writes suppressed by the cooldown
+        self.expired = 0  # entries removed because their window ended
+        self.evicted = 0  # live entries dropped to stay within max_entries
+
+    def check_and_set(self, key: str, now: Optional[float] = None) -> bool:
+        raise NotImplementedError
+
+    def release(self, key: str):
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "ttl_seconds": self.ttl,
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "checks": self.checks,
+            "hits": self.hits,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+class MemoryCooldownStore(CooldownStore):
+    """Per-process store. Every window has the same length, so insertion order is
+    expiry order: expired entries are popped from the front of an OrderedDict in
+    amortised O(1), and the oldest entry is the one evicted when full.
+    """
+    name = "memory"
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 100000):
+        super().__init__(ttl, max_entries)
+        self._expires: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._expires:
+            key, expires_at = next(iter(self._expires.items()))
+            if expires_at > now:
+                break
+            self._expires.popitem(last=False)
+            self.expired += 1
+
+    def check_and_set(self, key: str, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        with self._lock:
+            self.checks += 1
+            self._expire(now)
+            if key in self._expires:
+                self.hits += 1
+                return False
+            self._expires[key] = now + self.ttl
+            if len(self._expires) > self.max_entries:
+                self._expires.popitem(last=False)
+                self.evicted += 1
+            return True
+
+    def release(self, key: str):
+        with self._lock:
+            self._expires.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+
+class SQLiteCooldownStore(CooldownStore):
+    """Cross-process store in a local SQLite file, so every uvicorn worker on the
+    host shares one cooldown window per person.
+
+    The check-and-set is one UPSERT that only overwrites an expired row; SQLite's
+    write lock makes it atomic across processes, and a changed-row count of 1
+    means "not cooling down". Expired rows are swept every `sweep_every` calls
+    (and rows beyond `max_entries`, oldest first). Counters are per process.
+    """
+    name = "sqlite"
+    blocking = True  # may wait up to 5s for another worker's write lock
+
+    def __init__(self, path: str = "cooldown.db", ttl: float = 60.0, max_entries: int = 100000,
+                 sweep_every: int = 256):
+        super().__init__(ttl, max_entries)
+        self.path = path
+        self.sweep_every = max(1, int(sweep_every))
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._since_sweep = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cooldown (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cooldown_expires_at ON cooldown (expires_at)")
+            self._conn = conn
+        return self._conn
+
+    def _sweep(self, conn: sqlite3.Connection, now: float):
+        self.expired += conn.execute("DELETE FROM cooldown WHERE expires_at <= ?", (now,)).rowcount
+        self.evicted += conn.execute(
+            "DELETE FROM cooldown WHERE key IN ("
+            " SELECT key FROM cooldown ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+
+    def check_and_set(self, key: str, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        with self._lock:
+            conn = self._connection()
+            self.checks += 1
+            changed = conn.execute(
+                "INSERT INTO cooldown (key, expires_at) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at "
+                "WHERE cooldown.expires_at <= ?",
+                (key, now + self.ttl, now),
+            ).rowcount
+            self._since_sweep += 1
+            if self._since_sweep >= self.sweep_every:
+                self._since_sweep = 0
+                self._sweep(conn, now)
+        if changed:
+            return True
+        self.hits += 1
+        return False
+
+    def release(self, key: str):
+        with self._lock:
+            self._connection().execute("DELETE FROM cooldown WHERE key = ?", (key,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM cooldown").fetchone()[0]
+
+
+COOLDOWN_BACKENDS: Dict[str, Type[CooldownStore]] = {
+    MemoryCooldownStore.name: MemoryCooldownStore,
+    SQLiteCooldownStore.name: SQLiteCooldownStore,
+}
+
+
+def build_cooldown_store(name: Optional[str] = None) -> CooldownStore:
+    """Instantiate a cooldown backend by name ("memory", "sqlite") from settings."""
+    key = (name or settings.COOLDOWN_BACKEND).strip().lower()
+    if key not in COOLDOWN_BACKENDS:
+        raise ValueError(f"Unknown cooldown backend '{key}'. Choose one of: {', '.join(COOLDOWN_BACKENDS)}")
+    logging.info("Using %s recognition cooldown store (%.0fs window)", key, settings.RECOGNITION_COOLDOWN_SECONDS)
+    if key == SQLiteCooldownStore.name:
+        return SQLiteCooldownStore(settings.COOLDOWN_SQLITE_PATH, settings.RECOGNITION_COOLDOWN_SECONDS,
+                                   settings.COOLDOWN_MAX_ENTRIES)
+    return MemoryCooldownStore(settings.RECOGNITION_COOLDOWN_SECONDS, settings.COOLDOWN_MAX_ENTRIES)
+
+
+# Global cooldown store
+recognition_cooldown = build_cooldown_store()
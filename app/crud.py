@@ -1,26 +1,54 @@
 # app/crud.py
 
+import logging
+
 import numpy as np
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, delete, func, insert, or_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.future import select
-from typing import List, Tuple, Optional
+from datetime import date, datetime
+from typing import Dict, List, Tuple, Optional
 
 from . import models, schemas
 
-async def get_employee_by_id(db: AsyncSession, emp_id: str) -> Optional[models.Employee]:
-    """Fetch a single employee by their ID."""
-    result = await db.execute(select(models.Employee).filter(models.Employee.id == emp_id))
+async def _lock_employees(db: AsyncSession, emp_ids: List[str]):
+    """SQLite has no row locks (FOR UPDATE is not emitted there): a write that changes
+    nothing takes its database write lock instead, held until the transaction ends."""
+    if db.bind.dialect.name == "sqlite":
+        await db.execute(update(models.Employee).where(models.Employee.id.in_(emp_ids))
+                         .values(updated_at=models.Employee.updated_at))
+
+async def get_employee_by_id(db: AsyncSession, emp_id: str, for_update: bool = False) -> Optional[models.Employee]:
+    """Fetch a single employee by their ID.
+    for_update locks the row until the session commits, for a read-modify-write of its templates."""
+    stmt = select(models.Employee).filter(models.Employee.id == emp_id)
+    if for_update:
+        await _lock_employees(db, [emp_id])
+        stmt = stmt.with_for_update()
+    result = await db.execute(stmt)
     return result.scalars().first()
 
+async def get_embeddings_for_update(db: AsyncSession, emp_ids: List[str]) -> Dict[str, bytes]:
+    """Stored embedding blobs of the employees in emp_ids that exist, locked until the session commits."""
+    if not emp_ids:
+        return {}
+    await _lock_employees(db, emp_ids)
+    result = await db.execute(select(models.Employee.id, models.Employee.embedding)
+                              .filter(models.Employee.id.in_(emp_ids)).with_for_update())
+    return dict(result.all())
+
 async def create_employee(
     db: AsyncSession, 
     emp_id: str, 
     name: str, 
     member_code: str, 
     embedding: np.ndarray, 
-    image_path: str
+    image_path: str,
+    commit: bool = True
 ):
-    """Create a new employee record in the database."""
+    """Create a new employee record in the database.
+    commit=False only flushes, leaving the commit (and any row lock) to the caller."""
     db_employee = models.Employee(
         id=emp_id,
         name=name,
@@ -29,6 +57,9 @@ async def create_employee(
         image_path=image_path
     )
     db.add(db_employee)
+    if not commit:
+        await db.flush()
+        return db_employee
     await db.commit()
     await db.refresh(db_employee)
     return db_employee
@@ -39,19 +70,45 @@ async def update_employee(
     name: str,
     member_code: Optional[str],
     embedding: np.ndarray,
-    image_path: str
+    image_path: str,
+    commit: bool = True
 ):
-    """Fetches an employee by ID and updates their details."""
+    """Fetches an employee by ID and updates their details.
+    commit=False only flushes, leaving the commit (and any row lock) to the caller."""
     db_employee = await get_employee_by_id(db, emp_id)
     if db_employee:
         db_employee.name = name
         db_employee.member_code = member_code
         db_employee.embedding = embedding.tobytes()
         db_employee.image_path = image_path
+        if not commit:
+            await db.flush()
+            return db_employee
         await db.commit()
         await db.refresh(db_employee)
     return db_employee
 
+async def bulk_upsert_employees(db: AsyncSession, rows: List[dict]) -> int:
+    """Insert or update many employees with one multi-row upsert and one commit.
+    Each row is a dict of id, name, member_code, embedding (np.ndarray, (512,) or (k,512) templates)
+    and image_path.
+    """
+    if not rows:
+        return 0
+    latest = {r["id"]: r for r in rows}  # one statement may not touch a row twice: last one wins
+    values = [{"id": r["id"], "name": r["name"], "member_code": r["member_code"],
+               "embedding": np.asarray(r["embedding"], dtype=np.float32).tobytes(),
+               "image_path": r["image_path"]} for r in latest.values()]
+    stmt = _upsert_insert(db, models.Employee).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Employee.id],
+        set_={**{col: getattr(stmt.excluded, col) for col in ("name", "member_code", "embedding", "image_path")},
+              "updated_at": func.now()},
+    )
+    await db.execute(stmt)
+    await db.commit()
+    return len(values)
+
 async def delete_employee_by_id(db: AsyncSession, emp_id: str) -> Optional[models.Employee]:
     """Deletes an employee from the database by their ID."""
     db_employee = await get_employee_by_id(db, emp_id)
@@ -60,8 +117,8 @@ async def delete_employee_by_id(db: AsyncSession, emp_id: str) -> Optional[model
         await db.commit()
     return db_employee
 
-async def load_all_embeddings(db: AsyncSession) -> Tuple[List[str], np.ndarray, List[str], List[str]]:
-    """Load all employee names, IDs, and embeddings from the database."""
+async def load_all_embeddings(db: AsyncSession) -> Tuple[List[str], np.ndarray, List[str], List[str], Optional[np.ndarray]]:
+    """Load all employee names, IDs, and embeddings (templates) from the database."""
     result = await db.execute(select(
         models.Employee.name, 
         models.Employee.embedding, 
@@ -69,84 +126,252 @@ async def load_all_embeddings(db: AsyncSession) -> Tuple[List[str], np.ndarray,
         models.Employee.member_code
     ))
     
-    names, embeddings, ids, member_codes = [], [], [], []
-    for name, emb_bytes, emp_id, member_code in result.all():
-        if len(emb_bytes) % 4 == 0:
-            emb = np.frombuffer(emb_bytes, dtype=np.float32)
-            if emb.shape[0] == 512:
-                embeddings.append(emb)
-                names.append(name)
-                ids.append(emp_id)
-                member_codes.append(member_code)
-
-    return names, np.array(embeddings), ids, member_codes
+    return _rows_to_gallery(result.all())
+
+def _rows_to_gallery(rows) -> Tuple[List[str], np.ndarray, List[str], List[str], Optional[np.ndarray]]:
+    """(name, embedding blob, id, member_code) rows -> gallery lists, one (T,512) template matrix
+    and the owner (list position) of every template row; owners is None when every employee
+    has a single embedding. A blob holds k*512 float32 (k templates back to back).
+    Valid blobs are joined and decoded with a single frombuffer instead of one array per row.
+    """
+    names, blobs, ids, member_codes, counts = [], [], [], [], []
+    for name, emb_bytes, emp_id, member_code in rows:
+        if emb_bytes and len(emb_bytes) % (512 * 4) == 0:
+            blobs.append(emb_bytes)
+            names.append(name)
+            ids.append(emp_id)
+            member_codes.append(member_code)
+            counts.append(len(emb_bytes) // (512 * 4))
+
+    embeddings = np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(-1, 512)
+    owners = None
+    if len(embeddings) != len(ids):
+        owners = np.repeat(np.arange(len(ids), dtype=np.int32), counts)
+    return names, embeddings, ids, member_codes, owners
+
+async def load_embeddings_changed_since(db: AsyncSession, since) -> Tuple[List[str], np.ndarray, List[str], List[str], Optional[np.ndarray]]:
+    """Load only the employees written at or after `since` (the snapshot watermark minus a safety margin)."""
+    result = await db.execute(select(
+        models.Employee.name,
+        models.Employee.embedding,
+        models.Employee.id,
+        models.Employee.member_code
+    ).filter(models.Employee.updated_at >= since))
+    return _rows_to_gallery(result.all())
+
+async def get_all_employee_ids(db: AsyncSession) -> List[str]:
+    """All employee IDs (no blobs), used to drop deleted members from a snapshot."""
+    result = await db.execute(select(models.Employee.id))
+    return result.scalars().all()
+
+async def get_embeddings_watermark(db: AsyncSession):
+    """Latest Employee.updated_at in the table (None when empty). It is a database timestamp,
+    but a transaction that started earlier can still commit an older one: readers of
+    "changed since" subtract GALLERY_SNAPSHOT_MARGIN_SECONDS."""
+    result = await db.execute(select(func.max(models.Employee.updated_at)))
+    return result.scalar()
 
 async def get_all_employees(db: AsyncSession) -> List[models.Employee]:
     """Fetches all employee records from the database."""
     result = await db.execute(select(models.Employee))
     return result.scalars().all()
 
-# async def create_recognition_log(
-#     db: AsyncSession, 
-#     emp_id: str, 
-#     name: str, 
-#     member_code: str
-# ):
-#     """Creates a new entry in the recognition_log table."""
-#     db_log = models.RecognitionLog(
-#         employee_id=emp_id,
-#         name=name,
-#         member_code=member_code
-#     )
-#     db.add(db_log)
-#     await db.commit()
-#     return db_log
-
-
-async def create_recognition_log(
-    db: AsyncSession, 
-    emp_id: str, 
-    name: str, 
-    member_code: str
-):
-    """Creates a new entry in the recognition_log table."""
-    db_log = models.RecognitionLog(
-        employee_id=emp_id,
-        name=name,
-        member_code=member_code
-    )
-    db.add(db_log)
+async def insert_recognition_logs(db: AsyncSession, rows: List[dict]) -> int:
+    """Writes many recognition_log rows with one multi-row INSERT and one commit, then folds
+    them into daily_attendance in a transaction of its own.
+    Each row is a dict of employee_id, name, member_code, recognized_at and source.
+    The raw rows are the record: if the summary cannot be written (e.g. a dialect without
+    ON CONFLICT) it is logged and left to `python -m app.attendance rebuild`.
+    """
+    if not rows:
+        return 0
+    await db.execute(insert(models.RecognitionLog).values(rows))
     await db.commit()
-    await db.refresh(db_log)  # ✅ ensures ID and timestamps are loaded
-    return db_log
+    try:
+        await upsert_daily_attendance(db, rows)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        logging.exception("daily_attendance update for %d recognition rows failed; "
+                          "rebuild it with python -m app.attendance rebuild", len(rows))
+    return len(rows)
+
+
+def _upsert_insert(db: AsyncSession, table):
+    """Dialect-specific INSERT that supports on_conflict_do_update (PostgreSQL, SQLite)."""
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"Upserts are not implemented for {dialect}")
+
+
+def summarize_daily_attendance(rows: List[dict]) -> List[dict]:
+    """Fold recognition rows into one (employee, day) summary row each."""
+    summary: Dict[Tuple[str, date], dict] = {}
+    for r in rows:
+        if r["employee_id"] is None:
+            continue  # not a member: nothing to summarise (and NULL cannot be part of the key)
+        seen = r["recognized_at"]
+        key = (r["employee_id"], seen.date())
+        s = summary.get(key)
+        if s is None:
+            summary[key] = {"employee_id": key[0], "day": key[1], "name": r["name"],
+                            "member_code": r["member_code"], "first_seen": seen, "last_seen": seen, "count": 1}
+        else:
+            s["first_seen"] = min(s["first_seen"], seen)
+            s["last_seen"] = max(s["last_seen"], seen)
+            s["count"] += 1
+    return list(summary.values())
+
+
+async def upsert_daily_attendance(db: AsyncSession, rows: List[dict]):
+    """Merge a batch of recognition rows into daily_attendance (no commit).
+    One multi-row upsert per batch; needs PostgreSQL or SQLite (ON CONFLICT).
+    """
+    summary = summarize_daily_attendance(rows)
+    if not summary:
+        return
+    stmt = _upsert_insert(db, models.DailyAttendance).values(summary)
+    if db.bind.dialect.name == "postgresql":
+        least, greatest = func.least, func.greatest
+    else:
+        least, greatest = func.min, func.max  # SQLite: scalar min()/max() with two arguments
+
+    table = models.DailyAttendance
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.employee_id, table.day],
+        set_={
+            "name": stmt.excluded.name,
+            "member_code": stmt.excluded.member_code,
+            "first_seen": least(table.first_seen, stmt.excluded.first_seen),
+            "last_seen": greatest(table.last_seen, stmt.excluded.last_seen),
+            "count": table.count + stmt.excluded.count,
+        },
+    )
+    await db.execute(stmt)
     
     
     
     
 ########### Attendance log #############
 
-async def get_recognitions_grouped_by_date(db: AsyncSession):
-    result = await db.execute(
-        select(
-            models.RecognitionLog.employee_id,
-            models.RecognitionLog.name,
-            models.RecognitionLog.member_code,
-            models.RecognitionLog.recognized_at
-        ).order_by(models.RecognitionLog.recognized_at.desc())
-    )
-    rows = result.fetchall()
-
-    from collections import defaultdict
-    grouped = defaultdict(list)
-    for employee_id, name, member_code, recognized_at in rows:
-        if not recognized_at:
-            continue
-        date_str = recognized_at.strftime("%Y-%m-%d")
-        time_str = recognized_at.strftime("%H:%M:%S")
-        grouped[date_str].append({
-            "employee_id": employee_id,
+async def get_recognitions_datewise(
+    db: AsyncSession,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    employee_id: Optional[str] = None,
+    member_code: Optional[str] = None,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+) -> Tuple[Dict[str, List[dict]], Optional[Tuple[datetime, int]]]:
+    """Recognition logs in [start, end), newest first, grouped by date.
+
+    Filtering and ordering run in SQL on the recognized_at index; rows are read
+    through a server-side cursor and grouped as they arrive, so only the
+    requested window is ever materialised. Pages are keyset-based: pass the
+    returned (recognized_at, id) as `after` to continue. The second value is
+    None when there are no more rows.
+    """
+    log = models.RecognitionLog
+    stmt = select(log.id, log.employee_id, log.name, log.member_code, log.recognized_at)
+    conditions = [log.recognized_at.isnot(None)]
+    if start is not None:
+        conditions.append(log.recognized_at >= start)
+    if end is not None:
+        conditions.append(log.recognized_at < end)
+    if employee_id:
+        conditions.append(log.employee_id == employee_id)
+    if member_code:
+        conditions.append(log.member_code == member_code)
+    if after is not None:
+        after_at, after_id = after
+        conditions.append(or_(log.recognized_at < after_at,
+                              and_(log.recognized_at == after_at, log.id < after_id)))
+    stmt = stmt.where(*conditions).order_by(log.recognized_at.desc(), log.id.desc())
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)  # one extra row tells whether another page exists
+
+    grouped: Dict[str, List[dict]] = {}
+    last: Optional[Tuple[datetime, int]] = None
+    has_more = False
+    count = 0
+    result = await db.stream(stmt)
+    async for row_id, emp_id, name, code, recognized_at in result:
+        if limit is not None and count == limit:
+            has_more = True
+            break
+        count += 1
+        last = (recognized_at, row_id)
+        # rows arrive newest first, so dates are created in descending order
+        grouped.setdefault(recognized_at.strftime("%Y-%m-%d"), []).append({
+            "employee_id": emp_id,
             "name": name,
-            "member_code": member_code,
-            "time": time_str
+            "member_code": code,
+            "time": recognized_at.strftime("%H:%M:%S")
         })
-    return dict(sorted(grouped.items(), reverse=True))
\ No newline at end of file
+    await result.close()
+    return grouped, (last if has_more else None)
+
+
+
+########### Daily attendance summary #############
+
+async def rebuild_daily_attendance(db: AsyncSession, start: Optional[date] = None,
+                                   end: Optional[date] = None) -> int:
+    """Recompute daily_attendance for days in [start, end) (all days by default)
+    from recognition_log with one INSERT ... SELECT ... GROUP BY. Returns the row count.
+    """
+    log, table = models.RecognitionLog, models.DailyAttendance
+    day = func.date(log.recognized_at)
+
+    purge = delete(table)
+    conditions = [log.recognized_at.isnot(None), log.employee_id.isnot(None)]
+    if start is not None:
+        purge = purge.where(table.day >= start)
+        conditions.append(log.recognized_at >= datetime.combine(start, datetime.min.time()))
+    if end is not None:
+        purge = purge.where(table.day < end)
+        conditions.append(log.recognized_at < datetime.combine(end, datetime.min.time()))
+    await db.execute(purge)
+
+    grouped = (
+        select(log.employee_id, day, func.max(log.name), func.max(log.member_code),
+               func.min(log.recognized_at), func.max(log.recognized_at), func.count())
+        .where(*conditions)
+        .group_by(log.employee_id, day)
+    )
+    await db.execute(insert(table).from_select(
+        ["employee_id", "day", "name", "member_code", "first_seen", "last_seen", "count"], grouped
+    ))
+    await db.commit()
+
+    count_stmt = select(func.count()).select_from(table)
+    if start is not None:
+        count_stmt = count_stmt.where(table.day >= start)
+    if end is not None:
+        count_stmt = count_stmt.where(table.day < end)
+    return (await db.execute(count_stmt)).scalar()
+
+
+async def get_daily_attendance(
+    db: AsyncSession,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    employee_id: Optional[str] = None,
+    member_code: Optional[str] = None,
+) -> List[models.DailyAttendance]:
+    """Summary rows for days in [start, end), newest day first."""
+    table = models.DailyAttendance
+    stmt = select(table)
+    if start is not None:
+        stmt = stmt.where(table.day >= start)
+    if end is not None:
+        stmt = stmt.where(table.day < end)
+    if employee_id:
+        stmt = stmt.where(table.employee_id == employee_id)
+    if member_code:
+        stmt = stmt.where(table.member_code == member_code)
+    result = await db.execute(stmt.order_by(table.day.desc(), table.employee_id))
+    return result.scalars().all()
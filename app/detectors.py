@@ -0,0 +1,188 @@
+# app/detectors.py
+
+import logging
+from typing import Dict, List, Optional, Type
+
+import cv2
+import numpy as np
+
+from .config import settings
+
+
+# Every backend returns MTCNN-style dicts:
+#   {"box": [x, y, w, h], "confidence": float | None, "keypoints": {name: (x, y)}}
+# with keypoints named left_eye, right_eye, nose, mouth_left, mouth_right
+# (or an empty dict when the backend has no landmarks).
+# `scale` is the number of full-resolution pixels per pixel of image_bgr, for
+# detectors that run on a downscaled copy but have limits in full-size pixels.
+
+
+class FaceDetector:
+    """Base class for face detector backends."""
+    name = "base"
+
+    def detect(self, image_bgr: np.ndarray, scale: float = 1.0) -> List[dict]:
+        raise NotImplementedError
+
+
+class MTCNNDetector(FaceDetector):
+    """TensorFlow MTCNN. The import is deferred so other backends never load TensorFlow."""
+    name = "mtcnn"
+
+    def __init__(self):
+        from mtcnn import MTCNN
+        self._mtcnn = MTCNN()
+
+    def detect(self, image_bgr: np.ndarray, scale: float = 1.0) -> List[dict]:
+        rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+        return self._mtcnn.detect_faces(rgb) or []
+
+
+class HaarDetector(FaceDetector):
+    """OpenCV Haar cascade: cheap, box only (no keypoints, no confidence)."""
+    name = "haar"
+
+    def __init__(self, min_size: Optional[int] = None):
+        self.min_size = int(min_size if min_size is not None else getattr(settings, "MIN_FACE_SIZE", 50))
+        self._cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+
+    def detect(self, image_bgr: np.ndarray, scale: float = 1.0) -> List[dict]:
+        gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+        min_size = max(1, int(round(self.min_size / scale)))  # min_size is in full-resolution pixels
+        faces = self._cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=3,
+                                               minSize=(min_size, min_size))
+        return [{"box": [int(x), int(y), int(w), int(h)], "confidence": None, "keypoints": {}}
+                for (x, y, w, h) in faces]
+
+
+def _nms(dets: np.ndarray, threshold: float) -> List[int]:
+    """Greedy non-maximum suppression over rows of [x1, y1, x2, y2, score]."""
+    x1, y1, x2, y2, scores = dets[:, 0], dets[:, 1], dets[:, 2], dets[:, 3], dets[:, 4]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(int(i))
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.maximum(0.0, xx2 - xx1 + 1) * np.maximum(0.0, yy2 - yy1 + 1)
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[np.where(ovr <= threshold)[0] + 1]
+    return keep
+
+
+class SCRFDDetector(FaceDetector):
+    """ONNX Runtime SCRFD detector (det_10g.onnx from the buffalo_l pack).
+
+    Runs without TensorFlow and returns five landmarks in the same order as MTCNN.
+    Decoding follows the reference insightface implementation: three strides
+    (8, 16, 32), two anchors per location, distance-encoded boxes and keypoints.
+    """
+    name = "scrfd"
+
+    _STRIDES = (8, 16, 32)
+    _NUM_ANCHORS = 2
+    _KEYPOINT_NAMES = ("left_eye", "right_eye", "nose", "mouth_left", "mouth_right")
+
+    def __init__(self, model_path: Optional[str] = None, input_size: Optional[int] = None,
+                 score_threshold: Optional[float] = None, nms_threshold: Optional[float] = None):
+        from .engine import create_session
+
+        self.model_path = model_path or settings.DETECTOR_MODEL_PATH
+        self.input_size = int(input_size or settings.DETECTOR_INPUT_SIZE)
+        self.score_threshold = score_threshold if score_threshold is not None else settings.DETECTOR_SCORE_THRESHOLD
+        self.nms_threshold = nms_threshold if nms_threshold is not None else settings.DETECTOR_NMS_THRESHOLD
+
+        self._session = create_session(self.model_path)
+        self._input_name = self._session.get_inputs()[0].name
+        self._output_names = [o.name for o in self._session.get_outputs()]
+        self._center_cache: Dict[tuple, np.ndarray] = {}
+
+    def _anchor_centers(self, height: int, width: int, stride: int) -> np.ndarray:
+        key = (height, width, stride)
+        centers = self._center_cache.get(key)
+        if centers is None:
+            centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+            centers = (centers * stride).reshape((-1, 2))
+            centers = np.stack([centers] * self._NUM_ANCHORS, axis=1).reshape((-1, 2))
+            self._center_cache[key] = centers
+        return centers
+
+    def detect(self, image_bgr: np.ndarray, scale: float = 1.0) -> List[dict]:
+        size = self.input_size
+        h, w = image_bgr.shape[:2]
+
+        # letterbox into a size x size canvas, keeping the aspect ratio
+        if h > w:
+            new_h, new_w = size, max(1, int(size * w / h))
+        else:
+            new_h, new_w = max(1, int(size * h / w)), size
+        det_scale = new_h / float(h)
+        canvas = np.zeros((size, size, 3), dtype=np.uint8)
+        canvas[:new_h, :new_w] = cv2.resize(image_bgr, (new_w, new_h))
+
+        blob = cv2.dnn.blobFromImage(canvas, 1.0 / 128.0, (size, size), (127.5, 127.5, 127.5), swapRB=True)
+        outputs = self._session.run(self._output_names, {self._input_name: blob})
+
+        fmc = len(self._STRIDES)
+        all_scores, all_boxes, all_kps = [], [], []
+        for idx, stride in enumerate(self._STRIDES):
+            scores = outputs[idx].reshape(-1)
+            box_preds = outputs[idx + fmc].reshape(-1, 4) * stride
+            kps_preds = outputs[idx + fmc * 2].reshape(-1, 10) * stride
+
+            centers = self._anchor_centers(size // stride, size // stride, stride)
+            pos = np.where(scores >= self.score_threshold)[0]
+            if pos.size == 0:
+                continue
+
+            c = centers[pos]
+            d = box_preds[pos]
+            boxes = np.stack([c[:, 0] - d[:, 0], c[:, 1] - d[:, 1],
+                              c[:, 0] + d[:, 2], c[:, 1] + d[:, 3]], axis=-1)
+            kps = kps_preds[pos].reshape(-1, 5, 2) + c[:, None, :]
+
+            all_scores.append(scores[pos])
+            all_boxes.append(boxes)
+            all_kps.append(kps)
+
+        if not all_scores:
+            return []
+
+        scores = np.concatenate(all_scores)
+        boxes = np.concatenate(all_boxes) / det_scale
+        kps = np.concatenate(all_kps) / det_scale
+        keep = _nms(np.hstack([boxes, scores[:, None]]), self.nms_threshold)
+
+        faces = []
+        for i in keep:
+            x1, y1, x2, y2 = boxes[i]
+            x1, y1 = max(0.0, x1), max(0.0, y1)
+            faces.append({
+                "box": [int(x1), int(y1), int(x2 - x1), int(y2 - y1)],
+                "confidence": float(scores[i]),
+                "keypoints": {name: (int(px), int(py)) for name, (px, py) in zip(self._KEYPOINT_NAMES, kps[i])},
+            })
+        return faces
+
+
+DETECTOR_BACKENDS: Dict[str, Type[FaceDetector]] = {
+    MTCNNDetector.name: MTCNNDetector,
+    HaarDetector.name: HaarDetector,
+    SCRFDDetector.name: SCRFDDetector,
+}
+
+
+def build_detector(name: str) -> Optional[FaceDetector]:
+    """Instantiate a detector backend by name ("mtcnn", "haar", "scrfd"). Empty name → None."""
+    if not name:
+        return None
+    key = name.strip().lower()
+    if key not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend '{name}'. Choose one of: {', '.join(DETECTOR_BACKENDS)}")
+    logging.info("Initializing %s face detector", key)
+    return DETECTOR_BACKENDS[key]()
@@ -0,0 +1,145 @@
+# app/engine.py
+
+import hashlib
+import logging
+import os
+import platform
+import time
+from typing import List, Optional
+
+import numpy as np
+import onnxruntime as ort
+
+from .config import settings
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def _choice(options: dict, value: str, setting: str):
+    try:
+        return options[value.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown {setting} '{value}'. Choose one of: {', '.join(options)}")
+
+
+def session_options(optimization_level: Optional[ort.GraphOptimizationLevel] = None) -> ort.SessionOptions:
+    """SessionOptions from the ORT_* settings (read at call time, so a pool child can override them)."""
+    options = ort.SessionOptions()
+    if settings.ORT_INTRA_OP_THREADS > 0:
+        options.intra_op_num_threads = settings.ORT_INTRA_OP_THREADS
+    if settings.ORT_INTER_OP_THREADS > 0:
+        options.inter_op_num_threads = settings.ORT_INTER_OP_THREADS
+    options.execution_mode = _choice(EXECUTION_MODES, settings.ORT_EXECUTION_MODE, "ORT_EXECUTION_MODE")
+    if optimization_level is None:
+        optimization_level = _choice(GRAPH_OPTIMIZATION_LEVELS, settings.ORT_GRAPH_OPTIMIZATION, "ORT_GRAPH_OPTIMIZATION")
+    options.graph_optimization_level = optimization_level
+    return options
+
+
+def optimized_model_path(model_path: str, optimization_level: ort.GraphOptimizationLevel) -> str:
+    """Where the optimized graph of model_path is cached. The name changes with the source
+    file, the ORT version, the optimization level and the CPU architecture.
+    """
+    stat = os.stat(model_path)
+    key = "|".join(str(part) for part in (
+        os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns,
+        ort.__version__, int(optimization_level), platform.machine(),
+    ))
+    digest = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(settings.ORT_OPTIMIZED_MODEL_DIR, f"{stem}.{digest}.opt.onnx")
+
+
+def create_session(model_path: str) -> ort.InferenceSession:
+    """InferenceSession for model_path, reusing the optimized graph an earlier boot saved.
+    Without a cached graph the model is optimized now and the result saved for the next
+    boot (under ORT_OPTIMIZED_MODEL_DIR; "" disables the cache).
+
+    At most the "extended" optimizations are saved. "all" adds layout transforms
+    that pick kernels for the CPU features of the machine doing the optimizing
+    (AVX2, AVX-512, ...), which platform.machine() does not tell apart, so a
+    file saved with them could fail or run slowly on another host sharing the
+    cache. They run on top of the cached graph at every load instead.
+    """
+    level = _choice(GRAPH_OPTIMIZATION_LEVELS, settings.ORT_GRAPH_OPTIMIZATION, "ORT_GRAPH_OPTIMIZATION")
+    if not settings.ORT_OPTIMIZED_MODEL_DIR or level == ort.GraphOptimizationLevel.ORT_DISABLE_ALL:
+        return ort.InferenceSession(model_path, sess_options=session_options(level))
+
+    extended = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    saved_level = level if int(level) <= int(extended) else extended
+    # already optimized up to saved_level: running those optimizers again would only cost boot time
+    load_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL if saved_level == level else level
+
+    cached = optimized_model_path(model_path, saved_level)
+    if os.path.exists(cached):
+        try:
+            session = ort.InferenceSession(cached, sess_options=session_options(load_level))
+            logging.info("Using optimized model %s", cached)
+            return session
+        except Exception:
+            logging.exception("Cached optimized model %s is unusable, re-optimizing", cached)
+
+    options = session_options(saved_level)
+    os.makedirs(settings.ORT_OPTIMIZED_MODEL_DIR, exist_ok=True)
+    # workers booting together each write their own file; the last rename wins
+    tmp_path = f"{cached}.{os.getpid()}.tmp"
+    options.optimized_model_filepath = tmp_path
+    session = ort.InferenceSession(model_path, sess_options=options)
+    try:
+        os.replace(tmp_path, cached)
+        logging.info("Saved optimized model to %s", cached)
+    except OSError:
+        logging.warning("Could not save optimized model to %s", cached, exc_info=True)
+        cached = model_path
+    if load_level != ort.GraphOptimizationLevel.ORT_DISABLE_ALL:
+        # the level above what was saved runs for this CPU only
+        session = ort.InferenceSession(cached, sess_options=session_options(level))
+    return session
+
+
+def warmup_batch_sizes(value: str) -> List[int]:
+    """Parse MODEL_WARMUP_BATCH_SIZES ("1,8,32") into [1, 8, 32]."""
+    return [int(part) for part in value.replace(" ", "").split(",") if part]
+
+
+class EmbeddingEngine:
+    """The ArcFace session, with its input and output names resolved once at load."""
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        started = time.perf_counter()
+        self.session = create_session(model_path)
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_shape = model_input.shape
+        self.output_name = self.session.get_outputs()[0].name
+        self.load_ms = (time.perf_counter() - started) * 1000.0
+        self.warmup_ms = 0.0
+        logging.info("ArcFace model loaded in %.0f ms (input %s %s, optimization=%s, intra_op_threads=%s)",
+                     self.load_ms, self.input_name, self.input_shape, settings.ORT_GRAPH_OPTIMIZATION,
+                     settings.ORT_INTRA_OP_THREADS or "default")
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        """Raw (F,512) model output for a preprocessed (F,3,112,112) float32 batch."""
+        return self.session.run([self.output_name], {self.input_name: batch})[0]
+
+    def warm_up(self, batch_sizes: List[int]):
+        """Run each batch size once so the first requests do not pay ORT's lazy initialisation."""
+        fixed_batch = self.input_shape[0] if isinstance(self.input_shape[0], int) else None
+        height, width = (dim if isinstance(dim, int) else 112 for dim in self.input_shape[2:4])
+        sizes = [fixed_batch] if fixed_batch else sorted(set(b for b in batch_sizes if b > 0))
+        started = time.perf_counter()
+        for size in sizes:
+            self.run(np.zeros((size, 3, height, width), dtype=np.float32))
+        self.warmup_ms = (time.perf_counter() - started) * 1000.0
+        if sizes:
+            logging.info("ArcFace warm-up at batch sizes %s took %.0f ms", sizes, self.warmup_ms)
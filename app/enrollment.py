@@ -0,0 +1,291 @@
+# app/enrollment.py
+
+"""Bulk enrollment jobs behind POST /upload/batch.
+
+A job is a manifest (CSV with id, name, member_code, image columns, or a JSON
+list of objects with those keys) plus the images it names, either inside one
+ZIP archive or as separate multipart files. `image` holds one or more file
+names separated by ";", with or without extension (as in the onboarding
+spreadsheet). Rows are embedded on a thread pool, written with bulk upserts
+every ENROLL_DB_BATCH_SIZE rows, and the cache is updated with one atomic
+swap when the job ends. Templates of existing employees are merged with the
+stored ones, as /upload does, unless the job replaces them. Progress is kept in memory by the worker that runs the
+job and served by GET /jobs/{id}.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from . import crud
+from .ai_processing import process_employee_images
+from .cache import embedding_cache
+from .config import settings
+from .process_pool import inference_pool
+from .templates import merge_templates, templates_from_blob
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+MANIFEST_NAMES = ("manifest.csv", "manifest.json")
+
+
+class ManifestError(ValueError):
+    """The manifest is missing, unreadable or lacks required columns."""
+
+
+def parse_manifest(data: bytes, filename: str = "manifest.csv") -> List[dict]:
+    """Rows of a CSV or JSON manifest as dicts with id, name, member_code, images (list of names)."""
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith(".json"):
+        try:
+            records = json.loads(text)
+        except ValueError as e:
+            raise ManifestError(f"Invalid JSON manifest: {e}")
+        if not isinstance(records, list):
+            raise ManifestError("JSON manifest must be a list of objects")
+    else:
+        records = list(csv.DictReader(io.StringIO(text)))
+
+    rows = []
+    for record in records:
+        if not any(str(record.get(k) or "").strip() for k in ("id", "name", "image")):
+            continue  # blank line
+        rows.append({
+            "id": str(record.get("id") or "").strip(),
+            "name": str(record.get("name") or "").strip(),
+            "member_code": str(record.get("member_code") or "").strip() or None,
+            "images": [p.strip() for p in str(record.get("image") or "").split(";") if p.strip()],
+        })
+    if not rows:
+        raise ManifestError("Manifest has no rows (expected columns: id, name, member_code, image)")
+    return rows
+
+
+class ImageSource:
+    """Looks up images by manifest name in a ZIP archive or in an in-memory file set."""
+
+    def __init__(self, archive_path: Optional[str] = None, files: Optional[Dict[str, bytes]] = None):
+        self.archive_path = archive_path
+        self._zip = zipfile.ZipFile(archive_path) if archive_path else None
+        self._files = files or {}
+        names = self._zip.namelist() if self._zip else list(self._files)
+        # by base name, case-insensitive; directories inside the archive are ignored
+        self._index: Dict[str, str] = {}
+        for name in names:
+            if name.endswith("/"):
+                continue
+            self._index.setdefault(os.path.basename(name).lower(), name)
+
+    def manifest(self) -> Tuple[bytes, str]:
+        for candidate in MANIFEST_NAMES:
+            name = self._index.get(candidate)
+            if name is not None:
+                return self.read(name), candidate
+        raise ManifestError("Archive has no manifest.csv or manifest.json")
+
+    def resolve(self, name: str) -> Optional[str]:
+        key = os.path.basename(name).lower()
+        if key in self._index:
+            return self._index[key]
+        for ext in IMAGE_EXTENSIONS:
+            if key + ext in self._index:
+                return self._index[key + ext]
+        return None
+
+    def read(self, name: str) -> bytes:
+        if self._zip is not None:
+            return self._zip.read(name)  # ZipFile reads are safe across threads
+        return self._files[name]
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self.archive_path:
+            try:
+                os.remove(self.archive_path)
+            except OSError:
+                pass
+
+
+class EnrollmentJob:
+    def __init__(self, job_id: str, total: int):
+        self.id = job_id
+        self.status = "queued"
+        self.total = total
+        self.processed = 0
+        self.succeeded = 0
+        self.failures: List[dict] = []
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def fail_row(self, row_number: int, emp_id: str, reason: str):
+        self.failures.append({"row": row_number, "id": emp_id, "error": reason})
+
+    def to_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        elapsed = (end - self.started_at) if self.started_at else 0.0
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "succeeded": self.succeeded,
+            "failed": len(self.failures),
+            "progress": round(self.processed / self.total, 4) if self.total else 1.0,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+            "failures": self.failures[:1000],
+            "error": self.error,
+        }
+
+
+class JobRegistry:
+    """Most recent enrollment jobs of this worker (older finished ones are forgotten)."""
+
+    def __init__(self, max_jobs: int = 100):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, EnrollmentJob]" = OrderedDict()
+
+    def create(self, total: int) -> EnrollmentJob:
+        job = EnrollmentJob(uuid.uuid4().hex, total)
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_jobs:
+            oldest = next((j for j in self._jobs.values() if j.status in ("completed", "failed")), None)
+            if oldest is None:
+                break
+            del self._jobs[oldest.id]
+        return job
+
+    def get(self, job_id: str) -> Optional[EnrollmentJob]:
+        return self._jobs.get(job_id)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, settings.ENROLL_WORKERS),
+                                       thread_name_prefix="enroll")
+    return _executor
+
+
+def _embed_row(source: ImageSource, row: dict):
+    """Worker-thread half of one manifest row: read its images and embed them."""
+    files_data = []
+    for image_name in row["images"]:
+        path = source.resolve(image_name)
+        if path is None:
+            continue
+        files_data.append((os.path.basename(path), source.read(path)))
+    if not files_data:
+        return None, None, "image not found"
+    if inference_pool.running:
+        embedding, rep_img_path, report = inference_pool.process_employee_images(
+            row["name"], row["id"], files_data).result()
+    else:
+        embedding, rep_img_path, report = process_employee_images(
+            employee_name=row["name"], employee_id=row["id"], files_data=files_data
+        )
+    if embedding is None:
+        reasons = ", ".join(f"{entry['filename']}: {entry['reason']}" for entry in report)
+        return None, None, f"no usable face found ({reasons})"
+    return embedding, rep_img_path, None
+
+
+async def run_enrollment_job(job: EnrollmentJob, rows: List[dict], source: ImageSource, session_factory,
+                             replace_templates: bool = False):
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    chunk_size = max(1, settings.ENROLL_DB_BATCH_SIZE)
+    committed: List[Tuple[str, str, str, object]] = []
+
+    job.status = "running"
+    job.started_at = time.time()
+    try:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            futures = []
+            for offset, row in enumerate(chunk):
+                row_number = start + offset + 1
+                if not row["id"] or not row["name"] or not row["images"]:
+                    job.fail_row(row_number, row["id"], "id, name and image are required")
+                    futures.append(None)
+                    continue
+                futures.append(loop.run_in_executor(executor, _embed_row, source, row))
+
+            ready = []
+            for offset, (row, future) in enumerate(zip(chunk, futures)):
+                row_number = start + offset + 1
+                if future is not None:
+                    try:
+                        embedding, rep_img_path, reason = await future
+                    except Exception as e:
+                        logging.exception("Enrollment of row %d (ID: %s) failed", row_number, row["id"])
+                        embedding, rep_img_path, reason = None, None, f"{type(e).__name__}: {e}"
+                    if reason is not None:
+                        job.fail_row(row_number, row["id"], reason)
+                    else:
+                        ready.append({"id": row["id"], "name": row["name"], "member_code": row["member_code"],
+                                      "embedding": embedding, "image_path": rep_img_path})
+                job.processed += 1
+
+            if ready:
+                async with session_factory() as db:
+                    if settings.GALLERY_MAX_TEMPLATES > 1 and not replace_templates:
+                        # rows stay locked until the upsert commits, so a concurrent /upload is not lost
+                        stored = {emp_id: templates_from_blob(blob) for emp_id, blob in
+                                  (await crud.get_embeddings_for_update(db, [r["id"] for r in ready])).items()}
+                        for r in ready:
+                            if r["id"] in stored:
+                                r["embedding"] = stored[r["id"]] = merge_templates(stored[r["id"]], r["embedding"])
+                            else:
+                                stored[r["id"]] = r["embedding"]
+                    await crud.bulk_upsert_employees(db, ready)
+                committed.extend((r["id"], r["name"], r["member_code"], r["embedding"]) for r in ready)
+                job.succeeded += len(ready)
+            logging.info("Enrollment job %s: %d/%d rows", job.id, job.processed, job.total)
+
+        job.status = "completed"
+    except Exception as e:
+        logging.exception("Enrollment job %s failed", job.id)
+        job.status = "failed"
+        job.error = f"{type(e).__name__}: {e}"
+    finally:
+        # whatever reached the database goes live in one swap
+        try:
+            await run_in_threadpool(embedding_cache.upsert_many, committed)
+        except Exception:
+            logging.exception("Enrollment job %s: cache update failed", job.id)
+        source.close()
+        job.finished_at = time.time()
+        logging.info("Enrollment job %s %s: %d enrolled, %d failed in %.1fs", job.id, job.status,
+                     job.succeeded, len(job.failures), job.finished_at - job.started_at)
+
+
+def save_upload(fileobj, suffix: str = ".zip") -> str:
+    """Copy an uploaded file to a temp path that outlives the request."""
+    fd, path = tempfile.mkstemp(prefix="enroll-", suffix=suffix)
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(fileobj, out, length=1024 * 1024)
+    return path
+
+
+# Global job registry
+enrollment_jobs = JobRegistry()
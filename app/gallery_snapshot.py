@@ -0,0 +1,277 @@
+# app/gallery_snapshot.py
+
+"""On-disk gallery snapshot for fast starts.
+
+The snapshot is a `.npy` matrix plus a JSON sidecar (ids, names, member codes)
+and, when employees have several templates, the owner of every matrix row. The
+array files are named after a generation that only the sidecar (replaced last)
+points at, so the set switches atomically. It is stamped with a DB watermark:
+the newest Employee.updated_at it contains. At startup the matrix is memory-mapped and only rows written since the watermark
+(less GALLERY_SNAPSHOT_MARGIN_SECONDS, for transactions that were still in
+flight) are read from the database; members deleted since then are dropped by
+comparing against the (blob-free) list of current ids.
+
+Rebuild offline with:
+    python -m app.gallery_snapshot rebuild
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud
+from .config import settings
+
+
+MATRIX_FILE = "embeddings-{generation}.npy"
+OWNERS_FILE = "owners-{generation}.npy"
+META_FILE = "gallery.json"
+LOCK_FILE = "lock"
+
+
+class GalleryData(NamedTuple):
+    names: List[str]
+    embeddings: np.ndarray
+    ids: List[str]
+    member_codes: List[str]
+    watermark: Optional[datetime]
+    owners: Optional[np.ndarray] = None  # employee (list position) of every matrix row; None = one row each
+
+
+def _read_meta(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_durably(path: str, write):
+    """write(f) into a temporary file, fsync it and rename it over `path`.
+    The temporary file is per process: workers booting together each write their own."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def save_snapshot(directory: str, data: GalleryData):
+    """Atomically replace the snapshot in `directory`.
+    The matrix and owners go into files named after a new generation; the sidecar naming
+    that generation is renamed into place last, so a crash at any point leaves either the
+    old snapshot or the new one, never a mix of the two. Workers booting together take
+    turns (flock), so they never write the same generation at once."""
+    os.makedirs(directory, exist_ok=True)
+    fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        _save_generation(directory, data)
+    finally:
+        os.close(fd)  # releases the lock
+
+
+def _save_generation(directory: str, data: GalleryData):
+    previous = (_read_meta(directory) or {}).get("generation", 0)
+    generation = previous + 1
+
+    embeddings = np.ascontiguousarray(data.embeddings, dtype=np.float32).reshape(-1, 512)
+    _write_durably(os.path.join(directory, MATRIX_FILE.format(generation=generation)),
+                   lambda f: np.save(f, embeddings))
+    if data.owners is not None:
+        owners = np.asarray(data.owners, dtype=np.int32)
+        _write_durably(os.path.join(directory, OWNERS_FILE.format(generation=generation)),
+                       lambda f: np.save(f, owners))
+
+    meta = {
+        "generation": generation,
+        "watermark": data.watermark.isoformat() if data.watermark else None,
+        "count": len(data.ids),
+        "rows": len(embeddings),
+        "owners": data.owners is not None,
+        "ids": list(data.ids),
+        "names": list(data.names),
+        "member_codes": list(data.member_codes),
+    }
+    _write_durably(os.path.join(directory, META_FILE), lambda f: f.write(json.dumps(meta).encode("utf-8")))
+
+    # the previous generation stays for loaders that read its sidecar a moment ago
+    for name in os.listdir(directory):
+        stem, _, ext = name.rpartition(".")
+        try:
+            stale = ext == "npy" and int(stem.rsplit("-", 1)[1]) < previous
+        except (IndexError, ValueError):
+            stale = name in ("embeddings.npy", "owners.npy")  # pre-generation layout
+        if stale:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    logging.info("Gallery snapshot %d saved: %d members, watermark %s", generation, len(data.ids), meta["watermark"])
+
+
+def load_snapshot(directory: str) -> Optional[GalleryData]:
+    """Memory-map a saved snapshot. Returns None if there is none or it is unreadable."""
+    try:
+        meta = _read_meta(directory)
+        if meta is None:
+            return None
+        if "generation" not in meta:
+            logging.info("Gallery snapshot in %s predates generations; ignoring it", directory)
+            return None
+        generation = meta["generation"]
+        embeddings = np.load(os.path.join(directory, MATRIX_FILE.format(generation=generation)), mmap_mode="r")
+        owners = np.load(os.path.join(directory, OWNERS_FILE.format(generation=generation))) if meta.get("owners") else None
+        if embeddings.shape[0] != meta["rows"] or (owners is not None and len(owners) != len(embeddings)):
+            logging.warning("Gallery snapshot matrix and sidecar disagree; ignoring snapshot")
+            return None
+        watermark = datetime.fromisoformat(meta["watermark"]) if meta.get("watermark") else None
+        return GalleryData(meta["names"], embeddings, meta["ids"], meta["member_codes"], watermark, owners)
+    except Exception:
+        logging.exception("Failed to read gallery snapshot from %s", directory)
+        return None
+
+
+def drop_unchanged(base: GalleryData, changed: Tuple[List[str], np.ndarray, List[str], List[str], Optional[np.ndarray]]
+                   ) -> Tuple[List[str], np.ndarray, List[str], List[str], Optional[np.ndarray]]:
+    """Leave out changed rows identical to the snapshot's (re-read only because of the
+    watermark margin), so an unchanged gallery stays a plain memory map."""
+    ch_names, ch_embeddings, ch_ids, ch_codes, ch_owners = changed
+    if not ch_ids:
+        return changed
+    ch_embeddings = ch_embeddings.reshape(-1, 512)
+    ch_counts = np.bincount(ch_owners, minlength=len(ch_ids)) if ch_owners is not None else np.ones(len(ch_ids), dtype=np.int64)
+    ch_starts = np.cumsum(ch_counts) - ch_counts
+    if base.owners is not None:
+        base_order = np.argsort(base.owners, kind="stable")  # template rows of each employee, in order
+        base_counts = np.bincount(base.owners, minlength=len(base.ids))
+        base_starts = np.cumsum(base_counts) - base_counts
+    slot_of = {emp_id: slot for slot, emp_id in enumerate(base.ids)}
+
+    keep = []
+    for i, emp_id in enumerate(ch_ids):
+        slot = slot_of.get(emp_id)
+        if slot is None or base.names[slot] != ch_names[i] or base.member_codes[slot] != ch_codes[i]:
+            keep.append(i)
+            continue
+        if base.owners is None:
+            rows = [slot]
+        else:
+            rows = base_order[base_starts[slot]:base_starts[slot] + base_counts[slot]]
+        mine = ch_embeddings[ch_starts[i]:ch_starts[i] + ch_counts[i]]
+        if len(rows) != len(mine) or not np.array_equal(base.embeddings[rows], mine):
+            keep.append(i)
+    if len(keep) == len(ch_ids):
+        return changed
+
+    counts = ch_counts[keep]
+    rows = np.concatenate([np.arange(ch_starts[i], ch_starts[i] + ch_counts[i]) for i in keep]) if keep else np.empty(0, dtype=np.int64)
+    owners = np.repeat(np.arange(len(keep), dtype=np.int32), counts) if len(rows) != len(keep) else None
+    return ([ch_names[i] for i in keep], ch_embeddings[rows], [ch_ids[i] for i in keep],
+            [ch_codes[i] for i in keep], owners)
+
+
+def merge_changes(base: GalleryData, changed: Tuple[List[str], np.ndarray, List[str], List[str], Optional[np.ndarray]],
+                  current_ids: List[str], watermark: Optional[datetime]) -> GalleryData:
+    """Apply rows changed since the snapshot and drop members no longer in the DB."""
+    ch_names, ch_embeddings, ch_ids, ch_codes, ch_owners = changed
+    alive = set(current_ids)
+    replaced = set(ch_ids)
+
+    keep = [row for row, emp_id in enumerate(base.ids) if emp_id in alive and emp_id not in replaced]
+    base_owners = base.owners if base.owners is not None else np.arange(len(base.ids))
+    if len(keep) == len(base.ids):
+        if not ch_ids:
+            return base._replace(watermark=watermark)  # nothing changed: keep the memory map
+        kept_embeddings, kept_owners = base.embeddings, base_owners
+    else:
+        # renumber the kept employees and select their template rows in one pass
+        position = np.full(len(base.ids), -1, dtype=np.int64)
+        position[np.asarray(keep, dtype=np.int64)] = np.arange(len(keep))
+        row_owner = position[base_owners]
+        kept_rows = np.flatnonzero(row_owner >= 0)
+        kept_embeddings, kept_owners = base.embeddings[kept_rows], row_owner[kept_rows]
+
+    ch_embeddings = ch_embeddings.reshape(-1, 512)
+    ch_owners = np.arange(len(ch_ids)) if ch_owners is None else ch_owners
+    owners = np.concatenate([kept_owners, ch_owners + len(keep)]).astype(np.int32)
+    if len(owners) == len(keep) + len(ch_ids) and np.array_equal(owners, np.arange(len(owners))):
+        owners = None  # still one row per employee
+    return GalleryData(
+        [base.names[r] for r in keep] + list(ch_names),
+        np.concatenate([np.asarray(kept_embeddings, dtype=np.float32).reshape(-1, 512), ch_embeddings], axis=0),
+        [base.ids[r] for r in keep] + list(ch_ids),
+        [base.member_codes[r] for r in keep] + list(ch_codes),
+        watermark,
+        owners,
+    )
+
+
+async def _save_quietly(directory: str, data: GalleryData):
+    """save_snapshot off the loop; a failed write is logged, never raised, since the gallery
+    is already loaded and only the next boot would have used the snapshot."""
+    try:
+        await asyncio.to_thread(save_snapshot, directory, data)
+    except Exception:
+        logging.warning("Could not save the gallery snapshot to %s", directory, exc_info=True)
+
+
+async def rebuild(db: AsyncSession, directory: str) -> GalleryData:
+    """Full DB scan -> fresh snapshot."""
+    watermark = await crud.get_embeddings_watermark(db)  # read first: later commits are >= it - margin
+    names, embeddings, ids, member_codes, owners = await crud.load_all_embeddings(db)
+    data = GalleryData(names, embeddings, ids, member_codes, watermark, owners)
+    await _save_quietly(directory, data)
+    return data
+
+
+async def load_gallery(db: AsyncSession, directory: str) -> GalleryData:
+    """Snapshot + delta since its watermark; falls back to a full rebuild without a snapshot.
+    The snapshot is rewritten when the delta was not empty, so the next boot starts closer.
+    """
+    started = time.perf_counter()
+    base = await asyncio.to_thread(load_snapshot, directory)
+    if base is None or base.watermark is None:
+        logging.info("No usable gallery snapshot in %s; doing a full load", directory)
+        return await rebuild(db, directory)
+
+    watermark = await crud.get_embeddings_watermark(db)
+    since = base.watermark - timedelta(seconds=settings.GALLERY_SNAPSHOT_MARGIN_SECONDS)
+    changed = drop_unchanged(base, await crud.load_embeddings_changed_since(db, since))
+    current_ids = await crud.get_all_employee_ids(db)
+    data = merge_changes(base, changed, current_ids, watermark or base.watermark)
+
+    logging.info("Gallery loaded from snapshot (%d members, %d changed rows read) in %.1fms",
+                 len(data.ids), len(changed[2]), (time.perf_counter() - started) * 1000.0)
+    dropped = len(data.ids) != len(base.ids) - len(set(base.ids) & set(changed[2])) + len(changed[2])
+    if dropped or changed[2] or (watermark is not None and watermark > base.watermark):
+        await _save_quietly(directory, data)
+    return data
+
+
+async def _rebuild_cli():
+    from .db import AsyncSessionLocal
+    async with AsyncSessionLocal() as db:
+        data = await rebuild(db, settings.GALLERY_SNAPSHOT_DIR)
+    print(f"Snapshot written to {settings.GALLERY_SNAPSHOT_DIR}: {len(data.ids)} members, watermark {data.watermark}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python -m app.gallery_snapshot rebuild")
+        sys.exit(2)
+    if not settings.GALLERY_SNAPSHOT_DIR:
+        print("GALLERY_SNAPSHOT_DIR is not set")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_rebuild_cli())
@@ -0,0 +1,181 @@
+# app/log_writer.py
+
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, List, Optional
+
+from . import crud
+from .config import settings
+from .db import AsyncSessionLocal
+from .metrics import STAGE_SECONDS
+
+
+class RecognitionLogWriter:
+    """Write-behind buffer for recognition_log rows.
+
+    `submit()` is called from the request path: it stamps the event with the
+    recognition time, appends it to an in-memory buffer and returns at once, so
+    a /recognize response never waits on the database. A single writer task
+    drains the buffer with one multi-row INSERT (and one commit) whenever
+    `max_rows` events are waiting or `flush_interval_ms` has passed since the
+    last flush, and drains whatever is left on `stop()`.
+
+    Backpressure: the buffer holds at most `max_buffer` events; beyond that
+    `submit()` returns False and the event is counted as rejected, so a slow or
+    unreachable database shows up in `stats()` and the logs instead of growing
+    memory without bound. A failed flush is put back at the head of the buffer
+    and retried with exponential backoff; after `max_retries` attempts the batch
+    is dropped and counted as failed.
+    """
+
+    def __init__(self, flush_interval_ms: float = 250.0, max_rows: int = 500,
+                 max_buffer: int = 20000, max_retries: int = 5, session_factory=None):
+        self.flush_interval = max(0.0, float(flush_interval_ms)) / 1000.0
+        self.max_rows = max(1, int(max_rows))
+        self.max_buffer = max(self.max_rows, int(max_buffer))
+        self.max_retries = max(1, int(max_retries))
+        self._session_factory = session_factory or AsyncSessionLocal
+
+        self._buffer: Deque[dict] = deque()
+        self._has_rows: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._attempts = 0  # consecutive failed attempts for the batch at the head
+
+        self.submitted = 0
+        self.written = 0
+        self.rejected = 0
+        self.failed_rows = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._has_rows = asyncio.Event()
+        self._full = asyncio.Event()
+        self._stopping = False
+        if self._buffer:
+            self._has_rows.set()
+        self._task = asyncio.create_task(self._run())
+        logging.info("Recognition log writer started (flush every %.0fms or %d rows, buffer %d)",
+                     self.flush_interval * 1000.0, self.max_rows, self.max_buffer)
+
+    async def stop(self, timeout: float = 10.0):
+        """Flush everything still buffered, then stop the writer task."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._has_rows.set()
+        self._full.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            logging.error("Recognition log writer did not drain within %.0fs; %d events lost",
+                          timeout, len(self._buffer))
+        self._task = None
+        logging.info("Recognition log writer stopped (%d written, %d rejected, %d failed)",
+                     self.written, self.rejected, self.failed_rows)
+
+    def submit(self, emp_id: str, name: str, member_code: str, source: str = "live_recognize_api") -> bool:
+        """Queue one recognition for writing. Never blocks; False when the buffer is full."""
+        if len(self._buffer) >= self.max_buffer:
+            self.rejected += 1
+            if self.rejected == 1 or self.rejected % 1000 == 0:
+                logging.error("Recognition log buffer full (%d events); %d events rejected so far",
+                              self.max_buffer, self.rejected)
+            return False
+
+        self._buffer.append({"employee_id": emp_id, "name": name, "member_code": member_code,
+                             "recognized_at": datetime.utcnow(), "source": source})
+        self.submitted += 1
+        if self._has_rows is not None:
+            self._has_rows.set()
+            if len(self._buffer) >= self.max_rows:
+                self._full.set()
+        return True
+
+    async def _run(self):
+        while True:
+            if not self._buffer:
+                if self._stopping:
+                    return
+                self._has_rows.clear()
+                await self._has_rows.wait()
+                continue
+
+            if not self._stopping and len(self._buffer) < self.max_rows:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            if not await self._flush_once():
+                await asyncio.sleep(min(self.flush_interval * (2 ** self._attempts), 5.0))
+
+    async def _flush_once(self) -> bool:
+        count = min(len(self._buffer), self.max_rows)
+        rows: List[dict] = [self._buffer.popleft() for _ in range(count)]
+
+        started = time.perf_counter()
+        try:
+            async with self._session_factory() as db:
+                await crud.insert_recognition_logs(db, rows)
+            STAGE_SECONDS.observe(time.perf_counter() - started, "log_write")
+        except Exception as e:
+            self._attempts += 1
+            self.failed_flushes += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            if self._attempts >= self.max_retries:
+                self.failed_rows += len(rows)
+                self._attempts = 0
+                logging.error("Dropping %d recognition log rows after %d failed attempts: %s",
+                              len(rows), self.max_retries, self.last_error)
+                return True
+            logging.warning("Recognition log flush of %d rows failed (attempt %d/%d): %s",
+                            len(rows), self._attempts, self.max_retries, self.last_error)
+            self._buffer.extendleft(reversed(rows))
+            return False
+
+        self._attempts = 0
+        self.flushes += 1
+        self.written += len(rows)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000.0
+        logging.debug("Recognition log flush: %d rows in %.2fms", len(rows), self.last_flush_ms)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "buffered": len(self._buffer),
+            "max_buffer": self.max_buffer,
+            "submitted": self.submitted,
+            "written": self.written,
+            "rejected": self.rejected,
+            "failed_rows": self.failed_rows,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "last_error": self.last_error,
+        }
+
+
+# Global writer instance
+recognition_log_writer = RecognitionLogWriter(
+    flush_interval_ms=settings.LOG_FLUSH_INTERVAL_MS,
+    max_rows=settings.LOG_FLUSH_MAX_ROWS,
+    max_buffer=settings.LOG_BUFFER_SIZE,
+    max_retries=settings.LOG_FLUSH_MAX_RETRIES,
+)
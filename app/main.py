@@ -1,24 +1,47 @@
 # app/main.py
 
+import asyncio
 import logging
+import os
 import time
+import zipfile
+from datetime import datetime, timedelta
+import anyio
 import numpy as np
-import cv2
-from fastapi import FastAPI, File, Form, UploadFile, Depends, HTTPException, Request, BackgroundTasks
+from fastapi import FastAPI, File, Form, UploadFile, Depends, HTTPException, Request, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.concurrency import run_in_threadpool
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 
-from . import crud, models, schemas
-from .db import get_db, engine
+from . import crud, gallery_snapshot, models, schemas
+from .db import AsyncSessionLocal, get_db, engine
 from .cache import embedding_cache
 from .config import settings
-from .ai_processing import (
-    detect_and_recognize_faces,
-    process_employee_images
+from .ai_processing import build_recognition_results, load_models
+from .batching import embed_faces, inference_batcher
+from .process_pool import (
+    INFERENCE_EXECUTORS,
+    inference_pool,
+    run_prepare_faces,
+    run_process_employee_images
+)
+from .log_writer import recognition_log_writer
+from .cooldown import recognition_cooldown
+from .streaming import StreamSession
+from .result_cache import content_key, recognition_cache
+from .metrics import STAGE_SECONDS, registry as metrics_registry
+from .templates import as_templates, merge_templates, templates_from_blob
+from .enrollment import (
+    ImageSource,
+    ManifestError,
+    enrollment_jobs,
+    parse_manifest,
+    run_enrollment_job,
+    save_upload
 )
 
 # --- App Initialization ---
@@ -38,16 +61,91 @@ app.add_middleware(
 
 
 # --- Startup and Shutdown Events ---
+async def load_cache_from_db():
+    async for db in get_db():
+        if settings.GALLERY_SNAPSHOT_DIR:
+            data = await gallery_snapshot.load_gallery(db, settings.GALLERY_SNAPSHOT_DIR)
+            names, embeddings, ids, member_code, owners = data.names, data.embeddings, data.ids, data.member_codes, data.owners
+        else:
+            names, embeddings, ids ,member_code, owners = await crud.load_all_embeddings(db)
+        # a shared gallery is written out under a cross-process lock: keep that off the loop
+        await run_in_threadpool(embedding_cache.update, names, embeddings, ids, member_code, owners)
+        break
+
+# Readiness of this worker: /readyz reports ready once every part below is loaded
+readiness = {
+    "models": False,
+    "gallery": False,
+    "inference_pool": settings.INFERENCE_EXECUTOR != "process",
+    "error": None,
+}
+_warmup_task = None
+
+
+async def load_gallery():
+    logging.info("Loading embeddings into cache on startup...")
+    shared = embedding_cache.shared
+    if shared is not None:
+        # only the first worker scans the DB; the others map its gallery. One left
+        # behind by a stopped service (no live members) is stale and reloaded.
+        async with shared.startup_lock():
+            if shared.is_live():
+                await run_in_threadpool(embedding_cache.attach_shared)
+            else:
+                await load_cache_from_db()
+            shared.join()
+    else:
+        await load_cache_from_db()
+    readiness["gallery"] = True
+
+
+async def load_models_in_background():
+    started = time.perf_counter()
+    try:
+        async def models_and_pool():
+            # with the process pool, detection runs in its children: no detectors (or TensorFlow) here
+            await run_in_threadpool(load_models, settings.INFERENCE_EXECUTOR != "process")
+            readiness["models"] = True
+            if settings.INFERENCE_EXECUTOR == "process":
+                await run_in_threadpool(inference_pool.start)
+                readiness["inference_pool"] = True
+
+        await asyncio.gather(models_and_pool(), load_gallery())
+        logging.info("Worker ready in %.1fs.", time.perf_counter() - started)
+    except Exception as e:
+        logging.exception("Loading models or gallery failed; /readyz stays not-ready")
+        readiness["error"] = f"{type(e).__name__}: {e}"
+
+
 @app.on_event("startup")
 async def startup_event():
+    global _warmup_task
+    if settings.INFERENCE_EXECUTOR not in INFERENCE_EXECUTORS:
+        raise ValueError(f"Unknown INFERENCE_EXECUTOR '{settings.INFERENCE_EXECUTOR}'. Available: {', '.join(INFERENCE_EXECUTORS)}")
     async with engine.begin() as conn:
         await conn.run_sync(models.Base.metadata.create_all)
-    logging.info("Loading embeddings into cache on startup...")
-    async for db in get_db():
-        names, embeddings, ids ,member_code= await crud.load_all_embeddings(db)
-        embedding_cache.update(names, embeddings, ids, member_code)
-        break
-    logging.info("Startup complete.")
+        if conn.dialect.name == "postgresql":
+            # create_all does not add columns or indexes to an existing table
+            await conn.execute(text("ALTER TABLE employees ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP"))
+            await conn.execute(text("ALTER TABLE employees ALTER COLUMN updated_at SET DEFAULT now()"))
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_employees_updated_at ON employees (updated_at)"))
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recognition_log_recognized_at ON recognition_log (recognized_at)"))
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recognition_log_employee_id ON recognition_log (employee_id)"))
+    if settings.BATCHING_ENABLED:
+        await inference_batcher.start()
+    await recognition_log_writer.start()
+    # the port opens now; models and gallery load behind /readyz
+    _warmup_task = asyncio.create_task(load_models_in_background())
+    logging.info("Startup complete; loading models and gallery in the background.")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if _warmup_task is not None and not _warmup_task.done():
+        _warmup_task.cancel()
+    await inference_batcher.stop()
+    await recognition_log_writer.stop()
+    await run_in_threadpool(inference_pool.stop)
 
 # --- Helper for API Responses ---
 def make_response(status, code, flag, message, data=None):
@@ -56,6 +154,13 @@ def make_response(status, code, flag, message, data=None):
         "MESSAGE": message, "DATA": data
     }
 
+def gallery_loading_response():
+    """503 for endpoints that change the gallery while it is still loading
+    (the background load would overwrite their cache update)."""
+    if readiness["gallery"]:
+        return None
+    return JSONResponse(status_code=503, content=make_response(0, 2, False, "Gallery is still loading, retry shortly."))
+
 # --- API Endpoints ---
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -66,6 +171,21 @@ async def read_root(request: Request):
 async def read_root(request: Request):
     return templates.TemplateResponse("recognitions.html", {"request": request})
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving, even while models are still loading."""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once the models and the gallery are loaded, 503 until then
+    (and while the inference pool respawns after a child crash)."""
+    parts = dict(readiness)
+    if settings.INFERENCE_EXECUTOR == "process" and parts["inference_pool"]:
+        parts["inference_pool"] = inference_pool.ready
+    ready = all(parts[part] for part in ("models", "gallery", "inference_pool"))
+    return JSONResponse(status_code=200 if ready else 503, content=dict(parts, ready=ready))
+
 @app.get("/hi")
 def read_hi():
     return "TechV1z0r !"
@@ -76,48 +196,76 @@ async def upload_images(
     id: str = Form(...),
     member_code: str = Form(...),
     pictures: List[UploadFile] = File(...),
+    replace_templates: bool = Form(False),
     db: AsyncSession = Depends(get_db)
 ):
+    """
+    Enroll or update an employee. By default (GALLERY_MAX_TEMPLATES=1) the usable
+    photos are averaged into one embedding that replaces the stored one. With
+    GALLERY_MAX_TEMPLATES > 1 each photo becomes a template, and for an existing
+    employee they are added to the stored templates (pruned to the cap) unless
+    replace_templates is set.
+    """
     if not all([name, id, pictures]):
         raise HTTPException(status_code=400, detail="Missing required parameters.")
+    not_ready = gallery_loading_response()
+    if not_ready is not None:
+        return not_ready
 
     try:
         files_data = []
         for file in pictures:
-            contents = await file.read()
+            with STAGE_SECONDS.time("read"):
+                contents = await file.read()
             files_data.append((file.filename, contents))
 
-        avg_embedding, rep_img_path = await run_in_threadpool(
-            process_employee_images, employee_name=name, employee_id=id, files_data=files_data
-        )
+        templates, rep_img_path, quality_report = await run_process_employee_images(name, id, files_data)
 
-        if avg_embedding is None:
+        if templates is None:
             return JSONResponse(
                 status_code=200,
-                content=make_response(0, 2, False, "Failed to generate embeddings. No faces found or invalid images.")
+                content=make_response(0, 2, False, "Failed to generate embeddings. No faces found or invalid images.",
+                                      {"images": quality_report})
             )
 
-        existing_employee = await crud.get_employee_by_id(db, id)
+        # locked until the commit below: concurrent uploads for this id merge one after the other
+        existing_employee = await crud.get_employee_by_id(db, id, for_update=True)
         
         message = ""
         if existing_employee:
+            previous = (existing_employee.name, existing_employee.member_code,
+                        templates_from_blob(existing_employee.embedding))
+            if settings.GALLERY_MAX_TEMPLATES > 1 and not replace_templates:
+                templates = merge_templates(previous[2], templates)
             await crud.update_employee(
                 db, emp_id=id, name=name, member_code=member_code, 
-                embedding=avg_embedding, image_path=rep_img_path
+                embedding=templates, image_path=rep_img_path, commit=False
             )
             message = f"Employee {name} (ID: {id}) was successfully updated."
         else:
+            previous = None
             await crud.create_employee(
                 db, emp_id=id, name=name, member_code=member_code, 
-                embedding=avg_embedding, image_path=rep_img_path
+                embedding=templates, image_path=rep_img_path, commit=False
             )
             message = f"{name} is stored successfully."
         
-        embedding_cache.update_or_add_employee(id, name, member_code, avg_embedding)
+        # still under the row lock, so concurrent uploads reach the cache in commit order
+        await run_in_threadpool(embedding_cache.update_or_add_employee, id, name, member_code, templates)
+        try:
+            await db.commit()
+        except Exception:
+            # put the cache back to what the database still holds
+            if previous is None or not len(previous[2]):
+                await run_in_threadpool(embedding_cache.remove_employee, id)
+            else:
+                await run_in_threadpool(embedding_cache.update_or_add_employee, id, *previous)
+            raise
         
         return JSONResponse(
             status_code=200,
-            content=make_response(1, 1, True, message)
+            content=make_response(1, 1, True, message,
+                                  {"images": quality_report, "templates": len(as_templates(templates))})
         )
 
     except Exception as e:
@@ -125,31 +273,149 @@ async def upload_images(
         raise HTTPException(status_code=500, detail="Failed to save images to database.")
 
 
-recent_recognitions = {}
-RECOGNITION_COOLDOWN = 60  # seconds
+@app.post("/upload/batch", response_model=schemas.StandardResponse)
+async def upload_batch(
+    archive: Optional[UploadFile] = File(None),
+    manifest: Optional[UploadFile] = File(None),
+    pictures: List[UploadFile] = File(default=[]),
+    replace_templates: bool = Form(False)
+):
+    """
+    Bulk enrollment. Send either a ZIP `archive` containing manifest.csv (or
+    manifest.json) and the images, or a `manifest` file plus the `pictures`.
+    Manifest columns: id, name, member_code, image (";"-separated names,
+    extension optional). Returns a job id at once; poll GET /jobs/{job_id}.
+    As with /upload, when GALLERY_MAX_TEMPLATES > 1 a row for an existing employee
+    adds its templates to the stored ones (pruned to the cap) unless
+    replace_templates is set; otherwise it replaces the stored embedding.
+    """
+    not_ready = gallery_loading_response()
+    if not_ready is not None:
+        return not_ready
+    try:
+        if archive is not None:
+            path = await run_in_threadpool(save_upload, archive.file)
+            try:
+                source = await run_in_threadpool(ImageSource, path)
+            except zipfile.BadZipFile:
+                os.remove(path)
+                raise ManifestError("Archive is not a valid ZIP file")
+            try:
+                manifest_bytes, manifest_name = await run_in_threadpool(source.manifest)
+                rows = parse_manifest(manifest_bytes, manifest_name)
+            except Exception:
+                source.close()
+                raise
+        elif manifest is not None and pictures:
+            rows = parse_manifest(await manifest.read(), manifest.filename or "manifest.csv")
+            files = {}
+            for picture in pictures:
+                files[os.path.basename(picture.filename)] = await picture.read()
+            source = ImageSource(files=files)
+        else:
+            raise ManifestError("Send a ZIP archive, or a manifest together with pictures")
+    except (ManifestError, UnicodeDecodeError) as e:
+        return JSONResponse(status_code=400, content=make_response(0, 2, False, str(e)))
+
+    job = enrollment_jobs.create(total=len(rows))
+    job.task = asyncio.create_task(run_enrollment_job(job, rows, source, AsyncSessionLocal, replace_templates))
+    return JSONResponse(
+        status_code=202,
+        content=make_response(1, 1, True, f"Enrollment job queued for {len(rows)} rows.",
+                              {"job_id": job.id, "total": len(rows)})
+    )
+
+
+@app.get("/jobs/{job_id}", response_model=schemas.StandardResponse)
+async def get_job(job_id: str):
+    """Progress, per-row failures and throughput of a bulk enrollment job."""
+    job = enrollment_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return JSONResponse(status_code=200, content=make_response(1, 1, True, job.status, job.to_dict()))
+
+
+async def _cooldown_call(fn, *args):
+    """Call a cooldown store method; a blocking (SQLite) store runs on the threadpool."""
+    if recognition_cooldown.blocking:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
+
+async def log_recognition(best_face: dict):
+    """Queue a recognition-log entry for a matched face, once per cooldown window."""
+    try:
+        # the match carries the gallery id, so namesakes are never confused
+        emp_id_to_log = best_face["employee_id"]
+        member_code_to_log = best_face["member_code"]
+
+        # --- Cooldown logic: avoid multiple inserts for same person ---
+        # Marked *before* insert (atomic check-and-set) to block concurrent duplicates
+        if await _cooldown_call(recognition_cooldown.check_and_set, emp_id_to_log):
+            # write-behind: buffered and inserted in bulk, the response never waits on the DB
+            if recognition_log_writer.submit(
+                emp_id=emp_id_to_log,
+                name=best_face["name"],
+                member_code=member_code_to_log
+            ):
+                logging.info(f"✅ Recognition logged for {best_face['name']}")
+            else:
+                # Roll back the cooldown if the log buffer is full
+                await _cooldown_call(recognition_cooldown.release, emp_id_to_log)
+                logging.error(f"Failed to queue recognition log for {best_face['name']}: buffer full")
+        else:
+            logging.info(
+                f"⚠️ Skipped duplicate recognition for {best_face['name']} (within {recognition_cooldown.ttl:.0f}s)"
+            )
+
+    except Exception as log_error:
+        logging.error(f"Failed to save recognition log: {log_error}")
+
 
 @app.post("/recognize", response_model=schemas.RecognitionResponse)
 async def recognize(background_tasks: BackgroundTasks, # Add this
     file: UploadFile = File(...), 
     db: AsyncSession = Depends(get_db)
 ):
+    started = time.perf_counter()
     try:
-        contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image_bgr = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        if image_bgr is None:
-            logging.error("cv2.imdecode failed, image is None.")
-            return {"faces": []}
+        with STAGE_SECONDS.time("read"):
+            contents = await file.read()
 
-        cache_data = embedding_cache.get_all()
-        if embedding_cache.is_empty():
+        # one immutable snapshot for the whole request: names, ids and rows always line up
+        cache_data = embedding_cache.snapshot()
+        gallery_index = cache_data.index
+        if not cache_data.ids:
             logging.warning("Recognition attempted but embedding cache is empty.")
             return {"faces": []}
-            
-        recognized_faces = await run_in_threadpool(
-            detect_and_recognize_faces, image_bgr=image_bgr, cache_data=cache_data
-        )
+
+        # byte-identical frames and retries reuse the previous result for this gallery version
+        content_hash = content_key(contents)
+        recognized_faces = recognition_cache.get_result(content_hash, cache_data.version)
+        if recognized_faces is None:
+            # detect on a reduced decode, align on full resolution (only decoded when a face was found)
+            prepared = await run_prepare_faces(contents)
+
+            if prepared is None:
+                logging.error("cv2.imdecode failed, image is None.")
+                return {"faces": []}
+
+            # detect/align on the threadpool, then share the ArcFace run with concurrent requests;
+            # faces seen in a recent frame reuse their embedding
+            faces, batch = prepared
+            recognized_faces = []
+            if batch is not None:
+                embs = await recognition_cache.embed(batch, cache_data.version, embed_faces)
+                kept = [(face, emb) for face, emb in zip(faces, embs) if emb is not None]
+                if kept:
+                    recognized_faces = await run_in_threadpool(
+                        build_recognition_results,
+                        [face for face, _ in kept],
+                        np.stack([emb for _, emb in kept], axis=0),
+                        cache_data,
+                        gallery_index
+                    )
+            recognition_cache.put_result(content_hash, cache_data.version, recognized_faces)
 
         if recognized_faces:
             best_face = max(
@@ -158,72 +424,130 @@ async def recognize(background_tasks: BackgroundTasks, # Add this
                 default=None
             )
             if best_face:
-                try:
-                    names, _, ids, member_codes = embedding_cache.get_all()
-                    idx = names.index(best_face["name"])
-                    emp_id_to_log = ids[idx]
-                    member_code_to_log = member_codes[idx]
-                    
-                    # background_tasks.add_task(
-                    #     crud.create_recognition_log,
-                    #     db=db,
-                    #     emp_id=emp_id_to_log,
-                    #     name=best_face["name"],
-                    #     member_code=member_code_to_log
-                    # )
-                    
-                    # await crud.create_recognition_log(
-                    # db=db,
-                    # emp_id=emp_id_to_log,
-                    # name=best_face["name"],
-                    # member_code=member_code_to_log
-                    # )
-                    
-                    # --- Cooldown logic: avoid multiple inserts for same person ---
-                    now = time.time()
-                    last_time = recent_recognitions.get(emp_id_to_log, 0)
-                    
-                    if now - last_time > RECOGNITION_COOLDOWN:
-                        # Mark it *before* insert to block concurrent duplicates
-                        recent_recognitions[emp_id_to_log] = now  
-                    
-                        try:
-                            await crud.create_recognition_log(
-                                db=db,
-                                emp_id=emp_id_to_log,
-                                name=best_face["name"],
-                                member_code=member_code_to_log
-                            )
-                            logging.info(f"✅ Recognition logged for {best_face['name']}")
-                        except Exception as log_error:
-                            # Roll back the timestamp if DB insert fails
-                            recent_recognitions.pop(emp_id_to_log, None)
-                            logging.error(f"Failed to save recognition log: {log_error}")
-                    else:
-                        logging.info(
-                            f"⚠️ Skipped duplicate recognition for {best_face['name']} (within {RECOGNITION_COOLDOWN}s)"
-                        )
-
-
-                except Exception as log_error:
-                    logging.error(f"Failed to save recognition log: {log_error}")
+                await log_recognition(best_face)
         
         return {"faces": recognized_faces}
     except Exception as e:
         logging.exception("Error processing recognition request: %s", e)
         return {"faces": []}
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, "recognize")
+
+@app.websocket("/recognize/stream")
+async def recognize_stream(websocket: WebSocket):
+    """
+    Streaming recognition for kiosks: send JPEG/PNG frames as binary messages,
+    receive one JSON message per processed frame:
+    {"frame": n, "faces": [{track_id, name, member_code, employee_id, box, score, votes, embedded}], "dropped": d}
+    Only the newest frame is kept while one is being processed; older ones are
+    dropped (counted in "dropped"), so a fast client never builds a backlog.
+    """
+    await websocket.accept()
+    session = StreamSession(on_confirmed=log_recognition)
+    pending = {"frame": None, "seq": 0}
+    dropped = 0
+    frame_ready = asyncio.Event()
+
+    async def receive_frames():
+        nonlocal dropped
+        while True:
+            data = await websocket.receive_bytes()
+            if pending["frame"] is not None:
+                dropped += 1
+            pending["seq"] += 1
+            pending["frame"] = data
+            frame_ready.set()
+
+    async def process_frames():
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            data, seq = pending["frame"], pending["seq"]
+            pending["frame"] = None
+            faces = await session.process_frame(data)
+            if faces is None:
+                await websocket.send_json({"frame": seq, "faces": [], "dropped": dropped, "error": "undecodable frame"})
+                continue
+            await websocket.send_json({"frame": seq, "faces": faces, "dropped": dropped})
+
+    receiver = asyncio.create_task(receive_frames())
+    processor = asyncio.create_task(process_frames())
+    try:
+        done, _ = await asyncio.wait({receiver, processor}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            exc = task.exception()
+            if exc is not None and not isinstance(exc, WebSocketDisconnect):
+                logging.error("Recognition stream failed: %s", exc, exc_info=exc)
+    finally:
+        receiver.cancel()
+        processor.cancel()
+        logging.info("Recognition stream closed: %s, %d frames dropped", session.stats(), dropped)
+
+def _threadpool_usage() -> dict:
+    # anyio's default limiter runs every run_in_threadpool call; read on the event loop at scrape time
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    return {"busy": statistics.borrowed_tokens, "waiting": statistics.tasks_waiting, "capacity": limiter.total_tokens}
+
+
+metrics_registry.gauge("facerecog_gallery_size", "Employees in this worker's embedding cache.",
+                       lambda: len(embedding_cache.snapshot().ids))
+metrics_registry.gauge("facerecog_gallery_templates", "Template rows in this worker's embedding cache.",
+                       lambda: embedding_cache.snapshot().templates)
+metrics_registry.gauge("facerecog_threadpool", "Threadpool threads in use, calls queued for one, and capacity.",
+                       _threadpool_usage, labelname="state")
+metrics_registry.gauge("facerecog_batcher_queue_depth", "Faces waiting in the inference batcher.",
+                       lambda: inference_batcher.stats()["queue_depth"])
+metrics_registry.gauge("facerecog_inference_pool_in_flight", "Calls submitted to the inference process pool and not yet done.",
+                       lambda: inference_pool.submitted - inference_pool.completed)
+metrics_registry.gauge("facerecog_log_writer_buffered", "Recognition log rows waiting to be written.",
+                       lambda: recognition_log_writer.stats()["buffered"])
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of the per-stage latency histograms, face counters and gauges."""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/stats/batching")
+async def batching_stats():
+    """Rolling batch size / queue wait statistics of the inference batcher."""
+    return inference_batcher.stats()
+
+@app.get("/stats/inference_pool")
+async def inference_pool_stats():
+    """Calls, failures, in-flight work and call latency of the inference process pool."""
+    return inference_pool.stats()
+
+@app.get("/stats/log_writer")
+async def log_writer_stats():
+    """Buffer depth, written / rejected / failed counts of the recognition log writer."""
+    return recognition_log_writer.stats()
+
+@app.get("/stats/result_cache")
+async def result_cache_stats():
+    """Hit rate, entries and approximate bytes of the frame-result and face-embedding caches."""
+    return recognition_cache.stats()
+
+@app.get("/stats/cooldown")
+async def cooldown_stats():
+    """Entries, suppressed writes (hits), expiries and evictions of the recognition cooldown."""
+    return await _cooldown_call(recognition_cooldown.stats)
 
 @app.delete("/employees/{employee_id}", response_model=schemas.StandardResponse)
 async def delete_employee(employee_id: str, db: AsyncSession = Depends(get_db)):
     """
     Deletes an employee record from the database and the live cache.
     """
+    not_ready = gallery_loading_response()
+    if not_ready is not None:
+        return not_ready
     deleted_employee = await crud.delete_employee_by_id(db, employee_id)
 
     if not deleted_employee:
         raise HTTPException(status_code=404, detail=f"Employee with ID '{employee_id}' not found.")
 
-    embedding_cache.remove_employee(employee_id)
+    await run_in_threadpool(embedding_cache.remove_employee, employee_id)
 
     message = f"Successfully deleted employee {deleted_employee.name} (ID: {employee_id})."
     return JSONResponse(
@@ -256,23 +580,120 @@ async def get_recognitions_datewise_post(
     """
     Fetch recognition logs grouped by date (POST method).
     Example body: {"date": "2025-10-30"}
+    Optional: "start_date" / "end_date" (inclusive range, instead of "date"),
+    "employee_id", "member_code", "limit" (page size) and "cursor" (the
+    "next_cursor" of the previous page).
     """
     try:
         date = data.get("date")
-        grouped_data = await crud.get_recognitions_grouped_by_date(db)
+        start, end = _parse_date_range(date, data.get("start_date"), data.get("end_date"))
+        after = _decode_cursor(data.get("cursor"))
+        limit = data.get("limit")
+        if limit is not None:
+            # 0 is a bad page size, not "no limit"
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError("limit must be positive")
+            limit = min(limit, settings.DATEWISE_MAX_PAGE_SIZE)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request: {e}")
 
-        # Filter by specific date if provided
-        if date:
-            grouped_data = {date: grouped_data.get(date, [])}
+    try:
+        grouped_data, last = await crud.get_recognitions_datewise(
+            db, start=start, end=end,
+            employee_id=data.get("employee_id"), member_code=data.get("member_code"),
+            limit=limit, after=after
+        )
+
+        # A specific date is always present in the response, even without logs
+        if date and not grouped_data:
+            grouped_data = {date: []}
 
         return JSONResponse(
             status_code=200,
             content={
                 "status": True,
                 "message": "Recognition logs fetched successfully.",
-                "data": grouped_data
+                "data": grouped_data,
+                "next_cursor": _encode_cursor(last)
             }
         )
     except Exception as e:
         logging.error(f"Error fetching recognitions: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Failed to fetch recognition logs.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to fetch recognition logs.")
+
+
+# ------------------------------------------------
+# Route: POST API for the daily attendance summary
+# ------------------------------------------------
+@app.post("/attendance/daily")
+async def get_daily_attendance_post(
+    data: dict = Body(...),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    One row per employee per day (first seen, last seen, recognition count),
+    served from the daily_attendance table.
+    Example body: {"start_date": "2025-10-01", "end_date": "2025-10-31"}
+    Optional: "date" (a single day), "employee_id", "member_code".
+    """
+    try:
+        start, end = _parse_date_range(data.get("date"), data.get("start_date"), data.get("end_date"))
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request: {e}")
+
+    try:
+        rows = await crud.get_daily_attendance(
+            db,
+            start=start.date() if start else None,
+            end=end.date() if end else None,
+            employee_id=data.get("employee_id"),
+            member_code=data.get("member_code")
+        )
+        return JSONResponse(
+            status_code=200,
+            content={
+                "status": True,
+                "message": "Daily attendance fetched successfully.",
+                "data": [
+                    {
+                        "date": row.day.strftime("%Y-%m-%d"),
+                        "employee_id": row.employee_id,
+                        "name": row.name,
+                        "member_code": row.member_code,
+                        "first_seen": row.first_seen.strftime("%H:%M:%S"),
+                        "last_seen": row.last_seen.strftime("%H:%M:%S"),
+                        "count": row.count
+                    }
+                    for row in rows
+                ]
+            }
+        )
+    except Exception as e:
+        logging.error(f"Error fetching daily attendance: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to fetch daily attendance.")
+
+
+def _parse_date_range(date, start_date, end_date):
+    """YYYY-MM-DD strings -> half-open [start, end) datetimes (either may be None)."""
+    if date:
+        start_date = end_date = date
+    start = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+    end = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1) if end_date else None
+    return start, end
+
+
+def _encode_cursor(last):
+    if last is None:
+        return None
+    recognized_at, row_id = last
+    return f"{recognized_at.isoformat()}|{row_id}"
+
+
+def _decode_cursor(cursor):
+    if cursor is None or cursor == "":
+        return None
+    if not isinstance(cursor, str):
+        raise ValueError("cursor must be the next_cursor string of the previous page")
+    recognized_at, row_id = cursor.rsplit("|", 1)
+    return datetime.fromisoformat(recognized_at), int(row_id)
@@ -0,0 +1,163 @@
+# app/metrics.py
+
+"""In-process metrics in the Prometheus text exposition format (served at /metrics).
+
+A small, dependency-free subset of what prometheus_client offers: labelled
+counters, histograms and callback gauges. An observation costs one lock and a
+bisect. Values are per process: with several uvicorn workers each one is a
+separate scrape target, and work done inside inference-pool children is only
+visible in the parent's end-to-end stages.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# seconds; from a cached-face lookup up to a slow MTCNN pass on a big photo
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0.0)]
+        for labels, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time (a number, or {label value: number})."""
+
+    def __init__(self, name: str, help: str, callback: Callable[[], object], labelname: Optional[str] = None):
+        self.name, self.help, self.callback, self.labelname = name, help, callback, labelname
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.callback()
+        except Exception:
+            return lines  # a failing source must not break the whole scrape
+        if isinstance(value, dict):
+            for label, v in sorted(value.items()):
+                lines.append(f"{self.name}{_labels((self.labelname,), (label,))} {_number(v)}")
+        else:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[object] = []
+        self._names = set()
+
+    def register(self, metric):
+        if metric.name in self._names:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._names.add(metric.name)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, callback: Callable[[], object], labelname: Optional[str] = None) -> Gauge:
+        return self.register(Gauge(name, help, callback, labelname))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Global registry and the metrics the recognition path records into
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "facerecog_stage_seconds",
+    "Time spent per pipeline stage (read, decode, detect, detect_fallback, align, embed, match, enroll_score, log_write, recognize).",
+    labelnames=("stage",),
+))
+FACES_DETECTED = registry.register(Counter(
+    "facerecog_faces_detected_total", "Faces returned by the detectors."))
+FACES_REJECTED = registry.register(Counter(
+    "facerecog_faces_rejected_total", "Faces dropped by the quality gates before embedding.", labelnames=("reason",)))
+DETECTOR_FALLBACKS = registry.register(Counter(
+    "facerecog_detector_fallback_total", "Detections that fell through to the fallback detector."))
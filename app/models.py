@@ -1,6 +1,6 @@
 # app/models.py
 
-from sqlalchemy import Column, String, LargeBinary, Integer, DateTime
+from sqlalchemy import Column, String, LargeBinary, Integer, DateTime, Date, func
 from .db import Base
 from datetime import datetime
 
@@ -12,13 +12,27 @@ class Employee(Base):
     member_code = Column(String, nullable=True, index=True)
     embedding = Column(LargeBinary, nullable=False)
     image_path = Column(String, nullable=True)
+    # stamped by the database clock (rendered inline as now()), never the app server's
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), server_default=func.now(), index=True)
 
 class RecognitionLog(Base):
     __tablename__ = "recognition_log"
 
     id = Column(Integer, primary_key=True, index=True)
-    employee_id = Column(String)
+    employee_id = Column(String, index=True)
     name = Column(String)
     member_code = Column(String)
-    recognized_at = Column(DateTime, default=datetime.utcnow)
-    source = Column(String, default="live_recognize_api")
\ No newline at end of file
+    recognized_at = Column(DateTime, default=datetime.utcnow, index=True)
+    source = Column(String, default="live_recognize_api")
+
+class DailyAttendance(Base):
+    """One row per employee per day, kept up to date by the recognition-log writer."""
+    __tablename__ = "daily_attendance"
+
+    employee_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    name = Column(String)
+    member_code = Column(String, index=True)
+    first_seen = Column(DateTime, nullable=False)
+    last_seen = Column(DateTime, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
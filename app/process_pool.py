@@ -0,0 +1,302 @@
+# app/process_pool.py
+
+"""Optional process pool for the CPU-bound half of inference (INFERENCE_EXECUTOR="process").
+
+Decoding, detection pre/post-processing, alignment and the per-face Python
+loops hold the GIL, so on the threadpool one uvicorn worker cannot use more
+than about one core for them. Here they run in INFERENCE_PROCESSES spawned
+children. Each child loads the detector and ArcFace once in its initializer,
+with INFERENCE_ORT_THREADS intra-op threads, so the children do not
+oversubscribe the cores (INFERENCE_PROCESSES=0 divides the CPUs among the
+WEB_CONCURRENCY uvicorn workers, since each has a pool). Upload bytes go to a
+child through a multiprocessing.shared_memory block that the parent owns and
+unlinks when the call completes. Only the name and length of the block are
+pickled. The small results (face dicts, the preprocessed batch, an embedding)
+come back the ordinary way.
+
+The initializer sets the thread count before it calls
+ai_processing.load_models(), so the children's sessions are built with it.
+
+A child that dies (OOM kill, segfault in native code) breaks the whole
+executor: every pending call fails with BrokenProcessPool and so would every
+later one. The pool then drops the executor, reports not-ready and respawns
+the children in a background thread; calls made meanwhile fail fast.
+"""
+
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+from typing import Deque, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from .config import settings
+
+INFERENCE_EXECUTORS = ("thread", "process")
+
+
+# ----------------- Child side -----------------
+
+def _init_child(ort_threads: int, ready):
+    # before app.ai_processing is imported, so its ORT sessions use this thread count
+    settings.ORT_INTRA_OP_THREADS = ort_threads
+    import cv2
+    cv2.setNumThreads(1)  # parallelism comes from the processes
+    from .ai_processing import load_models
+    load_models()
+    with ready.get_lock():
+        ready.value += 1
+    logging.info("Inference child %d ready", os.getpid())
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _read_block(ref: Tuple[str, int]) -> bytes:
+    """Copy an upload out of the parent's shared memory block.
+    The copy is a memcpy. A view would keep the block mapped until every numpy array
+    decoded from it was freed, including arrays held by an exception traceback.
+    """
+    name, size = ref
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # before 3.13 attaching registers the block with this child's resource
+        # tracker, which would unlink the parent's block when the child exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+
+def _child_prepare_faces(refs: List[Tuple[str, int]]):
+    from .ai_processing import prepare_faces_from_bytes
+    return prepare_faces_from_bytes(_read_block(refs[0]))
+
+
+def _child_process_employee_images(refs: List[Tuple[str, int]], employee_name: str, employee_id: str,
+                                   filenames: List[str]):
+    from .ai_processing import process_employee_images
+    files_data = [(filename, _read_block(ref)) for filename, ref in zip(filenames, refs)]
+    return process_employee_images(employee_name=employee_name, employee_id=employee_id, files_data=files_data)
+
+
+# ----------------- Parent side -----------------
+
+class _SharedBlock:
+    """Parent-owned shared memory copy of one upload; freed when its call completes."""
+
+    def __init__(self, data: bytes):
+        self.size = len(data)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, self.size))
+        self.shm.buf[:self.size] = data
+
+    @property
+    def ref(self) -> Tuple[str, int]:
+        return self.shm.name, self.size
+
+    def free(self):
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except (FileNotFoundError, BufferError):
+            logging.exception("Could not free shared memory block %s", self.shm.name)
+
+
+class InferencePool:
+    """Spawned child processes with preloaded models, fed through shared memory."""
+
+    def __init__(self, processes: int = 0, ort_threads: int = 1, stats_window: int = 1024, workers: int = 1):
+        # every uvicorn worker has its own pool: by default they split the CPUs
+        self.processes = processes if processes > 0 else max(1, (os.cpu_count() or 1) // max(1, workers))
+        self.ort_threads = max(1, ort_threads)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._started = False
+        self._timeout = 300.0
+        self._lock = threading.Lock()
+        self._run_times_ms: Deque[float] = deque(maxlen=stats_window)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+
+    @property
+    def running(self) -> bool:
+        """Started and not stopped: calls go to the pool (and fail fast while it respawns)."""
+        return self._started
+
+    @property
+    def ready(self) -> bool:
+        """Children are up and accepting calls."""
+        return self._executor is not None
+
+    def _spawn(self, timeout: float) -> ProcessPoolExecutor:
+        started = time.perf_counter()
+        context = mp.get_context("spawn")  # never fork a process that already runs ORT threads
+        ready = context.Value("i", 0)
+        executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=context,
+            initializer=_init_child,
+            initargs=(self.ort_threads, ready),
+        )
+        try:
+            # one task per child: the executor spawns a process for each while none is idle
+            for future in [executor.submit(_ping) for _ in range(self.processes)]:
+                future.result()
+            while ready.value < self.processes:
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError(f"Inference pool: only {ready.value}/{self.processes} children loaded their models")
+                time.sleep(0.05)
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        logging.info("Inference pool started: %d processes, %d ORT threads each, in %.1fs",
+                     self.processes, self.ort_threads, time.perf_counter() - started)
+        return executor
+
+    def start(self, timeout: float = 300.0):
+        """Spawn the children and wait until each has loaded its models (blocking)."""
+        if self.running:
+            return
+        self._timeout = timeout
+        self._executor = self._spawn(timeout)
+        self._started = True
+
+    def stop(self):
+        with self._lock:
+            self._started = False
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+            logging.info("Inference pool stopped")
+
+    def _broken(self, executor: ProcessPoolExecutor):
+        """A child died: drop the executor and respawn the children in the background (once per breakage)."""
+        with self._lock:
+            if self._executor is not executor:
+                return  # already being replaced, or stopped
+            self._executor = None
+            self.restarts += 1
+        logging.error("Inference pool is broken (a child process died); respawning it")
+        threading.Thread(target=self._respawn, args=(executor,), name="inference-pool-respawn", daemon=True).start()
+
+    def _respawn(self, broken: ProcessPoolExecutor):
+        broken.shutdown(wait=False, cancel_futures=True)
+        delay = 1.0
+        while self._started:
+            try:
+                executor = self._spawn(self._timeout)
+            except Exception:
+                logging.exception("Inference pool respawn failed; retrying in %.0fs", delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 60.0)
+                continue
+            with self._lock:
+                if self._started:
+                    self._executor, executor = executor, None
+            if executor is not None:  # stopped while the children were loading
+                executor.shutdown(wait=False, cancel_futures=True)
+            return
+
+    def submit(self, fn, blobs: List[bytes], *args) -> Future:
+        """Run fn(refs, *args) in a child, with each blob in its own shared memory block."""
+        executor = self._executor
+        if executor is None:
+            raise RuntimeError("Inference pool is restarting" if self.running else "Inference pool is not running")
+        blocks = [_SharedBlock(b) for b in blobs]
+        started = time.perf_counter()
+        try:
+            future = executor.submit(fn, [b.ref for b in blocks], *args)
+        except Exception as e:
+            for block in blocks:
+                block.free()
+            if isinstance(e, BrokenProcessPool):
+                self._broken(executor)
+            raise
+        with self._lock:
+            self.submitted += 1
+
+        def done(f: Future):
+            for block in blocks:
+                block.free()
+            error = None if f.cancelled() else f.exception()
+            with self._lock:
+                self.completed += 1
+                if f.cancelled() or error is not None:
+                    self.failed += 1
+                self._run_times_ms.append((time.perf_counter() - started) * 1000.0)
+            if isinstance(error, BrokenProcessPool):
+                self._broken(executor)
+
+        future.add_done_callback(done)
+        return future
+
+    def prepare_faces_from_bytes(self, data: bytes) -> Future:
+        return self.submit(_child_prepare_faces, [data])
+
+    def process_employee_images(self, employee_name: str, employee_id: str,
+                                files_data: List[Tuple[str, bytes]]) -> Future:
+        filenames = [filename for filename, _ in files_data]
+        return self.submit(_child_process_employee_images, [contents for _, contents in files_data],
+                           employee_name, employee_id, filenames)
+
+    def stats(self) -> dict:
+        with self._lock:
+            times = np.asarray(self._run_times_ms, dtype=np.float64)
+            in_flight = self.submitted - self.completed
+        return {
+            "running": self.running,
+            "ready": self.ready,
+            "restarts": self.restarts,
+            "processes": self.processes,
+            "ort_threads": self.ort_threads,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_flight": in_flight,
+            "call_ms": {
+                "mean": round(float(times.mean()), 3) if times.size else 0.0,
+                "p50": round(float(np.percentile(times, 50)), 3) if times.size else 0.0,
+                "p99": round(float(np.percentile(times, 99)), 3) if times.size else 0.0,
+            },
+        }
+
+
+# Global inference pool (started by the app only when INFERENCE_EXECUTOR="process")
+inference_pool = InferencePool(
+    processes=settings.INFERENCE_PROCESSES,
+    ort_threads=settings.INFERENCE_ORT_THREADS,
+    workers=settings.WEB_CONCURRENCY,
+)
+
+
+async def run_prepare_faces(data: bytes):
+    """ai_processing.prepare_faces_from_bytes in a pool child when the pool is running,
+    otherwise on the threadpool."""
+    if inference_pool.running:
+        return await asyncio.wrap_future(inference_pool.prepare_faces_from_bytes(data))
+    from .ai_processing import prepare_faces_from_bytes
+    return await run_in_threadpool(prepare_faces_from_bytes, data)
+
+
+async def run_process_employee_images(employee_name: str, employee_id: str, files_data: List[Tuple[str, bytes]]):
+    """ai_processing.process_employee_images in a pool child when the pool is running,
+    otherwise on the threadpool."""
+    if inference_pool.running:
+        return await asyncio.wrap_future(inference_pool.process_employee_images(employee_name, employee_id, files_data))
+    from .ai_processing import process_employee_images
+    return await run_in_threadpool(
+        process_employee_images, employee_name=employee_name, employee_id=employee_id, files_data=files_data
+    )
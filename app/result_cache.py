@@ -0,0 +1,187 @@
+# app/result_cache.py
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Optional
+
+import numpy as np
+
+from .config import settings
+
+
+class LRUTTLCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after insertion.
+    Bounded by entry count and by the approximate bytes of the stored values.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 5.0, max_bytes: int = 64 * 2**20):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.max_bytes = int(max_bytes)
+        self._data: "OrderedDict[bytes, tuple]" = OrderedDict()  # key -> (expires_at, value, nbytes)
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: bytes, now: Optional[float] = None) -> Any:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value, size = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.nbytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: bytes, value: Any, size: int, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        size += len(key)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._data[key] = (now + self.ttl, value, size)
+            self.nbytes += size
+            while len(self._data) > self.max_entries or (self.nbytes > self.max_bytes and len(self._data) > 1):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.nbytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+def content_key(data: bytes) -> bytes:
+    """Level-one key: 128-bit BLAKE2b of the raw upload bytes."""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def face_key(tensor: np.ndarray) -> bytes:
+    """Level-two key: 128-bit BLAKE2b of one preprocessed (3,112,112) face.
+
+    The model input is a fixed function of the aligned 112x112 crop, so hashing
+    it identifies the crop exactly. Aligned faces share their layout, so a
+    perceptual hash collides across different people and a hit would reuse
+    someone else's embedding; only a bit-identical crop may skip ArcFace.
+    """
+    return hashlib.blake2b(np.ascontiguousarray(tensor, dtype=np.float32).tobytes(), digest_size=16).digest()
+
+
+class RecognitionCache:
+    """Two-level cache in front of /recognize.
+
+    Level one maps the hash of a request's raw bytes to its finished result, so
+    byte-identical frames and retries skip decoding, detection and embedding.
+    Level two maps the hash of each preprocessed face to its embedding, so the
+    same crop arriving in a re-encoded copy of a frame skips ArcFace. Both levels are tagged
+    with the gallery snapshot version they were filled under and are cleared as
+    soon as a request sees a newer one, so enrollments and deletions take effect
+    immediately.
+    """
+
+    def __init__(self, result_entries: int = 1024, result_ttl: float = 5.0,
+                 face_entries: int = 4096, face_ttl: float = 30.0,
+                 max_bytes: int = 64 * 2**20,
+                 results_enabled: bool = True, faces_enabled: bool = True):
+        self.results = LRUTTLCache(result_entries, result_ttl, max_bytes)
+        self.faces = LRUTTLCache(face_entries, face_ttl, max_bytes)
+        self.results_enabled = results_enabled
+        self.faces_enabled = faces_enabled
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _current(self, version: int) -> bool:
+        """Adopt a newer gallery version (dropping both levels). False for a stale one."""
+        with self._lock:
+            if self._version is None or version > self._version:
+                if self._version is not None:
+                    self.results.clear()
+                    self.faces.clear()
+                self._version = version
+            return version == self._version
+
+    # ---------- level one: raw bytes -> result ----------
+
+    def get_result(self, key: bytes, version: int) -> Optional[List[dict]]:
+        if not self.results_enabled or not self._current(version):
+            return None
+        return self.results.get(key)
+
+    def put_result(self, key: bytes, version: int, faces: List[dict]):
+        if not self.results_enabled or not self._current(version):
+            return
+        self.results.put(key, faces, 256 * max(1, len(faces)))
+
+    # ---------- level two: aligned face -> embedding ----------
+
+    async def embed(self, batch: np.ndarray, version: int,
+                    embed_fn: Callable[[np.ndarray], Awaitable[List[Optional[np.ndarray]]]]) -> List[Optional[np.ndarray]]:
+        """Embeddings of an (F,3,112,112) batch; only crops not seen recently reach `embed_fn`."""
+        if not self.faces_enabled or not self._current(version):
+            return list(await embed_fn(batch))
+
+        keys = [face_key(t) for t in batch]
+        embs: List[Optional[np.ndarray]] = [self.faces.get(k) for k in keys]
+        missing = [i for i, e in enumerate(embs) if e is None]
+        if missing:
+            fresh = await embed_fn(batch[missing])
+            for i, emb in zip(missing, fresh):
+                embs[i] = emb
+                if emb is not None and self._current(version):
+                    self.faces.put(keys[i], emb, emb.nbytes)
+        return embs
+
+    def stats(self) -> dict:
+        return {
+            "gallery_version": self._version,
+            "results": dict(self.results.stats(), enabled=self.results_enabled),
+            "faces": dict(self.faces.stats(), enabled=self.faces_enabled),
+        }
+
+
+# Global recognition cache
+recognition_cache = RecognitionCache(
+    result_entries=settings.RESULT_CACHE_MAX_ENTRIES,
+    result_ttl=settings.RESULT_CACHE_TTL_SECONDS,
+    face_entries=settings.FACE_CACHE_MAX_ENTRIES,
+    face_ttl=settings.FACE_CACHE_TTL_SECONDS,
+    max_bytes=settings.RESULT_CACHE_MAX_MB * 2**20,
+    results_enabled=settings.RESULT_CACHE_ENABLED,
+    faces_enabled=settings.FACE_CACHE_ENABLED,
+)
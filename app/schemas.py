@@ -28,6 +28,7 @@ class FaceResult(BaseModel):
     member_code: Optional[str] = None
     box: List[int]
     score: float
+    employee_id: Optional[str] = None
 
 class RecognitionResponse(BaseModel):
     faces: List[FaceResult]
\ No newline at end of file
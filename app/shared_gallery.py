@@ -0,0 +1,282 @@
+# app/shared_gallery.py
+
+import asyncio
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .ann import CompactGallery
+
+
+class SharedGalleryState(NamedTuple):
+    """The base of one shared generation; the changes appended since are in its log."""
+    generation: int
+    names: List[str]
+    ids: List[str]
+    member_codes: List[str]
+    embeddings: np.ndarray  # memory map of the whole (capacity,512) matrix file
+    rows: int  # rows of the base; later ones are appended in place
+    centroids: Optional[np.ndarray]  # IVF centroids, when the writer had an ANN index
+    labels: Optional[np.ndarray]  # IVF list of every base row
+    trained_size: int
+    compact: Optional[CompactGallery]  # float16/int8 rows, memory-mapped like the float32 ones
+    owners: Optional[np.ndarray]  # employee of every base row; None when each employee has a single row
+
+
+# control file: sequence number (odd while a writer updates it), generation, committed log bytes
+_CONTROL = struct.Struct("<qqq")
+
+
+class SharedGallery:
+    """A gallery shared by every worker process through memory-mapped files.
+
+    Layout of `directory`:
+      control              sequence / generation / log length, mmap'd by every worker
+      lock                 flock(2) target that serialises writers
+      startup              flock(2) target held by the worker deciding how to load the gallery
+      members              flock(2) target every running worker holds shared once it serves the gallery
+      gallery-<gen>.npy    (capacity,512) float32 matrix, mapped by every worker
+      gallery-<gen>.json   base ids / names / member codes
+      gallery-<gen>.log    one JSON line per mutation since the base
+      gallery-<gen>.ivf.npz  optional IVF centroids and base row labels
+      gallery-<gen>.q.npy / .qs.npy  optional float16/int8 rows and int8 scales (capacity rows)
+      gallery-<gen>.own.npy  optional owner of every base row (several templates per employee)
+
+    A generation's matrix files are created with spare rows. A writer takes the
+    lock, writes new template rows past the last used one, appends a log record
+    per mutation and then advances the committed log length in `control`.
+    Readers compare `control` with what they hold (three 8-byte reads) and
+    replay only the new records, so an enrollment costs every worker O(its
+    templates) while the page cache holds a single copy of the matrix no matter
+    how many workers run. Published rows are never written again: a new
+    generation (live rows only, room to double) is written when the file is
+    full or the log has retired too many rows.
+    """
+
+    KEEP_GENERATIONS = 3
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock_fd = os.open(os.path.join(directory, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._members_fd: Optional[int] = None  # opened by the worker itself, never inherited
+
+        fd = os.open(os.path.join(directory, "control"), os.O_RDWR | os.O_CREAT, 0o644)
+        with self.write_lock():
+            if os.fstat(fd).st_size != _CONTROL.size:
+                # new, or left by an older layout: start from "nothing published"
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, _CONTROL.size)
+        self._control_fd = fd
+        self._control = mmap.mmap(fd, _CONTROL.size)
+
+    # ---------- coordination ----------
+
+    def head(self) -> Tuple[int, int]:
+        """(generation, committed log bytes). Lock-free: retried while a writer is mid-update."""
+        spins = 0
+        while True:
+            seq, generation, log_end = _CONTROL.unpack_from(self._control, 0)
+            if seq % 2 == 0 and struct.unpack_from("<q", self._control, 0)[0] == seq:
+                return generation, log_end
+            spins += 1
+            if spins > 100:
+                time.sleep(0.0001)
+
+    def generation(self) -> int:
+        return self.head()[0]
+
+    def _set_head(self, generation: int, log_end: int):
+        seq = struct.unpack_from("<q", self._control, 0)[0] | 1
+        struct.pack_into("<q", self._control, 0, seq)
+        struct.pack_into("<qq", self._control, 8, generation, log_end)
+        struct.pack_into("<q", self._control, 0, seq + 1)
+
+    @contextmanager
+    def write_lock(self):
+        """Exclusive across processes (flock) and threads; re-entrant within a thread."""
+        with self._thread_lock:
+            if self._lock_depth == 0:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield self
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @asynccontextmanager
+    async def startup_lock(self, poll_seconds: float = 0.05):
+        """Serialises worker startup across processes from the event loop: the flock is
+        tried with LOCK_NB and retried after asyncio.sleep, so a waiting worker keeps serving."""
+        fd = os.open(os.path.join(self.directory, "startup"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(poll_seconds)
+            yield self
+        finally:
+            os.close(fd)  # releases the lock
+
+    def _members(self) -> int:
+        if self._members_fd is None:
+            self._members_fd = os.open(os.path.join(self.directory, "members"), os.O_RDWR | os.O_CREAT, 0o644)
+        return self._members_fd
+
+    def is_live(self) -> bool:
+        """True when a running worker serves the published gallery (holds `members` shared).
+        A gallery left behind by a stopped service has no members, since the kernel drops
+        a dead process's flocks. Call under startup_lock()."""
+        try:
+            fcntl.flock(self._members(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(self._members(), fcntl.LOCK_UN)
+        return False
+
+    def join(self):
+        """Mark this worker as serving the gallery until it exits. Call under startup_lock()."""
+        fcntl.flock(self._members(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+
+    def _path(self, generation: int, suffix: str) -> str:
+        return os.path.join(self.directory, f"gallery-{generation}{suffix}")
+
+    # ---------- read / write ----------
+
+    def load(self, generation: Optional[int] = None) -> Optional[SharedGalleryState]:
+        """Map the base of a generation (the latest by default). Returns None if nothing was published yet.
+        The matrix files are mapped writable: rows past the used ones are filled in place under write_lock().
+        """
+        generation = self.generation() if generation is None else generation
+        if generation <= 0:
+            return None
+        with open(self._path(generation, ".json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        embeddings = np.load(self._path(generation, ".npy"), mmap_mode="r+")
+
+        compact = None
+        if meta.get("precision"):
+            scales = np.load(self._path(generation, ".qs.npy"), mmap_mode="r+") if meta["precision"] == "int8" else None
+            compact = CompactGallery(meta["precision"], np.load(self._path(generation, ".q.npy"), mmap_mode="r+"), scales)
+
+        centroids = labels = None
+        if meta.get("ivf"):
+            with np.load(self._path(generation, ".ivf.npz")) as ivf:
+                centroids, labels = ivf["centroids"], ivf["labels"]
+
+        owners = np.load(self._path(generation, ".own.npy")) if meta.get("owners") else None
+
+        return SharedGalleryState(generation, meta["names"], meta["ids"], meta["member_codes"],
+                                  embeddings, meta["rows"], centroids, labels,
+                                  meta.get("trained_size", 0), compact, owners)
+
+    def read_log(self, generation: int, start: int, end: int) -> List[dict]:
+        """The records a generation's log gained between byte offsets start and end."""
+        with open(self._path(generation, ".log"), "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return [json.loads(line) for line in data.splitlines()]
+
+    def _save_rows(self, generation: int, suffix: str, data: np.ndarray, capacity: int):
+        """Write `data` as the first rows of a new .npy file sized for `capacity` rows."""
+        tmp = self._path(generation, ".tmp" + suffix)
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=data.dtype, shape=(capacity,) + data.shape[1:])
+        out[:len(data)] = data
+        out.flush()
+        del out
+        os.replace(tmp, self._path(generation, suffix))
+
+    def publish(self, names: List[str], embeddings: np.ndarray, ids: List[str], member_codes: List[str],
+                centroids: Optional[np.ndarray] = None, labels: Optional[np.ndarray] = None,
+                trained_size: int = 0, compact: Optional[CompactGallery] = None, owners: Optional[np.ndarray] = None,
+                capacity: int = 0) -> int:
+        """Write a complete new generation with room for `capacity` rows and make it current.
+        Call with write_lock() held. `owners` maps template rows to employees when
+        embeddings has more rows than ids."""
+        generation = self.generation() + 1
+        dim = embeddings.shape[1] if embeddings.ndim == 2 else 512
+        rows = len(embeddings)
+        capacity = max(capacity, rows, 16)
+        if owners is not None and rows == len(ids) and np.array_equal(owners, np.arange(rows)):
+            owners = None  # one row per employee: the plain layout
+
+        self._save_rows(generation, ".npy", np.ascontiguousarray(embeddings, dtype=np.float32).reshape(rows, dim),
+                        capacity)
+        if compact is not None:
+            self._save_rows(generation, ".q.npy", compact.matrix, capacity)
+            if compact.scales is not None:
+                self._save_rows(generation, ".qs.npy", compact.scales, capacity)
+        if owners is not None:
+            tmp = self._path(generation, ".tmp.own.npy")
+            np.save(tmp, np.asarray(owners, dtype=np.int32))
+            os.replace(tmp, self._path(generation, ".own.npy"))
+        if centroids is not None and labels is not None:
+            tmp = self._path(generation, ".tmp.ivf.npz")
+            np.savez(tmp, centroids=centroids, labels=labels)
+            os.replace(tmp, self._path(generation, ".ivf.npz"))
+
+        meta = {
+            "generation": generation,
+            "count": len(ids),
+            "rows": rows,
+            "capacity": capacity,
+            "owners": owners is not None,
+            "dim": dim,
+            "ids": list(ids),
+            "names": list(names),
+            "member_codes": list(member_codes),
+            "ivf": centroids is not None and labels is not None,
+            "trained_size": trained_size,
+            "precision": compact.precision if compact is not None else None,
+        }
+        tmp = self._path(generation, ".tmp.json")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(generation, ".json"))
+        open(self._path(generation, ".log"), "wb").close()
+
+        self._set_head(generation, 0)
+        self._prune(generation)
+        logging.info("Shared gallery generation %d published (%d members, room for %d rows)",
+                     generation, len(ids), capacity)
+        return generation
+
+    def append(self, generation: int, records: List[dict]) -> int:
+        """Append mutation records to the current generation's log and commit them.
+        Call with write_lock() held, after writing the rows they refer to. Returns the new log length."""
+        with open(self._path(generation, ".log"), "ab") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+            log_end = f.tell()
+        self._set_head(generation, log_end)
+        return log_end
+
+    def _prune(self, current: int):
+        # readers still mapping an old generation keep it alive after unlink
+        for name in os.listdir(self.directory):
+            if not name.startswith("gallery-"):
+                continue
+            try:
+                generation = int(name[len("gallery-"):].split(".", 1)[0])
+            except ValueError:
+                continue
+            if generation <= current - self.KEEP_GENERATIONS:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
@@ -0,0 +1,126 @@
+# app/streaming.py
+
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from .ai_processing import (
+    DetectionFrame,
+    decode_for_detection,
+    decode_full,
+    detect_faces_with_fallback,
+    match_embeddings,
+    prepare_detected_faces,
+    remap_faces,
+)
+from .batching import embed_faces
+from .cache import embedding_cache
+from .config import settings
+from .result_cache import recognition_cache
+from .tracking import FaceTracker
+
+
+class StreamSession:
+    """Per-connection state of /recognize/stream.
+
+    Every frame is detected (on a reduced decode), but only faces whose track
+    needs it (see FaceTracker) are aligned and embedded - and only then is the
+    frame decoded at full resolution; the others report their track's voted
+    identity. `on_confirmed(face)` is awaited once per track, the first
+    time its identity has STREAM_MIN_VOTES votes.
+    """
+
+    def __init__(self, on_confirmed: Optional[Callable[[dict], Awaitable[None]]] = None):
+        self.tracker = FaceTracker(
+            iou_threshold=settings.STREAM_IOU_THRESHOLD,
+            max_missed=settings.STREAM_MAX_MISSED_FRAMES,
+            refresh_seconds=settings.STREAM_REFRESH_SECONDS,
+            quality_gain=settings.STREAM_QUALITY_GAIN,
+            vote_window=settings.STREAM_VOTE_WINDOW,
+        )
+        self.on_confirmed = on_confirmed
+        self.frames = 0
+        self.faces_embedded = 0
+        self.faces_reused = 0
+
+    @staticmethod
+    def _detect(data: bytes) -> Tuple[Optional[List[dict]], Optional[DetectionFrame]]:
+        frame = decode_for_detection(data)
+        if frame is None:
+            return None, None
+        faces = detect_faces_with_fallback(frame.image, max(frame.scale_x, frame.scale_y))
+        return remap_faces(faces, frame.scale_x, frame.scale_y), frame
+
+    @staticmethod
+    def _prepare(data: bytes, frame: DetectionFrame, faces: List[dict]):
+        full = decode_full(data, frame)
+        if full is None:
+            return [], None
+        return prepare_detected_faces(full, faces)
+
+    async def process_frame(self, data: bytes) -> Optional[List[dict]]:
+        """Track and recognize one encoded frame (None if it cannot be decoded).
+        Returns list of dicts with: track_id, name, member_code, employee_id, box, score, votes, embedded
+        """
+        self.frames += 1
+        now = time.monotonic()
+        faces, frame = await run_in_threadpool(self._detect, data)
+        if faces is None:
+            return None
+        assignments = self.tracker.update(faces, now)
+
+        stale = [track for track, needs in assignments if needs]
+        embedded_ids = set()
+        cache_data = embedding_cache.snapshot()
+        if stale and cache_data.ids:
+            kept, batch = await run_in_threadpool(self._prepare, data, frame, [t.face for t in stale])
+            if batch is not None:
+                embs = await recognition_cache.embed(batch, cache_data.version, embed_faces)
+                track_of = {id(t.face): t for t in stale}
+                pairs = [(track_of[id(face)], emb) for face, emb in zip(kept, embs) if emb is not None]
+                if pairs:
+                    matches = await run_in_threadpool(
+                        match_embeddings, np.stack([emb for _, emb in pairs], axis=0), cache_data, cache_data.index
+                    )
+                    for (track, _), match in zip(pairs, matches):
+                        self.tracker.mark_embedded(track, match, now)
+                        embedded_ids.add(track.track_id)
+
+        self.faces_embedded += len(embedded_ids)
+        self.faces_reused += len(assignments) - len(embedded_ids)
+
+        results = []
+        for track, _ in assignments:
+            best, votes = track.identity()
+            result = {
+                "track_id": track.track_id,
+                "name": best["name"] if best else "Unknown",
+                "member_code": best["member_code"] if best else None,
+                "employee_id": best["employee_id"] if best else None,
+                "box": [int(x) for x in track.box],
+                "score": best["score"] if best else 0.0,
+                "votes": votes,
+                "embedded": track.track_id in embedded_ids,
+            }
+            results.append(result)
+
+            if (not track.logged and result["employee_id"] is not None
+                    and votes >= settings.STREAM_MIN_VOTES):
+                track.logged = True
+                if self.on_confirmed is not None:
+                    try:
+                        await self.on_confirmed(result)
+                    except Exception:
+                        logging.exception("Failed to log streamed recognition")
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "faces_embedded": self.faces_embedded,
+            "faces_reused": self.faces_reused,
+            "tracks": len(self.tracker.tracks),
+        }
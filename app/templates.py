@@ -0,0 +1,118 @@
+# app/templates.py
+
+"""Several embeddings ("templates") per employee.
+
+A gallery with templates is one contiguous (T,512) matrix plus an owner array
+mapping every row to its employee. Scoring stays a single matmul over the T
+rows; an employee's score is the best of their rows, taken for all employees at
+once with one vectorised gather/maximum per template rank, so the cost grows
+with the number of templates and not with a Python loop over employees.
+
+In the database an employee's templates are stored back to back in
+Employee.embedding (k*512 float32), so an existing single-embedding row is
+simply an employee with one template.
+"""
+
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+
+TEMPLATE_PRUNING_POLICIES = ("redundant", "oldest")
+DEAD_RANK = 255  # template rank of a row that belongs to nobody any more
+MAX_TEMPLATES = DEAD_RANK  # ranks are stored as uint8
+
+
+def as_templates(embedding: np.ndarray, dim: int = 512) -> np.ndarray:
+    """A (512,) embedding or (k,512) template set as a (k,512) float32 array."""
+    return np.asarray(embedding, dtype=np.float32).reshape(-1, dim)
+
+
+def templates_from_blob(blob: bytes, dim: int = 512) -> np.ndarray:
+    """Decode an Employee.embedding blob into its (k,512) templates (k=0 for an invalid blob)."""
+    if not blob or len(blob) % (dim * 4):
+        return np.empty((0, dim), dtype=np.float32)
+    return np.frombuffer(blob, dtype=np.float32).reshape(-1, dim)
+
+
+def prune_templates(templates: np.ndarray, max_templates: Optional[int] = None,
+                    policy: Optional[str] = None) -> np.ndarray:
+    """At most max_templates rows (default GALLERY_MAX_TEMPLATES), kept in their order (oldest first).
+    "oldest" drops the oldest rows. "redundant" repeatedly drops the older of the two most
+    similar templates, so the set keeps covering different poses and lighting while
+    near-duplicate photos collapse into one.
+    """
+    max_templates = min(max(1, settings.GALLERY_MAX_TEMPLATES if max_templates is None else max_templates), MAX_TEMPLATES)
+    policy = (policy or settings.GALLERY_TEMPLATE_PRUNING).lower()
+    if policy not in TEMPLATE_PRUNING_POLICIES:
+        raise ValueError(f"Unknown GALLERY_TEMPLATE_PRUNING '{policy}'. Choose one of: {', '.join(TEMPLATE_PRUNING_POLICIES)}")
+    if len(templates) <= max_templates:
+        return templates
+    if policy == "oldest":
+        return templates[-max_templates:]
+
+    sims = templates @ templates.T
+    np.fill_diagonal(sims, -np.inf)
+    kept = list(range(len(templates)))
+    while len(kept) > max_templates:
+        nearest = sims[np.ix_(kept, kept)].max(axis=1)
+        del kept[int(np.argmax(nearest))]  # first index of the closest pair = the older one
+    return templates[kept]
+
+
+def merge_templates(existing: np.ndarray, new: np.ndarray, max_templates: Optional[int] = None,
+                    policy: Optional[str] = None) -> np.ndarray:
+    """An employee's stored templates plus those of a new upload, pruned to the cap."""
+    return prune_templates(np.concatenate([as_templates(existing), as_templates(new)], axis=0),
+                           max_templates, policy)
+
+
+class TemplateOwners(NamedTuple):
+    """Which employee every gallery row belongs to, split into passes for the max-reduction.
+
+    Row r is template number ranks[r] of employee owners[r]. Pass j gathers the
+    j-th template of every employee that has one, so within a pass each employee
+    appears at most once and taking the maximum is a plain gather and scatter;
+    pass 0 covers every employee. Building the passes needs no sort by employee,
+    only a radix sort of the uint8 ranks. Dead rows (rank DEAD_RANK, owner -1)
+    are in no pass.
+    """
+    owners: np.ndarray  # (T,) employee of every row, -1 for a dead row
+    passes: Tuple[Tuple[np.ndarray, np.ndarray], ...]  # (rows, employees) per template rank
+    n_owners: int
+    dead: Optional[np.ndarray]  # rows that belong to nobody, excluded from every result
+
+    @classmethod
+    def build(cls, owners: np.ndarray, ranks: np.ndarray, n_owners: int) -> Optional["TemplateOwners"]:
+        """Pass layout of a gallery; the arrays are copied. None for a plain gallery
+        (row i is employee i's only template), which is then scored exactly as before."""
+        if len(owners) == n_owners and np.array_equal(owners, np.arange(n_owners)):
+            return None
+        owners = np.array(owners, dtype=np.int32)
+        ranks = np.asarray(ranks, dtype=np.uint8)
+        order = np.argsort(ranks, kind="stable")  # radix sort for uint8 keys
+        counts = np.bincount(ranks, minlength=DEAD_RANK + 1)
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+
+        passes = []
+        for rank in np.flatnonzero(counts[:DEAD_RANK]).tolist():
+            rows = order[bounds[rank]:bounds[rank + 1]]
+            passes.append((rows, owners[rows]))
+        dead = order[bounds[DEAD_RANK]:]
+        owners.flags.writeable = False
+        return cls(owners, tuple(passes), n_owners, dead if dead.size else None)
+
+    def max_per_owner(self, sims: np.ndarray) -> np.ndarray:
+        """(F,T) row scores -> (F,E) best score of each employee."""
+        best = np.empty((sims.shape[0], self.n_owners), dtype=sims.dtype)
+        for i, (rows, employees) in enumerate(self.passes):
+            if i == 0:
+                best[:, employees] = sims[:, rows]
+            else:
+                best[:, employees] = np.maximum(best[:, employees], sims[:, rows])
+        return best
+
+    def owner_of(self, rows: np.ndarray) -> np.ndarray:
+        """Employee of each row index (-1, for "no candidate" or a dead row, stays -1)."""
+        return np.where(rows >= 0, self.owners[np.maximum(rows, 0)], -1)
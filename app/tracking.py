@@ -0,0 +1,151 @@
+# app/tracking.py
+
+import itertools
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def box_iou(a: List[int], b: List[int]) -> float:
+    """IoU of two [x, y, w, h] boxes."""
+    ax2, ay2 = a[0] + a[2], a[1] + a[3]
+    bx2, by2 = b[0] + b[2], b[1] + b[3]
+    iw = min(ax2, bx2) - max(a[0], b[0])
+    ih = min(ay2, by2) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / float(a[2] * a[3] + b[2] * b[3] - inter)
+
+
+def face_quality(face: dict) -> float:
+    """Cheap per-detection quality: box area weighted by detector confidence."""
+    _, _, w, h = face["box"]
+    confidence = face.get("confidence")
+    return float(w * h) * (float(confidence) if confidence is not None else 1.0)
+
+
+class Track:
+    """One face followed across the frames of a stream."""
+
+    def __init__(self, track_id: int, face: dict, vote_window: int):
+        self.track_id = track_id
+        self.face = face
+        self.box = face["box"]
+        self.hits = 1
+        self.missed = 0
+        self.embedded_at: Optional[float] = None
+        self.embedded_quality = 0.0
+        self.logged = False
+        self._votes: Deque[Tuple[Optional[str], dict]] = deque(maxlen=vote_window)
+
+    def add_vote(self, match: dict):
+        """Record one embedding's match (name, member_code, employee_id, score)."""
+        self._votes.append((match.get("employee_id"), match))
+
+    @property
+    def votes(self) -> int:
+        return len(self._votes)
+
+    def identity(self) -> Tuple[Optional[dict], int]:
+        """Majority identity over the vote window (ties go to the higher total score).
+        Returns (best match of that identity, number of votes for it); (None, 0) without votes.
+        """
+        if not self._votes:
+            return None, 0
+        tally: Dict[Optional[str], List[dict]] = {}
+        for key, match in self._votes:
+            tally.setdefault(key, []).append(match)
+        key, matches = max(tally.items(), key=lambda kv: (len(kv[1]), sum(m["score"] for m in kv[1])))
+        best = max(matches, key=lambda m: m["score"])
+        return best, len(matches)
+
+
+class FaceTracker:
+    """Greedy IoU tracker with a centroid-distance fallback, for one video stream.
+
+    `update()` matches the detections of a frame to live tracks and says which
+    faces need a fresh embedding: new tracks, tracks whose face quality clearly
+    improved since they were last embedded, and tracks whose embedding is older
+    than `refresh_seconds`. Everything else reuses the track's voted identity.
+    Tracks not matched for more than `max_missed` frames are dropped.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_missed: int = 5, refresh_seconds: float = 2.0,
+                 quality_gain: float = 1.25, vote_window: int = 5):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.refresh_seconds = refresh_seconds
+        self.quality_gain = quality_gain
+        self.vote_window = vote_window
+        self.tracks: Dict[int, Track] = {}
+        self._ids = itertools.count(1)
+
+    def _match(self, faces: List[dict]) -> Dict[int, int]:
+        """detection index -> track id"""
+        tracks = list(self.tracks.values())
+        if not tracks or not faces:
+            return {}
+
+        pairs = []
+        for d, face in enumerate(faces):
+            for t in tracks:
+                iou = box_iou(face["box"], t.box)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, d, t.track_id))
+                else:
+                    # fast movement: accept a centroid within half the track's box size
+                    fx, fy, fw, fh = face["box"]
+                    tx, ty, tw, th = t.box
+                    dist = np.hypot((fx + fw / 2) - (tx + tw / 2), (fy + fh / 2) - (ty + th / 2))
+                    limit = 0.5 * max(tw, th)
+                    if dist < limit:
+                        # rank below every IoU match
+                        pairs.append((-dist / limit, d, t.track_id))
+
+        assigned: Dict[int, int] = {}
+        used_tracks = set()
+        for _, d, track_id in sorted(pairs, reverse=True):
+            if d in assigned or track_id in used_tracks:
+                continue
+            assigned[d] = track_id
+            used_tracks.add(track_id)
+        return assigned
+
+    def update(self, faces: List[dict], now: float) -> List[Tuple[Track, bool]]:
+        """Advance the tracker by one frame. Returns (track, needs_embedding) per detection, in order."""
+        assigned = self._match(faces)
+        seen = set(assigned.values())
+        for track_id in list(self.tracks):
+            if track_id not in seen:
+                track = self.tracks[track_id]
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    del self.tracks[track_id]
+
+        out = []
+        for d, face in enumerate(faces):
+            track_id = assigned.get(d)
+            if track_id is None:
+                track = Track(next(self._ids), face, self.vote_window)
+                self.tracks[track.track_id] = track
+            else:
+                track = self.tracks[track_id]
+                track.face, track.box = face, face["box"]
+                track.hits += 1
+                track.missed = 0
+            out.append((track, self.needs_embedding(track, now)))
+        return out
+
+    def needs_embedding(self, track: Track, now: float) -> bool:
+        if track.embedded_at is None:
+            return True
+        if now - track.embedded_at >= self.refresh_seconds:
+            return True
+        return face_quality(track.face) > track.embedded_quality * self.quality_gain
+
+    def mark_embedded(self, track: Track, match: dict, now: float):
+        track.embedded_at = now
+        track.embedded_quality = face_quality(track.face)
+        track.add_vote(match)
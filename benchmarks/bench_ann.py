@@ -0,0 +1,52 @@
+# benchmarks/bench_ann.py
+"""Recall / latency of the IVF gallery index against exact search.
+
+Usage: python -m benchmarks.bench_ann --n 100000 --queries 200 --nprobe 1 4 8 16
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.ann import IVFIndex, evaluate_recall
+
+
+def synthetic_gallery(n: int, dim: int = 512, clusters: int = 256, seed: int = 0):
+    """Clustered unit vectors (faces of one person are close, people spread out),
+    plus noisy re-captures of random members to use as queries."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    gallery = centers[rng.integers(0, clusters, n)] + 0.8 * rng.standard_normal((n, dim)).astype(np.float32)
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    return gallery, rng
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--k", type=int, default=1)
+    args = parser.parse_args()
+
+    gallery, rng = synthetic_gallery(args.n)
+    members = rng.integers(0, args.n, args.queries)
+    noise = rng.standard_normal((args.queries, gallery.shape[1])).astype(np.float32)
+    queries = gallery[members] + 0.5 * noise / np.sqrt(gallery.shape[1])
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    index = IVFIndex(nlist=args.nlist or None)
+    started = time.perf_counter()
+    index.build(gallery)
+    print(f"build: {(time.perf_counter() - started):.2f}s, {index.centroids.shape[0]} lists")
+
+    print(f"{'nprobe':>7} {'recall@k':>9} {'exact ms/q':>11} {'ann ms/q':>9}")
+    for nprobe in args.nprobe:
+        r = evaluate_recall(index, gallery, queries, k=args.k, nprobe=nprobe)
+        print(f"{nprobe:>7} {r['recall']:>9.4f} {r['exact_ms_per_query']:>11.3f} {r['ann_ms_per_query']:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# benchmarks/bench_cache_concurrency.py
+"""Mixed read/write stress test for EmbeddingCache snapshots.
+
+Reader threads take snapshots and check that names, ids and rows line up
+(every row is stamped with its owner's id); writer threads add, update and
+remove employees, optionally in coalesced batches. Reports throughput,
+publish count and the number of inconsistent snapshots (must be 0).
+
+Usage: python -m benchmarks.bench_cache_concurrency --n 20000 --readers 4 --writers 2 --seconds 5
+"""
+
+import argparse
+import contextlib
+import threading
+import time
+
+import numpy as np
+
+from app.cache import EmbeddingCache
+
+DIM = 512
+
+
+def stamped(emp_id: int) -> np.ndarray:
+    """A unit vector whose first component encodes the owner id (checked by readers)."""
+    v = np.zeros(DIM, dtype=np.float32)
+    v[0] = float(emp_id)
+    v[1] = 1.0
+    return v
+
+
+def check(snapshot) -> bool:
+    emb = snapshot.embeddings
+    owners = snapshot.owners
+    if not (len(snapshot.names) == len(snapshot.ids) == len(snapshot.member_codes)):
+        return False
+    if (owners.owners.shape[0] if owners is not None else len(snapshot.ids)) != emb.shape[0]:
+        return False
+    if emb.shape[0] == 0:
+        return True
+    rows = np.random.randint(0, emb.shape[0], size=min(32, emb.shape[0]))
+    slots = owners.owner_of(rows) if owners is not None else rows
+    return all(int(emb[r, 0]) == int(snapshot.ids[s]) and snapshot.names[s] == f"name-{snapshot.ids[s]}"
+               for r, s in zip(rows.tolist(), slots.tolist()) if s >= 0)  # dead rows belong to nobody
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--batch", type=int, default=1, help="mutations per coalesced batch")
+    parser.add_argument("--publish-delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(dim=DIM, publish_delay_ms=args.publish_delay_ms)
+    ids = [str(i) for i in range(args.n)]
+    cache.update([f"name-{i}" for i in ids], np.stack([stamped(int(i)) for i in ids]), ids, ids)
+
+    stop = threading.Event()
+    counters = {"reads": 0, "bad": 0, "writes": 0, "matmuls": 0}
+    lock = threading.Lock()
+
+    def reader():
+        reads = bad = 0
+        query = stamped(0)
+        while not stop.is_set():
+            snap = cache.snapshot()
+            if not check(snap):
+                bad += 1
+            snap.embeddings @ query  # the hot-path product runs on the snapshot
+            reads += 1
+        with lock:
+            counters["reads"] += reads
+            counters["bad"] += bad
+
+    def writer(seed: int):
+        rng = np.random.default_rng(seed)
+        next_id = args.n * (seed + 2)
+        writes = 0
+        while not stop.is_set():
+            with cache.batch() if args.batch > 1 else contextlib.nullcontext():
+                for _ in range(args.batch):
+                    op = rng.random()
+                    if op < 0.45:
+                        emp = str(next_id)
+                        next_id += 1
+                    elif op < 0.8:
+                        emp = str(int(rng.integers(0, args.n)))
+                    else:
+                        cache.remove_employee(str(int(rng.integers(0, args.n))))
+                        writes += 1
+                        continue
+                    cache.update_or_add_employee(emp, f"name-{emp}", emp, stamped(int(emp)))
+                    writes += 1
+        with lock:
+            counters["writes"] += writes
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(s,)) for s in range(args.writers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"gallery size: {len(cache.snapshot().ids)} (version {cache.version}, {cache.publish_count} publishes)")
+    print(f"reads:  {counters['reads'] / elapsed:,.0f}/s")
+    print(f"writes: {counters['writes'] / elapsed:,.0f}/s")
+    print(f"inconsistent snapshots: {counters['bad']}")
+
+
+if __name__ == "__main__":
+    main()
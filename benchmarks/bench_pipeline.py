@@ -0,0 +1,347 @@
+# benchmarks/bench_pipeline.py
+"""Offline benchmark suite for the recognition pipeline and the embedding cache.
+
+Runs without a GPU, network or database. A small stand-in ONNX embedding
+model (same input/output contract as glintr100: (N,3,112,112) -> (N,512)) and
+synthetic face images are generated into a temp directory, so results depend
+only on the code and the machine. Measured:
+
+  end_to_end.*   detect_and_recognize_faces on decoded images, and the
+                 /recognize path from JPEG bytes (prepare, embed, match)
+  stage.*        decode, detect, align (keypoints) / crop, quality gates,
+                 preprocess, embed at batch 1/8/32, match
+  cache.<N>.*    EmbeddingCache load, add, remove and search (batch 1 and 8)
+                 (cache.<N>x<T>.* with --templates T per employee)
+                 at each gallery size N (default 1k, 10k, 100k, 1M; 1M needs
+                 about 6 GB of RAM)
+
+Every result is a latency summary in ms (n, mean, p50, p95, min) written to a
+JSON file together with the library versions and relevant settings. Compare two
+runs with --compare; it exits non-zero when a p50 regressed beyond --tolerance.
+
+Usage: python -m benchmarks.bench_pipeline --out bench.json [--sizes 1000 10000] [--model path.onnx]
+       python -m benchmarks.bench_pipeline --compare base.json bench.json --tolerance 0.15
+
+The app is configured through environment variables set here before it is
+imported (Haar detector without fallback, no optimized-model cache, uploads in
+the temp directory); --model benchmarks a real ArcFace model instead.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+DIM = 512
+
+
+# ----------------- Fixtures -----------------
+
+def build_standin_model(path: str, seed: int = 0):
+    """Conv(stride 8) -> ReLU -> flatten -> MatMul to 512: ArcFace's I/O contract at a
+    fraction of its cost. Needs the `onnx` package (pip install onnx)."""
+    try:
+        import onnx
+        from onnx import TensorProto, helper, numpy_helper
+    except ImportError:
+        raise SystemExit("The stand-in model needs the 'onnx' package (pip install onnx), or pass --model")
+    rng = np.random.default_rng(seed)
+    weights = numpy_helper.from_array(rng.standard_normal((32, 3, 8, 8)).astype(np.float32) * 0.05, "W")
+    projection = numpy_helper.from_array(rng.standard_normal((32 * 14 * 14, DIM)).astype(np.float32) * 0.02, "P")
+    shape = numpy_helper.from_array(np.array([0, -1], dtype=np.int64), "shape")
+    nodes = [
+        helper.make_node("Conv", ["input", "W"], ["conv"], strides=[8, 8]),
+        helper.make_node("Relu", ["conv"], ["relu"]),
+        helper.make_node("Reshape", ["relu", "shape"], ["flat"]),
+        helper.make_node("MatMul", ["flat", "P"], ["embedding"]),
+    ]
+    graph = helper.make_graph(
+        nodes, "standin_arcface",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["N", 3, 112, 112])],
+        [helper.make_tensor_value_info("embedding", TensorProto.FLOAT, ["N", DIM])],
+        [weights, projection, shape],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def synthetic_face(seed: int, size: int = 640) -> Tuple[np.ndarray, dict]:
+    """A drawn frontal face on a noisy background (the Haar cascade finds these reliably),
+    plus its five keypoints in the detector's format."""
+    rng = np.random.default_rng(seed)
+    img = cv2.add(np.full((size, size, 3), 90, np.uint8), (rng.random((size, size, 3)) * 40).astype(np.uint8))
+    cx, cy = size // 2 + int(rng.integers(-40, 40)), size // 2 + int(rng.integers(-40, 40))
+    r = int(size * 0.22)
+    skin = tuple(int(v) for v in rng.integers(140, 220, 3))
+    cv2.ellipse(img, (cx, cy), (int(r * 0.8), r), 0, 0, 360, skin, -1)
+    ex, ey = int(r * 0.35), cy - int(r * 0.2)
+    for side in (-1, 1):
+        cv2.ellipse(img, (cx + side * ex, ey), (int(r * 0.17), int(r * 0.08)), 0, 0, 360, (255, 255, 255), -1)
+        cv2.circle(img, (cx + side * ex, ey), int(r * 0.06), (30, 30, 30), -1)
+        cv2.line(img, (cx + side * ex - int(r * 0.18), ey - int(r * 0.18)),
+                 (cx + side * ex + int(r * 0.18), ey - int(r * 0.2)), (40, 40, 40), int(r * 0.05))
+    nose = (cx - int(r * 0.05), cy + int(r * 0.25))
+    cv2.line(img, (cx, ey + int(r * 0.1)), nose, tuple(max(0, v - 60) for v in skin), 3)
+    mouth_y = cy + int(r * 0.5)
+    cv2.ellipse(img, (cx, mouth_y), (int(r * 0.3), int(r * 0.1)), 0, 0, 180, (40, 40, 120), int(r * 0.05))
+    keypoints = {
+        "left_eye": (cx - ex, ey), "right_eye": (cx + ex, ey), "nose": nose,
+        "mouth_left": (cx - int(r * 0.3), mouth_y + int(r * 0.05)),
+        "mouth_right": (cx + int(r * 0.3), mouth_y + int(r * 0.05)),
+    }
+    img = cv2.GaussianBlur(img, (0, 0), 1.0)
+    # sensor-like grain after the blur, so the faces clear the sharpness gate like real photos
+    grain = rng.normal(0.0, 6.0, img.shape)
+    return np.clip(img + grain, 0, 255).astype(np.uint8), keypoints
+
+
+def synthetic_gallery(n: int, seed: int = 0) -> np.ndarray:
+    """n unit vectors, generated in chunks so 1M rows do not need a float64 temporary."""
+    rng = np.random.default_rng(seed)
+    out = np.empty((n, DIM), dtype=np.float32)
+    for start in range(0, n, 65536):
+        block = rng.standard_normal((min(65536, n - start), DIM), dtype=np.float32)
+        out[start:start + len(block)] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return out
+
+
+# ----------------- Measurement -----------------
+
+def summarize(samples_ms: List[float]) -> dict:
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "n": int(arr.size),
+        "mean_ms": round(float(arr.mean()), 4),
+        "p50_ms": round(float(np.percentile(arr, 50)), 4),
+        "p95_ms": round(float(np.percentile(arr, 95)), 4),
+        "min_ms": round(float(arr.min()), 4),
+    }
+
+
+def measure(fn: Callable[[int], object], repeats: int, warmup: int = 2) -> dict:
+    """Time fn(i) for i in range(repeats) after `warmup` untimed calls."""
+    for i in range(warmup):
+        fn(i)
+    samples = []
+    for i in range(repeats):
+        started = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return summarize(samples)
+
+
+def report(results: Dict[str, dict], name: str, summary: dict):
+    results[name] = summary
+    print(f"{name:<34} p50 {summary['p50_ms']:>10.3f} ms   p95 {summary['p95_ms']:>10.3f} ms   n={summary['n']}")
+
+
+# ----------------- Suites -----------------
+
+def bench_pipeline(results: Dict[str, dict], images: List[np.ndarray], keypoints: List[dict],
+                   gallery_size: int, repeats: int):
+    from app import ai_processing as ap
+    from app.cache import EmbeddingCache
+
+    cache = EmbeddingCache(dim=DIM, publish_delay_ms=0)
+    ids = [str(i) for i in range(gallery_size)]
+    cache.update(ids, synthetic_gallery(gallery_size), ids, ids)
+    snapshot = cache.snapshot()
+    jpegs = [cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes() for img in images]
+    pick = lambda i: i % len(images)  # noqa: E731
+
+    detected = [ap.detect_faces_with_fallback(img) for img in images]
+    found = sum(1 for faces in detected if faces)
+    print(f"detector found faces in {found}/{len(images)} synthetic images")
+    if not found:
+        raise SystemExit("No face detected in the synthetic images; check DETECTOR_BACKEND")
+
+    # end to end
+    report(results, "end_to_end.detect_and_recognize",
+           measure(lambda i: ap.detect_and_recognize_faces(images[pick(i)], snapshot, snapshot.index), repeats))
+
+    def from_bytes(i):
+        prepared = ap.prepare_faces_from_bytes(jpegs[pick(i)])
+        if prepared and prepared[1] is not None:
+            ap.build_recognition_results(prepared[0], ap.run_embedding_model(prepared[1]), snapshot, snapshot.index)
+    report(results, "end_to_end.from_jpeg_bytes", measure(from_bytes, repeats))
+
+    # stages
+    report(results, "stage.decode", measure(lambda i: cv2.imdecode(np.frombuffer(jpegs[pick(i)], np.uint8),
+                                                                   cv2.IMREAD_COLOR), repeats))
+    report(results, "stage.decode_for_detection", measure(lambda i: ap.decode_for_detection(jpegs[pick(i)]), repeats))
+    report(results, "stage.detect", measure(lambda i: ap.detect_faces_with_fallback(images[pick(i)]), repeats))
+    report(results, "stage.align_keypoints",
+           measure(lambda i: ap.align_face_by_keypoints(images[pick(i)], keypoints[pick(i)]), repeats))
+    boxed = [(img, max(faces, key=lambda f: f["box"][2] * f["box"][3])["box"])
+             for img, faces in zip(images, detected) if faces]
+    crops = [ap.crop_face_from_box(img, box) for img, box in boxed]
+    report(results, "stage.crop", measure(lambda i: ap.crop_face_from_box(*boxed[i % len(boxed)]), repeats))
+    aligned = [ap.align_face_by_keypoints(img, kp) for img, kp in zip(images, keypoints)]
+    report(results, "stage.quality_gates", measure(lambda i: ap.passes_quality_gates(aligned[pick(i)]), repeats))
+    report(results, "stage.preprocess", measure(lambda i: ap.preprocess_faces([crops[i % len(crops)]]), repeats))
+    for batch_size in (1, 8, 32):
+        batch = ap.preprocess_faces([aligned[j % len(aligned)] for j in range(batch_size)])
+        report(results, f"stage.embed_b{batch_size}", measure(lambda i: ap.run_embedding_model(batch), repeats))
+    embs = ap.run_embedding_model(ap.preprocess_faces(aligned))
+    report(results, "stage.match_b1",
+           measure(lambda i: ap.match_embeddings(embs[pick(i):pick(i) + 1], snapshot, snapshot.index), repeats))
+
+
+def bench_cache(results: Dict[str, dict], sizes: List[int], ops: int, repeats: int, templates: int = 1, seed: int = 0):
+    from app.ai_processing import match_embeddings
+    from app.cache import EmbeddingCache
+
+    rng = np.random.default_rng(seed)
+    for n in sizes:
+        gallery = synthetic_gallery(n * templates, seed)
+        owners = np.repeat(np.arange(n, dtype=np.int32), templates) if templates > 1 else None
+        ids = [str(i) for i in range(n)]
+        prefix = f"cache.{n}" if templates == 1 else f"cache.{n}x{templates}"
+        cache = EmbeddingCache(dim=DIM, publish_delay_ms=0)
+        started = time.perf_counter()
+        cache.update(ids, gallery, ids, ids, owners)
+        load_ms = (time.perf_counter() - started) * 1000.0
+        report(results, f"{prefix}.load", summarize([load_ms]))
+
+        snapshot = cache.snapshot()
+        members = rng.integers(0, len(gallery), 64)
+        queries = gallery[members] + 0.3 * rng.standard_normal((64, DIM), dtype=np.float32) / np.sqrt(DIM)
+        queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+        report(results, f"{prefix}.search_b1",
+               measure(lambda i: match_embeddings(queries[i % 64:i % 64 + 1], snapshot, snapshot.index), repeats))
+        report(results, f"{prefix}.search_b8",
+               measure(lambda i: match_embeddings(queries[(i * 8) % 64:(i * 8) % 64 + 8], snapshot, snapshot.index),
+                       repeats))
+
+        new_rows = synthetic_gallery(ops * templates, seed + 1).reshape(ops, templates, DIM)
+        victims = [str(v) for v in rng.choice(n, size=min(ops, n), replace=False)]
+        add = measure(lambda i: cache.update_or_add_employee(f"new-{i}", f"new-{i}", "", new_rows[i]),
+                      ops, warmup=0)
+        remove = measure(lambda i: cache.remove_employee(victims[i]), len(victims), warmup=0)
+        report(results, f"{prefix}.add", add)
+        report(results, f"{prefix}.remove", remove)
+        del cache, snapshot, gallery, new_rows
+        gc.collect()
+
+
+# ----------------- Comparison -----------------
+
+def compare(base_path: str, new_path: str, tolerance: float) -> int:
+    with open(base_path) as f:
+        base = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    regressions = 0
+    print(f"{'benchmark':<34} {'base p50':>11} {'new p50':>11} {'change':>8}")
+    for name in sorted(set(base) & set(new)):
+        before, after = base[name]["p50_ms"], new[name]["p50_ms"]
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -tolerance:
+            flag = "  improved"
+        print(f"{name:<34} {before:>11.3f} {after:>11.3f} {change:>+8.1%}{flag}")
+    for name in sorted(set(base) ^ set(new)):
+        print(f"{name:<34} only in {'base' if name in base else 'new'}")
+    print(f"{regressions} regression(s) beyond {tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+# ----------------- Main -----------------
+
+def configure_environment(workdir: str, model: Optional[str], threads: int):
+    """Point the app's settings at local fixtures; must run before anything imports app.config."""
+    if "app.config" in sys.modules:
+        raise RuntimeError("app.config was imported before the benchmark configured the environment")
+    model_path = model or os.path.join(workdir, "standin_arcface.onnx")
+    if model is None:
+        build_standin_model(model_path)
+    os.environ.update({
+        "MODEL_PATH": model_path,
+        "DETECTOR_BACKEND": os.environ.get("DETECTOR_BACKEND", "haar"),
+        "DETECTOR_FALLBACK": os.environ.get("DETECTOR_FALLBACK", ""),
+        "ORT_OPTIMIZED_MODEL_DIR": "",
+        "ORT_INTRA_OP_THREADS": str(threads),
+        "MODEL_WARMUP_BATCH_SIZES": "1,8,32",
+        "SHARED_GALLERY_DIR": "",
+        "IMAGE_UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+        "DEBUG_SAVE_DIR": os.path.join(workdir, "debug_uploads"),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench_pipeline.json", help="JSON results file")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000],
+                        help="gallery sizes for the cache benchmarks")
+    parser.add_argument("--images", type=int, default=20, help="distinct synthetic face images")
+    parser.add_argument("--repeats", type=int, default=50, help="timed calls per benchmark")
+    parser.add_argument("--ops", type=int, default=200, help="adds / removes timed per gallery size")
+    parser.add_argument("--templates", type=int, default=1, help="templates per employee in the cache benchmarks")
+    parser.add_argument("--gallery", type=int, default=10000, help="gallery size for the pipeline benchmarks")
+    parser.add_argument("--threads", type=int, default=1, help="ORT intra-op threads (0 = ORT default)")
+    parser.add_argument("--model", default=None, help="real ONNX embedding model instead of the stand-in")
+    parser.add_argument("--skip-pipeline", action="store_true")
+    parser.add_argument("--skip-cache", action="store_true")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="diff two result files and exit")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed p50 slowdown for --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.tolerance))
+
+    with tempfile.TemporaryDirectory(prefix="bench-pipeline-") as workdir:
+        configure_environment(workdir, args.model, args.threads)
+        import onnxruntime as ort
+        from app import ai_processing
+        from app.config import settings
+
+        ai_processing.load_models()
+        results: Dict[str, dict] = {}
+        started = time.perf_counter()
+        if not args.skip_pipeline:
+            faces = [synthetic_face(seed) for seed in range(args.images)]
+            bench_pipeline(results, [img for img, _ in faces], [kp for _, kp in faces], args.gallery, args.repeats)
+        if not args.skip_cache:
+            bench_cache(results, args.sizes, args.ops, args.repeats, args.templates)
+
+        output = {
+            "meta": {
+                "created": datetime.now(timezone.utc).isoformat(),
+                "duration_s": round(time.perf_counter() - started, 1),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "numpy": np.__version__,
+                "opencv": cv2.__version__,
+                "onnxruntime": ort.__version__,
+                "model": args.model or "standin",
+                "args": {k: v for k, v in vars(args).items() if k not in ("compare", "tolerance")},
+                "settings": {key: getattr(settings, key) for key in (
+                    "DETECTOR_BACKEND", "DETECTOR_FALLBACK", "DETECTION_MAX_SIDE", "GALLERY_PRECISION",
+                    "GALLERY_RERANK_CANDIDATES", "GALLERY_MAX_TEMPLATES", "ANN_ENABLED", "ANN_MIN_SIZE", "ORT_INTRA_OP_THREADS",
+                    "ORT_GRAPH_OPTIMIZATION", "ORT_EXECUTION_MODE",
+                )},
+            },
+            "results": results,
+        }
+    with open(args.out, "w") as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    print(f"wrote {len(results)} results to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# benchmarks/bench_precision.py
+"""Memory / latency / accuracy of float16 and int8 galleries against float32.
+
+Reports, per precision: bytes scored per search, ms per query batch, top-1
+agreement with exact float32 search, and how many accept/reject decisions at
+the recognition threshold flip (including score drift after re-ranking).
+
+Usage: python -m benchmarks.bench_precision --n 200000 --queries 256 --rerank 8
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.ann import CompactGallery, compact_search, exact_search, quantize_rows
+from app.config import settings
+from benchmarks.bench_ann import synthetic_gallery
+
+
+def timed(fn, repeats: int):
+    fn()  # warm-up
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.perf_counter() - started) * 1000.0 / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=8, help="faces scored per search call")
+    parser.add_argument("--rerank", type=int, default=settings.GALLERY_RERANK_CANDIDATES)
+    parser.add_argument("--threshold", type=float, default=settings.RECOGNITION_THRESHOLD)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    gallery, rng = synthetic_gallery(args.n)
+    dim = gallery.shape[1]
+    # half re-captures of members (should match), half strangers (should not)
+    members = rng.integers(0, args.n, args.queries // 2)
+    noise = rng.standard_normal((len(members), dim)).astype(np.float32)
+    known = gallery[members] + 1.2 * noise / np.sqrt(dim)
+    strangers = rng.standard_normal((args.queries - len(members), dim)).astype(np.float32)
+    queries = np.concatenate([known, strangers])
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    batches = [queries[i:i + args.batch] for i in range(0, len(queries), args.batch)]
+
+    def run_exact():
+        return [exact_search(b, gallery, 1) for b in batches]
+
+    ref, ref_ms = timed(run_exact, args.repeats)
+    ref_idx = np.concatenate([r[0][:, 0] for r in ref])
+    ref_score = np.concatenate([r[1][:, 0] for r in ref])
+    ref_accept = ref_score >= args.threshold
+
+    print(f"{args.n} members, {len(queries)} queries in batches of {args.batch}, "
+          f"threshold {args.threshold}, rerank {args.rerank}")
+    print(f"{'precision':>9} {'MB scored':>10} {'ms/batch':>9} {'top1 agree':>11} "
+          f"{'flips':>6} {'max |dscore|':>13}")
+    print(f"{'float32':>9} {gallery.nbytes / 2**20:>10.1f} {ref_ms / len(batches):>9.3f} "
+          f"{1.0:>11.4f} {0:>6} {0.0:>13.2e}")
+
+    for precision in ("float16", "int8"):
+        matrix, scales = quantize_rows(gallery, precision)
+        compact = CompactGallery(precision, matrix, scales)
+
+        def run_compact():
+            return [compact_search(b, gallery, compact, k=1, rerank=args.rerank) for b in batches]
+
+        res, ms = timed(run_compact, args.repeats)
+        idx = np.concatenate([r[0][:, 0] for r in res])
+        score = np.concatenate([r[1][:, 0] for r in res])
+        flips = int(np.count_nonzero((score >= args.threshold) != ref_accept))
+        print(f"{precision:>9} {compact.nbytes / 2**20:>10.1f} {ms / len(batches):>9.3f} "
+              f"{np.mean(idx == ref_idx):>11.4f} {flips:>6} {np.abs(score - ref_score).max():>13.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,115 +1,289 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
 import pandas as pd
 import requests
-import time
-import os
-from typing import List, Tuple
+from requests.adapters import HTTPAdapter
 
 # --- ⚙️ Configuration ---
 # 1. The URL of your API endpoint for uploading
 API_URL = "https://facehrms.techvizor.in//upload"
 
 # 2. The path to the folder containing your images (e.g., "profile")
-IMAGE_FOLDER_PATH = "profile" 
+IMAGE_FOLDER_PATH = "profile"
 
 # 3. The name of your Excel or CSV file
-# IMPORTANT: Your file must have these exact column names: 
+# IMPORTANT: Your file must have these exact column names:
 # id, name, image, member_code, member_status
 DATA_FILE = "oliv-member-with-status.csv" # Change this to your filename
 
 # 4. The file extension of your images (e.g., ".jpg", ".png")
 ALLOWED_EXTENSIONS = [".jpg", ".JPG", ".png", ".PNG"] # Make sure this matches your image files
 
+# 5. Parallel uploads. Match it to the server (roughly its worker count).
+CONCURRENCY = 4
+
+# 6. Retries for network errors, timeouts, 429 and 5xx (exponential backoff with jitter)
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT = 60
+
+# 7. IDs uploaded successfully are appended here; a re-run skips them.
+CHECKPOINT_FILE = "upload_checkpoint.jsonl"
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
 # --- Script Logic ---
 
-def upload_all_employees():
+def build_image_index(folder: str) -> Dict[str, str]:
+    """One directory scan: file name without extension -> path (first allowed extension wins)."""
+    index = {}
+    rank = {ext: i for i, ext in enumerate(ALLOWED_EXTENSIONS)}
+    best = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stem, ext = os.path.splitext(entry.name)
+            if ext not in rank:
+                continue
+            if stem not in best or rank[ext] < best[stem]:
+                best[stem] = rank[ext]
+                index[stem] = entry.path
+    return index
+
+
+def load_checkpoint(path: str) -> set:
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue  # half-written last line of a crashed run
+    return done
+
+
+class Checkpoint:
+    """Append-only log of finished IDs, flushed per line so a crash loses at most one."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def mark(self, employee_id: str):
+        with self._lock:
+            self._file.write(json.dumps({"id": employee_id, "at": time.time()}) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def make_session(concurrency: int) -> requests.Session:
+    """Keep-alive session with one pooled connection per worker thread."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def upload_one(session: requests.Session, api_url: str, row: dict, image_path: str,
+               max_retries: int, timeout: float) -> Tuple[bool, str, float, int]:
+    """
+    Upload one member, retrying transient failures.
+    Returns (success, message, seconds of the last attempt, attempts made).
+    """
+    with open(image_path, "rb") as f:
+        image_content = f.read()
+    payload = {"id": row["id"], "name": row["name"], "member_code": row["member_code"]}
+    filename = os.path.basename(image_path)
+    content_type = "image/png" if filename.lower().endswith(".png") else "image/jpeg"
+
+    attempt = 0
+    while True:
+        attempt += 1
+        started = time.perf_counter()
+        try:
+            response = session.post(
+                api_url, data=payload,
+                files={"pictures": (filename, image_content, content_type)},
+                timeout=timeout
+            )
+            latency = time.perf_counter() - started
+            if response.status_code not in RETRY_STATUS_CODES:
+                if not response.ok:
+                    return False, f"HTTP {response.status_code}: {response.text[:200]}", latency, attempt
+                body = response.json()
+                return bool(body.get("FLAG")), body.get("MESSAGE", ""), latency, attempt
+            error = f"HTTP {response.status_code}"
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            latency = time.perf_counter() - started
+            error = f"{type(e).__name__}: {e}"
+
+        if attempt > max_retries:
+            return False, f"{error} (gave up after {attempt} attempts)", latency, attempt
+        time.sleep(BACKOFF_SECONDS * (2 ** (attempt - 1)) * (0.5 + random.random()))
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def upload_all_employees(api_url: str = API_URL, data_file: str = DATA_FILE,
+                         image_folder: str = IMAGE_FOLDER_PATH, concurrency: int = CONCURRENCY,
+                         checkpoint_file: str = CHECKPOINT_FILE, max_retries: int = MAX_RETRIES,
+                         timeout: float = REQUEST_TIMEOUT):
     """
     Reads a data file, filters for active members, and uploads their
-    corresponding images and data to the API.
+    corresponding images and data to the API, `concurrency` at a time.
+    Members recorded in the checkpoint file by an earlier run are skipped.
     """
-    if not os.path.exists(DATA_FILE):
-        print(f"❌ Error: The data file '{DATA_FILE}' was not found.")
+    if not os.path.exists(data_file):
+        print(f"❌ Error: The data file '{data_file}' was not found.")
         return
-    if not os.path.isdir(IMAGE_FOLDER_PATH):
-        print(f"❌ Error: The image folder '{IMAGE_FOLDER_PATH}' was not found.")
+    if not os.path.isdir(image_folder):
+        print(f"❌ Error: The image folder '{image_folder}' was not found.")
         return
 
     try:
         # Read the data file, ensuring all columns are treated as strings
-        if DATA_FILE.endswith('.xlsx'):
-            df = pd.read_excel(DATA_FILE, dtype=str)
-        elif DATA_FILE.endswith('.csv'):
-            df = pd.read_csv(DATA_FILE, dtype=str)
+        if data_file.endswith('.xlsx'):
+            df = pd.read_excel(data_file, dtype=str)
+        elif data_file.endswith('.csv'):
+            df = pd.read_csv(data_file, dtype=str)
         else:
             print(f"❌ Error: Unsupported file format. Please use .xlsx or .csv")
             return
-        print(f"✅ Successfully loaded {len(df)} total records from '{DATA_FILE}'.")
+        print(f"✅ Successfully loaded {len(df)} total records from '{data_file}'.")
     except Exception as e:
         print(f"❌ Error reading data file: {e}")
         return
 
     # Filter for only active members
-    active_df = df[df['member_status'].str.upper() == 'ACTIVE'].copy()
+    active_df = df[df['member_status'].str.upper() == 'ACTIVE']
     print(f"Found {len(active_df)} active members to process.")
 
-    for index, row in active_df.iterrows():
-        # --- Read data from the required columns ---
-        employee_id = str(row["id"])
-        name = str(row["name"])
-        member_code = str(row["member_code"])
-        image_filename_base = str(row["image"])
-        
-        print(f"\nProcessing {name} (ID: {employee_id}, Member: {member_code})")
-
-        # --- Construct the image path and read the file ---
-        image_filename = None
-        local_image_path = None
-        for ext in ALLOWED_EXTENSIONS:
-            potential_filename = image_filename_base + ext
-            potential_path = os.path.join(IMAGE_FOLDER_PATH, potential_filename)
-            if os.path.exists(potential_path):
-                image_filename = potential_filename
-                local_image_path = potential_path
-                break # Stop searching once the file is found
-
-        if not local_image_path:
-            print(f"  ❌ WARNING: Image for '{image_filename_base}' not found with any extension. Skipping {name}.")
+    image_index = build_image_index(image_folder)
+    print(f"Indexed {len(image_index)} images in '{image_folder}'.")
+
+    done = load_checkpoint(checkpoint_file)
+    jobs = []
+    missing = skipped = 0
+    for record in active_df[["id", "name", "member_code", "image"]].itertuples(index=False):
+        row = {"id": str(record.id), "name": str(record.name),
+               "member_code": str(record.member_code), "image": str(record.image)}
+        if row["id"] in done:
+            skipped += 1
+            continue
+        image_path = image_index.get(row["image"])
+        if image_path is None:
+            print(f"  ❌ WARNING: Image for '{row['image']}' not found with any extension. Skipping {row['name']}.")
+            missing += 1
             continue
-            
+        jobs.append((row, image_path))
+    if skipped:
+        print(f"⏩ Skipping {skipped} members already uploaded (checkpoint '{checkpoint_file}').")
+    print(f"🚀 Uploading {len(jobs)} members with concurrency {concurrency}...")
+
+    checkpoint = Checkpoint(checkpoint_file)
+    session = make_session(concurrency)
+    latencies: List[float] = []
+    failures: List[Tuple[dict, str]] = []
+    succeeded = retried = 0
+    started = time.perf_counter()
+    futures = {}
+    handled = set()
+
+    def record(future):
+        nonlocal succeeded, retried
+        handled.add(future)
+        n = len(handled)
+        row = futures[future]
         try:
-            with open(local_image_path, 'rb') as f:
-                image_content = f.read()
+            ok, message, latency, attempts = future.result()
         except Exception as e:
-            print(f"  ❌ WARNING: Could not read image file. Error: {e}")
-            continue
+            ok, message, latency, attempts = False, f"{type(e).__name__}: {e}", 0.0, 1
+        latencies.append(latency)
+        retried += attempts > 1
+        if ok:
+            succeeded += 1
+            checkpoint.mark(row["id"])
+            print(f"  ✅ [{n}/{len(jobs)}] {row['name']} (ID: {row['id']}): {message}")
+        else:
+            failures.append((row, message))
+            print(f"  ❌ [{n}/{len(jobs)}] FAILED {row['name']} (ID: {row['id']}): {message}")
 
-        # --- Prepare the data for the API request ---
-        payload = {
-            'id': employee_id,
-            'name': name,
-            'member_code': member_code
-        }
-        
-        files = {
-            'pictures': (image_filename, image_content, 'image/jpeg')
-        }
-
-        # --- Send the POST request to the API ---
+    # not a `with` block: its exit would wait for every queued upload, even after Ctrl+C
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for row, image_path in jobs:
+            futures[pool.submit(upload_one, session, api_url, row, image_path, max_retries, timeout)] = row
+        for future in as_completed(futures):
+            record(future)
+    except KeyboardInterrupt:
+        # drop the queued uploads; the ones already sent are still checkpointed when they finish
+        pool.shutdown(wait=False, cancel_futures=True)
+        in_flight = [f for f in futures if f not in handled and not f.cancelled()]
+        print(f"\n⚠️ Interrupted; waiting for {len(in_flight)} uploads in flight (Ctrl+C again to stop now)...")
         try:
-            print(f"  🚀 Uploading data for {name}...")
-            upload_response = requests.post(API_URL, data=payload, files=files, timeout=60)
-            upload_response.raise_for_status()
-            
-            print(f"  ✅ SUCCESS! Server response: {upload_response.json().get('MESSAGE')}")
-
-        except requests.exceptions.RequestException as e:
-            print(f"  ❌ FAILED to upload data for {name}. Error: {e}")
-            if e.response is not None:
-                print(f"  Server details: {e.response.text}")
-        
-        time.sleep(0.5) # A small delay to avoid overwhelming the server
+            for future in as_completed(in_flight):
+                record(future)
+        except KeyboardInterrupt:
+            pass
+        print("Re-run to resume from the checkpoint.")
+        raise
+    finally:
+        pool.shutdown(wait=False)
+        checkpoint.close()
+        session.close()
 
+    elapsed = time.perf_counter() - started
+    print("\n--- Summary ---")
+    print(f"Uploaded:  {succeeded}")
+    print(f"Failed:    {len(failures)}")
+    print(f"No image:  {missing}")
+    print(f"Skipped:   {skipped} (already in checkpoint)")
+    print(f"Retried:   {retried}")
+    if jobs:
+        print(f"Elapsed:   {elapsed:.1f}s ({len(jobs) / max(elapsed, 1e-9):.2f} uploads/s)")
+        print(f"Latency:   p50 {_percentile(latencies, 0.5) * 1000:.0f} ms, "
+              f"p95 {_percentile(latencies, 0.95) * 1000:.0f} ms, "
+              f"max {max(latencies, default=0.0) * 1000:.0f} ms")
+    for row, message in failures:
+        print(f"  - {row['id']} {row['name']}: {message}")
     print("\n--- Script finished ---")
 
 
 if __name__ == "__main__":
-    upload_all_employees()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Upload active members' photos to the face recognition API.")
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--data-file", default=DATA_FILE)
+    parser.add_argument("--images", default=IMAGE_FOLDER_PATH, help="folder with the member photos")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="parallel uploads; match it to the server's capacity")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="seconds per request")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--restart", action="store_true", help="ignore and clear the checkpoint")
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    upload_all_employees(
+        api_url=args.api_url, data_file=args.data_file, image_folder=args.images,
+        concurrency=max(1, args.concurrency), checkpoint_file=args.checkpoint,
+        max_retries=max(0, args.retries), timeout=args.timeout
+    )
@@ -0,0 +1,126 @@
+# tests/test_ann.py
+
+import numpy as np
+
+from app.ann import FrozenIVFIndex, IVFIndex, evaluate_recall
+
+
+def unit(rng, n, dim=512):
+    x = rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def noisy_copies(rng, rows, noise=0.5):
+    """Queries near the given rows, as a probe photo of an enrolled employee would be."""
+    queries = rows + noise * unit(rng, len(rows))
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def built_index(rng, n, **kwargs):
+    embeddings = unit(rng, n)
+    index = IVFIndex(**kwargs)
+    index.build(embeddings)
+    return index, embeddings
+
+
+def test_recall_at_1_against_exact_search_with_the_default_nprobe():
+    rng = np.random.default_rng(0)
+    index, embeddings = built_index(rng, 2000)
+    queries = noisy_copies(rng, embeddings[rng.integers(0, 2000, 200)])
+
+    report = evaluate_recall(index, embeddings, queries)
+
+    assert report["nprobe"] == 8
+    assert report["recall"] >= 0.95
+
+
+def test_search_scores_are_exact_cosines():
+    rng = np.random.default_rng(1)
+    index, embeddings = built_index(rng, 500)
+    queries = noisy_copies(rng, embeddings[:20])
+
+    idx, scores = index.search(queries, embeddings, k=3)
+
+    assert np.allclose(scores, np.einsum("fkd,fd->fk", embeddings[idx], queries), atol=1e-5)
+    assert (np.diff(scores, axis=1) <= 0).all()
+
+
+def test_add_makes_a_new_row_findable():
+    rng = np.random.default_rng(2)
+    index, embeddings = built_index(rng, 300)
+    embeddings = np.concatenate([embeddings, unit(rng, 1)])
+
+    index.add(300, embeddings[300])
+
+    assert len(index) == 301
+    idx, _ = index.search(noisy_copies(rng, embeddings[300:]), embeddings)
+    assert idx[0, 0] == 300
+
+
+def test_remove_drops_the_row_from_every_result():
+    rng = np.random.default_rng(3)
+    index, embeddings = built_index(rng, 300)
+
+    index.remove(42)
+    index.remove(42)  # already gone: a no-op
+
+    assert len(index) == 299 and 42 not in index._assignment
+    idx, _ = index.search(embeddings[40:45], embeddings, k=5)
+    assert 42 not in idx
+    assert idx[0, 0] == 40 and idx[4, 0] == 44
+
+
+def test_relabel_follows_a_moved_row():
+    rng = np.random.default_rng(4)
+    index, embeddings = built_index(rng, 300)
+    moved_label = index._assignment[299]
+
+    # swap-remove: the last row moves into slot 7
+    index.remove(7)
+    embeddings[7] = embeddings[299]
+    index.relabel(299, 7)
+    embeddings = embeddings[:299]
+
+    assert len(index) == 299 and 299 not in index._assignment
+    assert index._assignment[7] == index.labels(299)[7] == moved_label
+    idx, _ = index.search(embeddings[7:8], embeddings)
+    assert idx[0, 0] == 7
+    index.relabel(299, 5)  # no longer indexed: a no-op
+    assert len(index) == 299 and 299 not in index._assignment
+
+
+def test_frozen_snapshot_agrees_with_the_live_index():
+    rng = np.random.default_rng(5)
+    index, embeddings = built_index(rng, 800)
+    embeddings = np.concatenate([embeddings, unit(rng, 20)])
+    for row in range(800, 820):
+        index.add(row, embeddings[row])
+    for row in rng.choice(800, 30, replace=False).tolist():
+        index.remove(row)
+    index.update(3, embeddings[3])
+    queries = noisy_copies(rng, embeddings[rng.integers(0, 820, 100)])
+
+    frozen = index.freeze()
+    live_idx, live_scores = index.search(queries, embeddings, k=5)
+    frozen_idx, frozen_scores = frozen.search(queries, embeddings, k=5)
+
+    assert np.array_equal(live_idx, frozen_idx) and np.array_equal(live_scores, frozen_scores)
+
+    # later mutations of the live index never reach the snapshot
+    for row in live_idx[:, 0].tolist():
+        index.remove(row)
+    assert np.array_equal(frozen.search(queries, embeddings, k=5)[0], frozen_idx)
+
+
+def test_restored_indexes_search_like_the_original():
+    rng = np.random.default_rng(6)
+    index, embeddings = built_index(rng, 400)
+    labels = index.labels(400)
+    queries = noisy_copies(rng, embeddings[:50])
+    expected = index.search(queries, embeddings, k=3)[0]
+
+    restored = IVFIndex.restore(index.centroids, labels, index.trained_size, nprobe=index.nprobe)
+    frozen = FrozenIVFIndex.from_labels(index.centroids, labels, index.nprobe)
+
+    assert np.array_equal(restored.search(queries, embeddings, k=3)[0], expected)
+    assert np.array_equal(frozen.search(queries, embeddings, k=3)[0], expected)
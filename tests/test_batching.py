@@ -0,0 +1,119 @@
+# tests/test_batching.py
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app import batching
+from app.batching import InferenceBatcher
+
+
+def faces(*values):
+    """(F,3,112,112) batch whose i-th face is filled with values[i]."""
+    return np.stack([np.full((3, 112, 112), v, dtype=np.float32) for v in values])
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """Stub ArcFace: face i embeds to a vector filled with its pixel value; records batch sizes."""
+    batches = []
+
+    def run_embedding_model(batch):
+        batches.append(len(batch))
+        return [np.full(512, face[0, 0, 0], dtype=np.float32) for face in batch]
+
+    monkeypatch.setattr(batching, "run_embedding_model", run_embedding_model)
+    return batches
+
+
+async def embed_with(batcher, *requests):
+    await batcher.start()
+    try:
+        return await asyncio.gather(*(batcher.embed(faces(*values)) for values in requests))
+    finally:
+        await batcher.stop()
+
+
+def values_of(results):
+    return [[float(emb[0]) for emb in embs] for embs in results]
+
+
+def test_a_full_batch_flushes_without_waiting(model):
+    batcher = InferenceBatcher(max_batch_size=4, max_wait_ms=10_000)
+
+    started = time.perf_counter()
+    results = asyncio.run(embed_with(batcher, range(8)))
+
+    assert time.perf_counter() - started < 5.0
+    assert model == [4, 4]
+    assert values_of(results) == [list(map(float, range(8)))]
+
+
+def test_a_partial_batch_flushes_after_max_wait(model):
+    batcher = InferenceBatcher(max_batch_size=32, max_wait_ms=50)
+
+    started = time.perf_counter()
+    results = asyncio.run(embed_with(batcher, [1, 2, 3]))
+
+    assert time.perf_counter() - started >= 0.05
+    assert model == [3]
+    assert values_of(results) == [[1.0, 2.0, 3.0]]
+
+
+def test_results_reach_the_request_that_sent_each_face(model):
+    batcher = InferenceBatcher(max_batch_size=5, max_wait_ms=20)
+    requests = [[1, 2], [3], [4, 5, 6], [7, 8, 9, 10]]
+
+    results = asyncio.run(embed_with(batcher, *requests))
+
+    assert values_of(results) == [list(map(float, r)) for r in requests]
+    assert sum(model) == 10 and max(model) <= 5
+
+
+def test_a_failed_batch_yields_none_for_its_faces(monkeypatch):
+    def broken(batch):
+        raise RuntimeError("session lost")
+
+    monkeypatch.setattr(batching, "run_embedding_model", broken)
+    batcher = InferenceBatcher(max_batch_size=4, max_wait_ms=1)
+
+    results = asyncio.run(embed_with(batcher, [1, 2]))
+
+    assert results == [[None, None]]
+    assert batcher.failed_batches == 1
+
+
+def test_stop_fails_queued_and_in_flight_faces(monkeypatch):
+    running, release = threading.Event(), threading.Event()
+
+    def blocking(batch):
+        running.set()
+        release.wait(10)
+        return [np.zeros(512, dtype=np.float32) for _ in batch]
+
+    monkeypatch.setattr(batching, "run_embedding_model", blocking)
+    batcher = InferenceBatcher(max_batch_size=2, max_wait_ms=1)
+
+    async def scenario():
+        await batcher.start()
+        requests = [asyncio.create_task(batcher.embed(faces(v))) for v in range(5)]
+        while not running.is_set():
+            await asyncio.sleep(0.001)
+        assert len(batcher._in_flight) == 2 and batcher._queue.qsize() == 3
+
+        await batcher.stop()
+        release.set()
+        return await asyncio.gather(*requests, return_exceptions=True)
+
+    outcomes = asyncio.run(scenario())
+
+    assert all(isinstance(o, RuntimeError) and "stopped" in str(o) for o in outcomes)
+    assert not batcher.running
+
+
+def test_embed_refuses_when_not_running():
+    with pytest.raises(RuntimeError):
+        asyncio.run(InferenceBatcher().embed(faces(1)))
@@ -0,0 +1,103 @@
+# tests/test_cache.py
+
+import numpy as np
+import pytest
+
+from app.ai_processing import match_embeddings
+from app.cache import EmbeddingCache
+from app.config import settings
+from app.shared_gallery import SharedGallery
+from app.templates import DEAD_RANK
+
+
+def unit(rng, n, dim=512):
+    x = rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def make_cache(mode, tmp_path, monkeypatch):
+    if mode == "ann":
+        monkeypatch.setattr(settings, "ANN_ENABLED", True)
+        monkeypatch.setattr(settings, "ANN_MIN_SIZE", 30)
+    shared = SharedGallery(str(tmp_path / "shared")) if mode == "shared" else None
+    cache = EmbeddingCache(publish_delay_ms=0, precision="int8" if mode == "int8" else "float32", shared=shared)
+    cache.COMPACT_MIN_DEAD = 8  # compact often
+    return cache
+
+
+def check_working_state(cache):
+    """Owner / rank / per-slot row bookkeeping of the writer's working store."""
+    size = cache._size
+    owners, ranks = cache._owner[:size], cache._rank[:size]
+    assert (owners < 0).sum() == cache._dead == (ranks == DEAD_RANK).sum()
+    for slot, rows in enumerate(cache._rows_of):
+        assert owners[rows].tolist() == [slot] * len(rows)
+        assert ranks[rows].tolist() == list(range(len(rows)))
+    assert sum(map(len, cache._rows_of)) == size - cache._dead
+    if cache.index is not None:
+        assert sorted(cache.index._assignment) == np.flatnonzero(owners >= 0).tolist()
+
+
+def check_snapshot(snap, reference):
+    assert set(snap.ids) == set(reference)
+    owners = snap.owners.owners if snap.owners is not None else np.arange(len(snap.ids))
+    assert len(owners) == len(snap.embeddings)
+    assert (owners >= 0).sum() == snap.templates == sum(len(t) for t in reference.values())
+    embeddings = np.asarray(snap.embeddings)
+    for slot, emp_id in enumerate(snap.ids):
+        rows = embeddings[owners == slot]
+        assert np.allclose(np.sort(rows, axis=0), np.sort(reference[emp_id], axis=0), atol=1e-6), emp_id
+
+
+def check_matches(rng, snap, reference):
+    """Best matches of noisy copies of stored templates against a brute-force scan."""
+    queried = list(reference)[:5]
+    queries = np.stack([reference[e][int(rng.integers(0, len(reference[e])))] for e in queried])
+    queries = queries + 0.02 * unit(rng, len(queries))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+    for query, result in zip(queries, match_embeddings(queries, snap, snap.index)):
+        best = max(reference, key=lambda e: float((reference[e] @ query).max()))
+        assert result["employee_id"] == best
+        assert result["score"] == pytest.approx(float((reference[best] @ query).max()), abs=1e-4)
+
+
+@pytest.mark.parametrize("mode", ["float32", "int8", "ann", "shared"])
+def test_random_mutations_match_a_reference(mode, tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    cache = make_cache(mode, tmp_path, monkeypatch)
+    ids = [f"e{i}" for i in range(60)]
+    reference = {emp_id: unit(rng, int(rng.integers(1, 4))) for emp_id in ids[:40]}
+    owners = np.repeat(np.arange(len(reference)), [len(t) for t in reference.values()])
+    cache.update(list(reference), np.concatenate(list(reference.values())), list(reference), list(reference), owners)
+
+    held = []
+    for step in range(300):
+        emp_id = ids[int(rng.integers(0, len(ids)))]
+        if rng.random() < 0.35 and emp_id in reference:
+            assert cache.remove_employee(emp_id)
+            del reference[emp_id]
+        else:
+            templates = unit(rng, int(rng.integers(1, 5)))
+            # a single template may also arrive as a plain (512,) embedding
+            cache.update_or_add_employee(emp_id, emp_id, emp_id, templates[0] if len(templates) == 1 else templates)
+            reference[emp_id] = templates
+
+        snap = cache.snapshot()
+        check_snapshot(snap, reference)
+        if mode != "shared":
+            check_working_state(cache)
+        if step % 10 == 0 and reference:
+            check_matches(rng, snap, reference)
+        if step % 37 == 0:
+            held.append((snap, np.array(snap.embeddings)))
+
+    # published snapshots never change under later mutations
+    for snap, embeddings in held:
+        assert np.array_equal(np.asarray(snap.embeddings), embeddings)
+
+
+def test_removing_an_unknown_employee_is_a_no_op(tmp_path, monkeypatch):
+    cache = make_cache("float32", tmp_path, monkeypatch)
+    cache.update(["a"], unit(np.random.default_rng(1), 1), ["a"], ["a"])
+    assert not cache.remove_employee("missing")
+    assert list(cache.snapshot().ids) == ["a"]
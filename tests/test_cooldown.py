@@ -0,0 +1,87 @@
+# tests/test_cooldown.py
+
+import pytest
+
+from app.cooldown import MemoryCooldownStore, SQLiteCooldownStore, build_cooldown_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(ttl=60.0, max_entries=100):
+        if request.param == "sqlite":
+            return SQLiteCooldownStore(str(tmp_path / "cooldown.db"), ttl, max_entries, sweep_every=1)
+        return MemoryCooldownStore(ttl, max_entries)
+    return make
+
+
+def test_a_key_is_let_through_once_per_window(make_store):
+    store = make_store(ttl=60)
+    assert store.check_and_set("a", now=1000.0)
+    assert not store.check_and_set("a", now=1030.0)
+    assert store.check_and_set("b", now=1030.0)
+    assert (store.checks, store.hits) == (3, 1)
+
+
+def test_a_window_expires_after_ttl(make_store):
+    store = make_store(ttl=60)
+    assert store.check_and_set("a", now=1000.0)
+    assert not store.check_and_set("a", now=1059.9)
+    assert store.check_and_set("a", now=1060.0)
+    assert not store.check_and_set("a", now=1061.0)
+
+
+def test_expired_entries_are_dropped(make_store):
+    store = make_store(ttl=60)
+    for i, key in enumerate("abc"):
+        store.check_and_set(key, now=1000.0 + i)
+    store.check_and_set("d", now=1061.5)  # a and b have expired
+    assert len(store) == 2 and store.expired == 2
+
+
+def test_the_oldest_entries_are_evicted_at_max_entries(make_store):
+    store = make_store(ttl=60, max_entries=3)
+    for i, key in enumerate("abcd"):
+        assert store.check_and_set(key, now=1000.0 + i)
+
+    assert len(store) == 3 and store.evicted == 1
+    assert store.check_and_set("a", now=1010.0)  # evicted, so no longer cooling down
+    assert not store.check_and_set("d", now=1010.0)
+
+
+def test_release_reopens_the_window(make_store):
+    store = make_store(ttl=60)
+    assert store.check_and_set("a", now=1000.0)
+    store.release("a")
+    store.release("missing")  # unknown keys are ignored
+    assert store.check_and_set("a", now=1001.0)
+    assert not store.check_and_set("a", now=1002.0)
+
+
+def test_stats_report_the_backend_and_counters(make_store):
+    store = make_store(ttl=60, max_entries=5)
+    store.check_and_set("a", now=1000.0)
+    store.check_and_set("a", now=1001.0)
+    stats = store.stats()
+    assert stats["backend"] == store.name and stats["entries"] == 1
+    assert (stats["checks"], stats["hits"], stats["max_entries"]) == (2, 1, 5)
+
+
+def test_sqlite_workers_share_one_window(tmp_path):
+    path = str(tmp_path / "cooldown.db")
+    first, second = SQLiteCooldownStore(path, ttl=60), SQLiteCooldownStore(path, ttl=60)
+
+    # the UPSERT only overwrites an expired row: one caller wins the window
+    assert [first.check_and_set("a", now=1000.0), second.check_and_set("a", now=1000.5)] == [True, False]
+    assert not first.check_and_set("a", now=1001.0)
+    assert second.check_and_set("a", now=1060.0)
+    assert not first.check_and_set("a", now=1061.0)
+
+
+def test_sqlite_store_creates_its_directory(tmp_path):
+    store = SQLiteCooldownStore(str(tmp_path / "data" / "cooldown.db"))
+    assert store.check_and_set("a") and len(store) == 1
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        build_cooldown_store("redis")
@@ -0,0 +1,88 @@
+# tests/test_detection_resolution.py
+
+import cv2
+import numpy as np
+import pytest
+
+from app import ai_processing
+from app.ai_processing import decode_for_detection, decode_full, detect_faces_capped, remap_faces
+
+# a 4000x3000 photo with a bright 800x600 "face" at (1600, 900)
+WIDTH, HEIGHT = 4000, 3000
+BOX = [1600, 900, 800, 600]
+
+
+def photo(width=WIDTH, height=HEIGHT, box=BOX, ext=".jpg"):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    x, y, w, h = box
+    image[y:y + h, x:x + w] = 255
+    ok, data = cv2.imencode(ext, image)
+    assert ok
+    return data.tobytes()
+
+
+def find_rectangle(image_bgr):
+    """Stand-in detector: the bounding box of the bright pixels, with its corners as keypoints."""
+    ys, xs = np.nonzero(image_bgr[:, :, 0] > 127)
+    x, y = int(xs.min()), int(ys.min())
+    w, h = int(xs.max()) + 1 - x, int(ys.max()) + 1 - y
+    return [{"box": [x, y, w, h], "keypoints": {"left_eye": (x, y), "right_eye": (x + w, y + h)}}]
+
+
+@pytest.mark.parametrize("max_side, scale", [(500, 8.0), (400, 10.0), (1600, 2.5)])
+def test_a_box_found_on_the_reduced_decode_maps_back_to_full_resolution(max_side, scale):
+    data = photo()
+
+    frame = decode_for_detection(data, max_side)
+
+    assert frame.full is None  # decoded reduced, full resolution left for later
+    assert max(frame.image.shape[:2]) == max_side
+    assert frame.scale_x == pytest.approx(scale) and frame.scale_y == pytest.approx(scale)
+
+    face, = remap_faces(find_rectangle(frame.image), frame.scale_x, frame.scale_y)
+    assert np.allclose(face["box"], BOX, atol=2 * scale)
+    x, y, w, h = BOX
+    assert np.allclose(face["keypoints"]["left_eye"], (x, y), atol=2 * scale)
+    assert np.allclose(face["keypoints"]["right_eye"], (x + w, y + h), atol=2 * scale)
+    assert decode_full(data, frame).shape == (HEIGHT, WIDTH, 3)
+
+
+def test_a_portrait_photo_keeps_its_axes():
+    box = [900, 1600, 600, 800]
+    frame = decode_for_detection(photo(WIDTH // 4 * 3, HEIGHT // 3 * 4, box), 500)
+
+    assert frame.image.shape[:2] == (500, 375)
+    face, = remap_faces(find_rectangle(frame.image), frame.scale_x, frame.scale_y)
+    assert np.allclose(face["box"], box, atol=16)
+
+
+@pytest.mark.parametrize("max_side", [0, 1280])
+def test_small_images_and_no_cap_skip_reduction(max_side):
+    box = [200, 150, 160, 120]
+    data = photo(640, 480, box)
+
+    frame = decode_for_detection(data, max_side)
+
+    assert frame.full is not None and frame.image is frame.full
+    assert (frame.scale_x, frame.scale_y) == (1.0, 1.0)
+    assert remap_faces(find_rectangle(frame.image), 1.0, 1.0)[0]["box"] == box
+
+
+def test_undecodable_bytes_give_none():
+    assert decode_for_detection(b"\xff\xd8not really a jpeg", 500) is None
+
+
+def test_capped_detection_passes_the_scale_and_maps_boxes_back(monkeypatch):
+    seen = []
+
+    def detect(image_bgr, scale=1.0):
+        seen.append((image_bgr.shape[:2], scale))
+        return find_rectangle(image_bgr)
+
+    monkeypatch.setattr(ai_processing, "detect_faces_with_fallback", detect)
+    full = cv2.imdecode(np.frombuffer(photo(), np.uint8), cv2.IMREAD_COLOR)
+
+    face, = detect_faces_capped(full, ai_processing.downscale_for_detection(full, 800))
+
+    assert seen == [((600, 800), 5.0)]
+    assert np.allclose(face["box"], BOX, atol=10)
@@ -0,0 +1,146 @@
+# tests/test_gallery_snapshot.py
+
+import asyncio
+import multiprocessing as mp
+from datetime import datetime
+
+import numpy as np
+
+from app import crud, gallery_snapshot
+from app.gallery_snapshot import GalleryData, drop_unchanged, load_snapshot, merge_changes, save_snapshot
+
+
+def unit(rng, n, dim=512):
+    x = rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def gallery(templates: dict, watermark=None) -> GalleryData:
+    """GalleryData for {id: (k,512) templates}; owners only when someone has more than one."""
+    ids = list(templates)
+    counts = [len(t) for t in templates.values()]
+    owners = np.repeat(np.arange(len(ids)), counts).astype(np.int32) if any(c > 1 for c in counts) else None
+    return GalleryData([f"name-{i}" for i in ids], np.concatenate(list(templates.values())), ids,
+                       [f"code-{i}" for i in ids], watermark, owners)
+
+
+def as_dict(data: GalleryData) -> dict:
+    owners = data.owners if data.owners is not None else np.arange(len(data.ids))
+    embeddings = np.asarray(data.embeddings)
+    return {emp_id: embeddings[owners == slot] for slot, emp_id in enumerate(data.ids)}
+
+
+def changes(data: GalleryData):
+    return data.names, data.embeddings, data.ids, data.member_codes, data.owners
+
+
+def assert_same(got: dict, expected: dict):
+    assert set(got) == set(expected)
+    for emp_id, templates in expected.items():
+        assert np.array_equal(got[emp_id], templates), emp_id
+
+
+def test_merge_changes_with_owners():
+    rng = np.random.default_rng(0)
+    base = {"a": unit(rng, 2), "b": unit(rng, 1), "c": unit(rng, 3), "d": unit(rng, 1)}
+    changed = {"b": unit(rng, 3), "e": unit(rng, 2)}
+    watermark = datetime(2026, 1, 2)
+
+    merged = merge_changes(gallery(base), changes(gallery(changed)), ["a", "b", "c", "e"], watermark)
+
+    assert_same(as_dict(merged), {"a": base["a"], "b": changed["b"], "c": base["c"], "e": changed["e"]})
+    assert merged.watermark == watermark
+    assert merged.names[merged.ids.index("e")] == "name-e"
+
+
+def test_merge_changes_without_changes_keeps_the_base_matrix():
+    rng = np.random.default_rng(1)
+    base = gallery({"a": unit(rng, 1), "b": unit(rng, 1)})
+    nothing = ([], np.empty((0, 512), dtype=np.float32), [], [], None)
+    merged = merge_changes(base, nothing, ["a", "b"], datetime(2026, 1, 2))
+    assert merged.embeddings is base.embeddings
+
+
+def test_merge_changes_back_to_one_template_each_drops_owners():
+    rng = np.random.default_rng(2)
+    base = {"a": unit(rng, 1), "b": unit(rng, 2)}
+    changed = {"b": unit(rng, 1)}
+    merged = merge_changes(gallery(base), changes(gallery(changed)), ["a", "b"], None)
+    assert merged.owners is None
+    assert_same(as_dict(merged), {"a": base["a"], "b": changed["b"]})
+
+
+def test_drop_unchanged_leaves_out_rows_identical_to_the_snapshot():
+    rng = np.random.default_rng(3)
+    base = {"a": unit(rng, 2), "b": unit(rng, 1), "c": unit(rng, 2)}
+    # re-read because of the watermark margin: a and c are unchanged, b got a template, d is new
+    reread = {"a": base["a"], "b": unit(rng, 2), "c": base["c"], "d": unit(rng, 1)}
+
+    kept = drop_unchanged(gallery(base), changes(gallery(reread)))
+
+    names, embeddings, ids, codes, owners = kept
+    assert ids == ["b", "d"] and names == ["name-b", "name-d"] and codes == ["code-b", "code-d"]
+    assert_same(as_dict(GalleryData(names, embeddings, ids, codes, None, owners)),
+                {"b": reread["b"], "d": reread["d"]})
+
+
+def test_drop_unchanged_keeps_a_renamed_employee():
+    rng = np.random.default_rng(4)
+    base = gallery({"a": unit(rng, 1)})
+    reread = gallery({"a": base.embeddings})._replace(names=["renamed"])
+    assert drop_unchanged(base, changes(reread))[2] == ["a"]
+
+
+def test_save_and_load_round_trip(tmp_path):
+    rng = np.random.default_rng(5)
+    directory = str(tmp_path)
+    first = gallery({"a": unit(rng, 2), "b": unit(rng, 1)}, datetime(2026, 1, 1))
+    second = gallery({"a": unit(rng, 1), "c": unit(rng, 3)}, datetime(2026, 1, 2))
+
+    save_snapshot(directory, first)
+    save_snapshot(directory, second)
+    loaded = load_snapshot(directory)
+
+    assert loaded.ids == second.ids and loaded.watermark == second.watermark
+    assert_same(as_dict(loaded), as_dict(second))
+
+
+def _save_repeatedly(directory, seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(5):
+        save_snapshot(directory, gallery({"a": unit(rng, 2), "b": unit(rng, 1)}, datetime(2026, 1, 1)))
+
+
+def test_workers_saving_at_once_do_not_collide(tmp_path):
+    directory = str(tmp_path)
+    workers = [mp.get_context("fork").Process(target=_save_repeatedly, args=(directory, seed)) for seed in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert [worker.exitcode for worker in workers] == [0, 0, 0, 0]
+    loaded = load_snapshot(directory)
+    assert loaded is not None and loaded.ids == ["a", "b"] and len(loaded.embeddings) == 3
+
+
+def test_a_failed_snapshot_write_still_returns_the_gallery(tmp_path, monkeypatch):
+    rng = np.random.default_rng(6)
+    data = gallery({"a": unit(rng, 1), "b": unit(rng, 2)}, datetime(2026, 1, 1))
+
+    async def watermark(db):
+        return data.watermark
+
+    async def load_all(db):
+        return changes(data)
+
+    def fail(directory, data):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(crud, "get_embeddings_watermark", watermark)
+    monkeypatch.setattr(crud, "load_all_embeddings", load_all)
+    monkeypatch.setattr(gallery_snapshot, "save_snapshot", fail)
+
+    loaded = asyncio.run(gallery_snapshot.load_gallery(None, str(tmp_path)))
+
+    assert loaded.ids == data.ids
@@ -0,0 +1,85 @@
+# tests/test_templates.py
+
+import numpy as np
+import pytest
+
+from app.templates import DEAD_RANK, TemplateOwners, merge_templates, prune_templates
+
+
+def unit(rng, n, dim=512):
+    x = rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def random_layout(rng, n_owners, dead):
+    """Rows of n_owners employees (1-4 templates each) plus `dead` dead rows, shuffled."""
+    owners, ranks = [], []
+    for owner in range(n_owners):
+        k = int(rng.integers(1, 5))
+        owners += [owner] * k
+        ranks += list(range(k))
+    owners += [-1] * dead
+    ranks += [DEAD_RANK] * dead
+    order = rng.permutation(len(owners))
+    return np.asarray(owners, dtype=np.int32)[order], np.asarray(ranks, dtype=np.uint8)[order]
+
+
+@pytest.mark.parametrize("dead", [0, 7])
+def test_max_per_owner_matches_brute_force(dead):
+    rng = np.random.default_rng(dead)
+    owners, ranks = random_layout(rng, 50, dead)
+    layout = TemplateOwners.build(owners, ranks, 50)
+    sims = rng.standard_normal((6, len(owners))).astype(np.float32)
+
+    best = layout.max_per_owner(sims)
+
+    expected = np.stack([sims[:, owners == owner].max(axis=1) for owner in range(50)], axis=1)
+    assert np.array_equal(best, expected)
+    assert layout.dead is None if dead == 0 else sorted(layout.dead) == sorted(np.flatnonzero(owners < 0))
+
+
+def test_build_returns_none_for_a_plain_gallery():
+    assert TemplateOwners.build(np.arange(5), np.zeros(5), 5) is None
+
+
+def test_owner_of_keeps_missing_and_dead_rows_at_minus_one():
+    layout = TemplateOwners.build(np.array([1, -1, 0, 1]), np.array([0, DEAD_RANK, 0, 1]), 2)
+    assert layout.owner_of(np.array([0, 1, 2, 3, -1])).tolist() == [1, -1, 0, 1, -1]
+
+
+def test_prune_oldest_keeps_the_newest_rows():
+    templates = unit(np.random.default_rng(0), 6)
+    assert np.array_equal(prune_templates(templates, 4, "oldest"), templates[2:])
+
+
+def test_prune_redundant_drops_the_older_near_duplicate():
+    rng = np.random.default_rng(1)
+    a, b, c = unit(rng, 3)
+    near_a = a + 0.01 * unit(rng, 1)[0]
+    near_a /= np.linalg.norm(near_a)
+    templates = np.stack([a, b, near_a, c])
+
+    kept = prune_templates(templates, 3, "redundant")
+
+    assert np.array_equal(kept, templates[[1, 2, 3]])
+
+
+def test_prune_leaves_sets_within_the_cap_alone():
+    templates = unit(np.random.default_rng(2), 3)
+    assert prune_templates(templates, 3, "redundant") is templates
+
+
+def test_prune_rejects_an_unknown_policy():
+    with pytest.raises(ValueError):
+        prune_templates(unit(np.random.default_rng(3), 4), 2, "newest")
+
+
+def test_merge_appends_then_prunes():
+    rng = np.random.default_rng(4)
+    existing, new = unit(rng, 3), unit(rng, 2)
+
+    merged = merge_templates(existing, new[0], max_templates=5)
+    assert np.array_equal(merged, np.concatenate([existing, new[:1]]))
+
+    merged = merge_templates(existing, new, max_templates=4, policy="oldest")
+    assert np.array_equal(merged, np.concatenate([existing[1:], new]))